@@ -0,0 +1,75 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# time parsing the .toc files of the tests, and of 99 track discs as
+# cdrdao read-toc writes them; run from the top of the source tree
+
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import timeit
+
+from morituri.common import common
+from morituri.image import toc
+
+logging.disable(logging.CRITICAL)
+
+
+def synthesize(path, tracks=99, files=False):
+    """
+    Write a .toc file of a disc of tracks of three minutes, every other
+    one with a pre-gap of two seconds, and with an INDEX 02 in each.
+
+    @param files: whether each track has its own file instead of data.wav
+    """
+    lines = ['CD_DA', '']
+    offset = 0
+    for number in range(1, tracks + 1):
+        lines.extend(['// Track %d' % number, 'TRACK AUDIO', 'NO COPY',
+            'NO PRE_EMPHASIS', 'TWO_CHANNEL_AUDIO'])
+        pregap = number % 2 and 150 or 0
+        length = 3 * 60 * common.FRAMES_PER_SECOND
+        name = files and 'track%02d.wav' % number or 'data.wav'
+        start = not files and offset or 0
+        if number == 1:
+            lines.append('SILENCE 00:00:32')
+        lines.append('FILE "%s" %s %s' % (name,
+            start and common.framesToMSF(start) or '0',
+            common.framesToMSF(pregap + length)))
+        if pregap:
+            lines.append('START %s' % common.framesToMSF(pregap))
+        lines.append('INDEX %s' % common.framesToMSF(length / 2))
+        lines.append('')
+        offset += pregap + length
+
+    handle = open(path, 'w')
+    handle.write('\n'.join(lines))
+    handle.close()
+
+
+def parse(path):
+    t = toc.TocFile(path)
+    t.parse()
+
+
+def time(path, number=20):
+    best = min(timeit.repeat(lambda: parse(path), number=number, repeat=3))
+    print '%-40s %8.3f ms' % (os.path.basename(path), best / number * 1000)
+
+
+directory = tempfile.mkdtemp(suffix=u'.morituri.benchmark')
+try:
+    for path in sorted(glob.glob(u'morituri/test/*.toc')):
+        time(path)
+
+    path = os.path.join(directory, u'99-tracks.toc')
+    synthesize(path)
+    time(path)
+
+    path = os.path.join(directory, u'99-files.toc')
+    synthesize(path, files=True)
+    time(path)
+finally:
+    shutil.rmtree(directory)
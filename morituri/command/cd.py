@@ -21,6 +21,7 @@
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import copy
 import os
 import glob
 import urllib2
@@ -32,8 +33,9 @@ gobject.threads_init()
 
 from morituri.command.basecommand import BaseCommand
 from morituri.common import (
-    accurip, common, config, drive, gstreamer, program, task
+    common, config, drive, gstreamer, program, task
 )
+from morituri.extern.task.task import TaskException
 from morituri.program import cdrdao, cdparanoia, utils
 from morituri.result import result
 
@@ -94,18 +96,39 @@ class _CD(BaseCommand):
         parser.add_argument('-c', '--country',
             action="store", dest="country",
             help="Filter releases by country")
+        parser.add_argument('--refresh-metadata',
+            action="store_true", dest="refresh_metadata",
+            help="Look up the disc in MusicBrainz again instead of using "
+                 "the cached lookup")
 
 
     def do(self):
         self.config = config.Config()
         self.program = program.Program(self.config,
             record=self.options.record,
-            stdout=sys.stdout)
+            stdout=sys.stdout,
+            refresh=self.options.refresh_metadata)
         self.runner = task.SyncRunner()
 
-        # if the device is mounted (data session), unmount it
         #self.device = self.parentCommand.options.device
         self.device = self.options.device
+        ret = self._identifyDisc()
+        if ret:
+            return ret
+
+        self.doCommand()
+
+        if self.options.eject in ('success', 'always'):
+            utils.eject_device(self.device)
+
+    def _identifyDisc(self):
+        """
+        Read the table of contents of the disc in the device, and look up
+        its metadata.
+
+        @returns: -1 if the disc is unknown and may not be ripped
+        """
+        # if the device is mounted (data session), unmount it
         sys.stdout.write('Checking device %s\n' % self.device)
 
         utils.load_device(self.device)
@@ -125,6 +148,25 @@ class _CD(BaseCommand):
         sys.stdout.write("MusicBrainz lookup URL %s\n" %
             self.ittoc.getMusicBrainzSubmitURL())
 
+        # look the disc up while reading the full table
+        self.program.prefetch(self.ittoc, self.mbdiscid,
+            country=self.options.country)
+
+        # FIXME ?????
+        # Hackish fix for broken commit
+        offset = 0
+        info = drive.getDeviceInfo(self.device)
+        if info:
+            try:
+                offset = self.config.getReadOffset(*info)
+            except KeyError:
+                pass
+
+        # now, read the complete index table, which is slower
+        self.itable = self.program.getTable(self.runner,
+            self.ittoc.getCDDBDiscId(),
+            self.ittoc.getMusicBrainzDiscId(), self.device, offset)
+
         self.program.metadata = self.program.getMusicBrainz(self.ittoc,
             self.mbdiscid,
             release=self.options.release_id,
@@ -144,21 +186,6 @@ class _CD(BaseCommand):
                                 "--unknown not passed")
                 return -1
 
-        # FIXME ?????
-        # Hackish fix for broken commit
-        offset = 0
-        info = drive.getDeviceInfo(self.device)
-        if info:
-            try:
-                offset = self.config.getReadOffset(*info)
-            except KeyError:
-                pass
-
-        # now, read the complete index table, which is slower
-        self.itable = self.program.getTable(self.runner,
-            self.ittoc.getCDDBDiscId(),
-            self.ittoc.getMusicBrainzDiscId(), self.device, offset)
-
         assert self.itable.getCDDBDiscId() == self.ittoc.getCDDBDiscId(), \
             "full table's id %s differs from toc id %s" % (
                 self.itable.getCDDBDiscId(), self.ittoc.getCDDBDiscId())
@@ -203,11 +230,6 @@ class _CD(BaseCommand):
                               "This is a hard dependency: if not "
                               "available please install it")
 
-        self.doCommand()
-
-        if self.options.eject in ('success', 'always'):
-            utils.eject_device(self.device)
-
     def doCommand(self):
         pass
 
@@ -223,6 +245,419 @@ class Info(_CD):
     def add_arguments(self):
         _CD.add_arguments(self.parser)
 
+class _TrackRipJob:
+    """
+    I rip a track as a job for L{task.PipelineTask}: the first stage reads
+    and encodes the track, the second stage verifies the encoding.
+
+    @ivar number:      the number of the track, 0 for HTOA
+    @ivar trackResult: the result of the track
+    @type trackResult: L{result.TrackResult}
+    @ivar needsRip:    whether the track needs ripping; if not, the job
+                       is only committed
+    @type needsRip:    bool
+    @ivar paranoia:    whether the next read of the track is done with
+                       paranoia; when ripping burst first, it is only once
+                       a burst read failed
+    @type paranoia:    bool
+    """
+
+    def __init__(self, rip, number, trackResult, needsRip, profile, commit):
+        """
+        @param rip:      the command ripping the disc
+        @type  rip:      L{Rip}
+        @param commit:   called with the track number and whether the track
+                         was ripped, in track order
+        """
+        self._rip = rip
+        self.number = number
+        self.trackResult = trackResult
+        self.needsRip = needsRip
+        self._profile = profile
+        self._commit = commit
+        self._tries = 0
+        self._task = None
+        self._read = False
+        self.paranoia = not rip.options.burst
+        if needsRip:
+            trackResult.burstduration = 0.0
+            trackResult.paranoiaduration = 0.0
+
+    def __repr__(self):
+        return '<_TrackRipJob for track %d>' % self.number
+
+    def setRead(self, t):
+        """
+        Use the track as read along with other tracks, as the first try.
+
+        @type t: L{cdparanoia.DiscTrackRead}
+        """
+        self._task = t
+        self._tries = 1
+        self._read = True
+        self.trackResult.testduration = 0.0
+        self.trackResult.copyduration = 0.0
+        self.addReadDuration(t.testduration + t.copyduration)
+
+    def setReadFailed(self, t=None):
+        """
+        Account for a failed read of the track along with other tracks; the
+        track is ripped on its own, with paranoia.
+
+        @type t: L{cdparanoia.DiscTrackRead} or None
+        """
+        if t is not None and t.copyduration is not None:
+            self.addReadDuration((t.testduration or 0.0) + t.copyduration)
+        self.paranoia = True
+
+    def addReadDuration(self, duration):
+        """
+        Account for the time spent on a read of the track, in the current
+        read mode, when ripping burst first.
+        """
+        if not self._rip.options.burst:
+            return
+
+        if self.paranoia:
+            self.trackResult.paranoiaduration += duration
+        else:
+            self.trackResult.burstduration += duration
+
+    def getFirstTask(self):
+        if not self.needsRip:
+            return None
+
+        if self._read:
+            self._read = False
+            return None
+
+        rip = self._rip
+        trackCount = len(rip.itable.tracks)
+        path = self.trackResult.filename
+
+        self._tries += 1
+        extra = ""
+        if self._tries > 1:
+            extra = " (try %d)" % self._tries
+        else:
+            # we reset durations for test and copy here
+            self.trackResult.testduration = 0.0
+            self.trackResult.copyduration = 0.0
+        if not self.paranoia:
+            extra += " (burst)"
+        rip.write('Ripping track %d of %d%s: %s\n' % (
+            self.number, trackCount, extra,
+            os.path.basename(path).encode('utf-8')))
+        # reads interrupted in an earlier resumable rip resume anyway
+        checkpoint = self.trackResult.checkpoint
+        resumable = rip.options.resumable or bool(checkpoint)
+        if checkpoint and (checkpoint.testframes or checkpoint.copyframes):
+            rip.write('Resuming interrupted reads: test read at %s, '
+                'copy read at %s\n' % (
+                    common.framesToMSF(checkpoint.testframes),
+                    common.framesToMSF(checkpoint.copyframes)))
+        logger.debug('_TrackRipJob: track %d, try %d',
+            self.number, self._tries)
+
+        # burst reads are checked against AccurateRip before reading again
+        responses = None
+        if rip.options.accuraterip_single_read or not self.paranoia:
+            responses = rip.responses
+
+        self._task = rip.program.getRipTrackTask(self.trackResult,
+            offset=rip.offset,
+            device=rip.device,
+            profile=self._profile,
+            taglist=rip.program.getTagList(self.number),
+            overread=rip.options.overread,
+            what='track %d of %d%s' % (self.number, trackCount, extra),
+            verify=False,
+            responses=responses,
+            minConfidence=rip.options.accuraterip_confidence,
+            paranoia=self.paranoia,
+            resumable=resumable,
+            reader=rip.options.reader)
+        return self._task
+
+    def getSecondTask(self):
+        if not self.needsRip:
+            return None
+
+        # reading is done, unless the track was read along with others
+        if isinstance(self._task, cdparanoia.ReadVerifyTrackTask):
+            self.addReadDuration(self._task.duration)
+
+        # verifying is CPU-bound; share the CPUs with the other drives
+        t = self._task.getVerifyTask()
+        if self._rip.pool:
+            t = self._rip.pool.wrap(t)
+        return t
+
+    def retry(self, exception):
+        logger.debug('Got exception %r on try %d', exception, self._tries)
+        if isinstance(self._task, cdparanoia.ReadVerifyTrackTask) and \
+                self._task.exception:
+            self.addReadDuration(self._task.duration or 0.0)
+
+        if not self.paranoia:
+            self._rip.write('Burst read of track %d failed, reading it '
+                'with paranoia\n' % self.number)
+            self.paranoia = True
+
+        if self._tries < MAX_TRIES:
+            return True
+
+        logger.critical('Giving up on track %d after %d times' % (
+            self.number, self._tries))
+        raise RuntimeError(
+            "track can't be ripped. "
+            "Rip attempts number is equal to 'MAX_TRIES'")
+
+    def commit(self):
+        if self.needsRip:
+            self._rip.program.setRipTrackResult(self.trackResult,
+                self._task)
+            if self._rip.options.burst:
+                self.trackResult.strategy = \
+                    self.paranoia and 'paranoia' or 'burst'
+        self._commit(self.number, self.needsRip)
+
+
+class _DiscRipTask(task.LoggableMultiSeparateTask):
+    """
+    I rip the tracks of a disc: first the passes reading runs of
+    consecutive tracks, if any, then the jobs ripping the tracks.
+
+    The tracks a pass could read are handed to their job; the other ones,
+    and all tracks of a pass that failed, are left to be ripped one by one.
+    """
+
+    description = 'Ripping disc'
+
+    def __init__(self, rip, passes, jobs):
+        """
+        @param rip:    the command ripping the disc
+        @type  rip:    L{Rip}
+        @param passes: the task, description and jobs of each pass
+        @type  passes: list of (L{cdparanoia.ReadVerifyDiscTask}, str,
+                       list of L{_TrackRipJob})
+        @param jobs:   the jobs ripping the tracks
+        @type  jobs:   list of L{_TrackRipJob}
+        """
+        task.LoggableMultiSeparateTask.__init__(self)
+        self._rip = rip
+        self._passes = {}
+        for t, what, run in passes:
+            self._passes[t] = (what, run)
+            self.addTask(t)
+        self.addTask(task.PipelineTask(jobs))
+
+    def next(self):
+        t = self.tasks[self._task]
+        if t in self._passes:
+            self._rip.write('Reading %s in one %spass\n' % (
+                self._passes[t][0],
+                self._rip.options.burst and 'burst ' or ''))
+
+        task.LoggableMultiSeparateTask.next(self)
+        self.setDescription(t.description)
+
+    def _readPass(self, t):
+        what, run = self._passes[t]
+        if t.exception:
+            logger.debug('reading %s failed: %s', what, t.exceptionMessage)
+            self._rip.write('Reading %s failed, ripping them one by '
+                'one: %r\n' % (what, t.exception))
+            for job in run:
+                job.setReadFailed()
+            return
+
+        for job, read in zip(run, t.tracks):
+            if read.checksum is None:
+                self._rip.write('Checksums did not match for track '
+                    '%d, ripping it again\n' % job.number)
+                job.setReadFailed(read)
+                continue
+
+            job.setRead(read)
+
+    ### ITaskListener methods
+    def described(self, task, description):
+        self.setDescription(description)
+
+    def stopped(self, taskk):
+        if taskk in self._passes:
+            self._readPass(taskk)
+            # the jobs always come after the passes
+            self.schedule(0, self.next)
+            return
+
+        task.LoggableMultiSeparateTask.stopped(self, taskk)
+
+
+class _DriveTask(task.LoggableMultiSeparateTask):
+    """
+    I rip the disc in a drive, then finish it and eject it, without waiting
+    for the other drives ripping at the same time.
+
+    @ivar ripTask: the task ripping the disc
+    @type ripTask: L{_DiscRipTask}
+    """
+
+    description = 'Ripping disc'
+
+    def __init__(self, rip, ripTask):
+        """
+        @param rip:     the command ripping the disc
+        @type  rip:     L{Rip}
+        @type  ripTask: L{_DiscRipTask}
+        """
+        task.LoggableMultiSeparateTask.__init__(self)
+        self._rip = rip
+        self.ripTask = ripTask
+        self.addTask(ripTask)
+
+    def stop(self):
+        if self.exception:
+            eject = ('failure', 'always')
+        else:
+            eject = ('success', 'always')
+        if self._rip.options.eject in eject:
+            utils.eject_device(self._rip.device)
+
+        task.LoggableMultiSeparateTask.stop(self)
+
+    ### ITaskListener methods
+    def described(self, taskk, description):
+        self.setDescription(description)
+
+    def stopped(self, taskk):
+        if taskk is self.ripTask and not taskk.exception:
+            self._rip.write('Finishing the disc\n')
+            try:
+                self.addTask(self._rip._getFinishTask())
+            except Exception, e:
+                self.setException(e)
+                self.stop()
+                return
+
+        task.LoggableMultiSeparateTask.stopped(self, taskk)
+
+
+class _DrivesTask(task.MultiParallelTask):
+    """
+    I rip the discs in several drives at the same time, describing what
+    each drive does.  A drive failing does not stop the others, and I
+    stop without an exception; check the task of each drive.
+    """
+
+    description = 'Ripping discs'
+
+    def __init__(self, drives):
+        """
+        @param drives: the name of each drive, and the task ripping its disc
+        @type  drives: list of (str, L{_DriveTask})
+        """
+        task.MultiParallelTask.__init__(self)
+        self._names = {}
+        self._descriptions = {}
+        self._stopped = set()
+        for name, t in drives:
+            self._names[t] = name
+            self._descriptions[t] = t.description
+            self.addTask(t)
+
+    def _describe(self):
+        states = []
+        for t in self.tasks:
+            if t.exception:
+                state = 'failed'
+            elif t in self._stopped:
+                state = 'done'
+            else:
+                state = '%s %3d %%' % (self._descriptions[t],
+                    t.progress * 100.0)
+            states.append('%s: %s' % (self._names[t], state))
+        self.setDescription(' | '.join(states))
+
+    ### ITaskListener methods
+    def progressed(self, taskk, value):
+        self._describe()
+        task.MultiParallelTask.progressed(self, taskk, value)
+
+    def described(self, taskk, description):
+        self._descriptions[taskk] = description
+        self._describe()
+
+    def stopped(self, taskk):
+        self._stopped.add(taskk)
+        self._describe()
+        self._running -= 1
+        if not self._running:
+            self.stop()
+
+
+class _FinishDiscTask(task.LoggableMultiSeparateTask):
+    """
+    I verify a ripped disc with AccurateRip, once its cue file is written,
+    and write its log.
+    """
+
+    description = 'Verifying disc'
+
+    def __init__(self, rip, discName, responses):
+        """
+        @param rip:       the command that ripped the disc
+        @type  rip:       L{Rip}
+        @param discName:  the path of the disc files, without extension
+        @type  discName:  unicode
+        @type  responses: list of L{accurip.AccurateRipResponse} or None
+        """
+        task.LoggableMultiSeparateTask.__init__(self)
+        self._rip = rip
+        self._discName = discName
+        self.addTask(rip.program.getVerifyImageTask(responses))
+
+    ### ITaskListener methods
+    def described(self, taskk, description):
+        self.setDescription(description)
+
+    def stopped(self, taskk):
+        if not taskk.exception:
+            try:
+                self._rip._writeLog(self._discName)
+            except Exception, e:
+                self.setException(e)
+                self.stop()
+                return
+
+        task.LoggableMultiSeparateTask.stopped(self, taskk)
+
+
+class _WaitForDiscTask(task.LoggableTask):
+    """
+    I wait until a disc is loaded in a drive.
+    """
+
+    description = 'Waiting for a disc'
+
+    _INTERVAL = 1.0 # seconds between checking the drive
+
+    def __init__(self, device):
+        self._device = device
+
+    def start(self, runner):
+        task.LoggableTask.start(self, runner)
+        self.schedule(0, self._check)
+
+    def _check(self):
+        if drive.hasDisc(self._device):
+            self.stop()
+            return
+
+        self.schedule(self._INTERVAL, self._check)
+
+
 class Rip(_CD):
     summary = "rip CD"
     # see morituri.common.program.Program.getPath for expansion
@@ -239,6 +674,15 @@ Log files will log the path to tracks relative to this directory.
 """ % TEMPLATE_DESCRIPTION
     formatter_class = argparse.ArgumentDefaultsHelpFormatter
 
+    responses = None # AccurateRip responses, fetched before ripping
+    offset = None # sample read offset of the device
+    pool = None # workers shared with the other drives ripping at once
+    _prefix = '' # marks messages with the device, when ripping several
+
+    # what the rips of several discs share; see _copy
+    _SHARED = ('opts', 'prog_name', 'parser', 'options', 'config', 'runner',
+        'pool')
+
     # Requires opts.record
     # Requires opts.device
 
@@ -259,10 +703,12 @@ Log files will log the path to tracks relative to this directory.
         self.parser.add_argument('-L', '--logger',
             action="store", dest="logger", default='morituri',
             help="logger to use (choose from '" + "', '".join(loggers) + "')")
-        # FIXME: get from config
+        # given explicitly or not, see handle_arguments
+        self._defaultOffset = default_offset
         self.parser.add_argument('-o', '--offset',
-            action="store", dest="offset", default=default_offset,
-            help="sample read offset")
+            action="store", dest="offset", default=None,
+            help="sample read offset; defaults to the one configured for "
+                "the device")
         self.parser.add_argument('-x', '--force-overread',
             action="store_true", dest="overread", default=False,
             help="Force overreading into the lead-out portion of the disc. "
@@ -288,6 +734,45 @@ Log files will log the path to tracks relative to this directory.
             action="store_true", dest="unknown",
             help="whether to continue ripping if the CD is unknown",
             default=False)
+        self.parser.add_argument('--accuraterip-single-read',
+            action="store_true", dest="accuraterip_single_read",
+            default=False,
+            help="read tracks only once when they match the AccurateRip "
+                "database; tracks that do not are read twice")
+        self.parser.add_argument('--accuraterip-confidence',
+            action="store", dest="accuraterip_confidence", type=int,
+            default=2,
+            help="lowest AccurateRip confidence accepted for a single read")
+        self.parser.add_argument('--whole-disc',
+            action="store_true", dest="whole_disc", default=False,
+            help="read consecutive tracks in one continuous pass and split "
+                "them afterwards; tracks that fail are ripped one by one")
+        self.parser.add_argument('--burst',
+            action="store_true", dest="burst", default=False,
+            help="read the disc in burst mode first, without paranoia "
+                "checks, and accept tracks that match AccurateRip or read "
+                "the same twice; only tracks that fail are read again with "
+                "paranoia")
+        self.parser.add_argument('--resumable',
+            action="store_true", dest="resumable", default=False,
+            help="keep the audio read so far on disk while ripping, so that "
+                "an interrupted rip resumes where it got instead of reading "
+                "the track again")
+        self.parser.add_argument('--reader',
+            action="store", dest="reader", default='cdparanoia',
+            choices=cdparanoia.BACKENDS,
+            help="what reads the disc: the cdparanoia program, or the "
+                "libcdio-paranoia library in-process (default %(default)s)")
+        self.parser.add_argument('--drives',
+            action="store", dest="drives", nargs='+', metavar='DEVICE',
+            help="rip the discs in all of the given drives at once, each "
+                "with its configured read offset, instead of the one in "
+                "the device")
+        self.parser.add_argument('--loop',
+            action="store_true", dest="loop", default=False,
+            help="keep ripping discs until interrupted: the drive is "
+                "ejected once a disc is read, and the disc is verified "
+                "while the next one is loaded")
 
     def handle_arguments(self):
         self.options.output_directory = os.path.expanduser(self.options.output_directory)
@@ -295,17 +780,36 @@ Log files will log the path to tracks relative to this directory.
         self.options.track_template = self.options.track_template.decode('utf-8')
         self.options.disc_template = self.options.disc_template.decode('utf-8')
 
+        # each drive has its own configured offset
+        if self.options.drives and self.options.offset is not None:
+            raise ValueError("--offset cannot be given with --drives; each "
+                             "drive is ripped with its configured read "
+                             "offset")
         if self.options.offset is None:
+            self.options.offset = self._defaultOffset
+        if self.options.offset is None and not self.options.drives:
             raise ValueError("Drive offset is unconfigured.\n"
                              "Please install pycdio and run 'rip offset "
                              "find' to detect your drive's offset or set it "
                              "manually in the configuration file. It can "
                              "also be specified at runtime using the "
                              "'--offset=value' argument")
-
+        if self.options.offset is not None:
+            self.offset = int(self.options.offset)
+        if self.options.loop and self.options.drives:
+            raise ValueError("--loop rips from the device only, not from "
+                             "several drives")
 
         if self.options.working_directory is not None:
-            self.options.working_directory = os.path.expanduser(self.options.working_directory)
+            # absolute, as each disc ripped changes to it
+            self.options.working_directory = os.path.abspath(
+                os.path.expanduser(self.options.working_directory))
+
+        try:
+            cdparanoia.checkReader(self.options.reader)
+        except common.MissingDependencyException, e:
+            raise ValueError("Reader %s needs %s, which is not installed" % (
+                self.options.reader, e.dependency))
 
         if self.options.logger:
             try:
@@ -316,10 +820,42 @@ Log files will log the path to tracks relative to this directory.
                 raise ValueError(msg)
 
 
+    def do(self):
+        if self.options.loop:
+            return self._doLoop()
+        if self.options.drives:
+            return self._doDrives()
+
+        return _CD.do(self)
+
     def doCommand(self):
+        jobs = self._prepareRip()
+        if jobs is None:
+            return
+
+        # the drive reads the next track while the previous one is verified
+        self.runner.run(self._getRipTask(jobs))
+
+        self._finishRip()
+
+    def write(self, text):
+        """
+        Write a message about the rip, marked with the device when ripping
+        several drives at once.
+        """
+        sys.stdout.write(self._prefix + text)
+
+    def _prepareRip(self):
+        """
+        Create the output directory, and the jobs ripping the tracks.
+
+        @returns: the jobs, or None if the disc was ripped already
+        @rtype:   list of L{_TrackRipJob}
+        """
         # here to avoid import gst eating our options
         from morituri.common import encode
         profile = encode.PROFILES['flac']()
+        self._profile = profile
         self.program.result.profileName = profile.name
         self.program.result.profilePipeline = profile.pipeline
         elementFactory = profile.pipeline.split(' ')[0]
@@ -330,9 +866,11 @@ Log files will log the path to tracks relative to this directory.
 
         self.program.setWorkingDirectory(self.options.working_directory)
         self.program.outdir = self.options.output_directory.decode('utf-8')
-        self.program.result.offset = int(self.options.offset)
+        self.program.result.offset = self.offset
         self.program.result.overread = self.options.overread
         self.program.result.logger = self.options.logger
+        self.program.result.burst = self.options.burst
+        self.program.result.reader = self.options.reader
 
         ### write disc files
         disambiguate = False
@@ -352,7 +890,7 @@ Log files will log the path to tracks relative to this directory.
                     if not disambiguate:
                         disambiguate = True
                         continue
-                    return
+                    return None
                 else:
                     break
 
@@ -361,22 +899,32 @@ Log files will log the path to tracks relative to this directory.
                     dirname.encode('utf-8'))
                 os.makedirs(dirname)
                 break
+        self._disambiguate = disambiguate
 
         # FIXME: say when we're continuing a rip
         # FIXME: disambiguate if the pre-existing rip is different
 
+        # the responses are needed before ripping to read tracks only once
+        if self.options.accuraterip_single_read or self.options.burst:
+            self.responses = self._getAccurateRipResponses()
+
 
         # FIXME: turn this into a method
 
-        def ripIfNotRipped(number):
-            logger.debug('ripIfNotRipped for track %d' % number)
+        def prepareTrack(number):
+            """
+            Get the result for the track, verifying a previous rip.
+
+            @returns: the track result, and whether the track needs ripping
+            """
+            logger.debug('prepareTrack for track %d' % number)
             # we can have a previous result
             trackResult = self.program.result.getTrackResult(number)
             if not trackResult:
                 trackResult = result.TrackResult()
                 self.program.result.tracks.append(trackResult)
             else:
-                logger.debug('ripIfNotRipped have trackresult, path %r' %
+                logger.debug('prepareTrack have trackresult, path %r' %
                     trackResult.filename)
 
             path = self.program.getPath(self.program.outdir,
@@ -384,7 +932,7 @@ Log files will log the path to tracks relative to this directory.
                 self.mbdiscid, number,
                 profile=profile, disambiguate=disambiguate) \
                 + '.' + profile.extension
-            logger.debug('ripIfNotRipped: path %r' % path)
+            logger.debug('prepareTrack: path %r' % path)
             trackResult.number = number
 
             assert type(path) is unicode, "%r is not unicode" % path
@@ -407,55 +955,34 @@ Log files will log the path to tracks relative to this directory.
                     sys.stdout.write('Verification failed, reripping...\n')
                     os.unlink(path)
 
-            if not os.path.exists(path):
-                logger.debug('path %r does not exist, ripping...' % path)
-                tries = 0
-                # we reset durations for test and copy here
-                trackResult.testduration = 0.0
-                trackResult.copyduration = 0.0
-                extra = ""
-                while tries < MAX_TRIES:
-                    tries += 1
-                    if tries > 1:
-                        extra = " (try %d)" % tries
-                    sys.stdout.write('Ripping track %d of %d%s: %s\n' % (
-                        number, len(self.itable.tracks), extra,
-                        os.path.basename(path).encode('utf-8')))
-                    try:
-                        logger.debug('ripIfNotRipped: track %d, try %d',
-                            number, tries)
-                        self.program.ripTrack(self.runner, trackResult,
-                            offset=int(self.options.offset),
-                            device=self.device,
-                            profile=profile,
-                            taglist=self.program.getTagList(number),
-                            overread=self.options.overread,
-                            what='track %d of %d%s' % (
-                                number, len(self.itable.tracks), extra))
-                        break
-                    except Exception, e:
-                        logger.debug('Got exception %r on try %d',
-                            e, tries)
-
-
-                if tries == MAX_TRIES:
-                    logger.critical('Giving up on track %d after %d times' % (
-                        number, tries))
-                    raise RuntimeError(
-                        "track can't be ripped. "
-                        "Rip attempts number is equal to 'MAX_TRIES'")
-                if trackResult.testcrc == trackResult.copycrc:
-                    sys.stdout.write('Checksums match for track %d\n' %
+            return trackResult, not os.path.exists(path)
+
+        def commitTrack(number, ripped):
+            trackResult = self.program.result.getTrackResult(number)
+
+            if ripped:
+                if trackResult.singleRead:
+                    self.write('AccurateRip match for track %d, '
+                        'read once\n' % number)
+                elif trackResult.testcrc == trackResult.copycrc:
+                    self.write('Checksums match for track %d\n' %
                         number)
+                elif trackResult.rereadSegments:
+                    self.write('Checksums match for track %d after '
+                        're-reading %d segments\n' % (
+                            number, trackResult.rereadSegments))
                 else:
-                    sys.stdout.write(
+                    self.write(
                         'ERROR: checksums did not match for track %d\n' %
                         number)
                     raise
 
-                sys.stdout.write('Peak level: {:.2%} \n'.format(trackResult.peak))
+                self.write('Peak level: {:.2%} \n'.format(trackResult.peak))
 
-                sys.stdout.write('Rip quality: {:.2%}\n'.format(trackResult.quality))
+                # unknown if all of the track was resumed from checkpoints
+                if trackResult.quality is not None:
+                    self.write('Rip quality: {:.2%}\n'.format(
+                        trackResult.quality))
 
             # overlay this rip onto the Table
             if number == 0:
@@ -468,7 +995,7 @@ Log files will log the path to tracks relative to this directory.
                     logger.debug('Unlinking %r', trackResult.filename)
                     os.unlink(trackResult.filename)
                     trackResult.filename = None
-                    sys.stdout.write('HTOA discarded, contains digital silence\n')
+                    self.write('HTOA discarded, contains digital silence\n')
                 else:
                     self.itable.setFile(1, 0, trackResult.filename,
                         self.ittoc.getTrackStart(1), number)
@@ -478,19 +1005,23 @@ Log files will log the path to tracks relative to this directory.
 
             self.program.saveRipResult()
 
+        def getJob(number):
+            trackResult, rip = prepareTrack(number)
+            return _TrackRipJob(self, number, trackResult, rip, profile,
+                commitTrack)
+
+        jobs = []
 
         # check for hidden track one audio
-        htoapath = None
-        htoa = self.program.getHTOA()
-        if htoa:
-            start, stop = htoa
+        self._htoa = self.program.getHTOA()
+        if self._htoa:
+            start, stop = self._htoa
             sys.stdout.write(
                 'Found Hidden Track One Audio from frame %d to %d\n' % (
                 start, stop))
 
             # rip it
-            ripIfNotRipped(0)
-            htoapath = self.program.result.tracks[0].filename
+            jobs.append(getJob(0))
 
         for i, track in enumerate(self.itable.tracks):
             # FIXME: rip data tracks differently
@@ -502,7 +1033,31 @@ Log files will log the path to tracks relative to this directory.
                 track.indexes[1].relative = 0
                 continue
 
-            ripIfNotRipped(i + 1)
+            jobs.append(getJob(i + 1))
+
+        return jobs
+
+    def _finishRip(self):
+        """
+        Write the disc files once all tracks are ripped, and verify the
+        disc with AccurateRip.
+        """
+        self.runner.run(self._getFinishTask())
+
+    def _getFinishTask(self):
+        """
+        Write the cue and m3u files of the disc once all tracks are ripped,
+        and get the task verifying the disc with AccurateRip and writing
+        its log.
+
+        @rtype: L{_FinishDiscTask}
+        """
+        profile = self._profile
+        disambiguate = self._disambiguate
+
+        htoapath = None
+        if self._htoa:
+            htoapath = self.program.result.tracks[0].filename
 
         ### write disc files
         discName = self.program.getPath(self.program.outdir,
@@ -547,12 +1102,234 @@ Log files will log the path to tracks relative to this directory.
         handle.close()
 
         # verify using accuraterip
+        responses = self.responses
+        if not self.options.accuraterip_single_read and \
+                not self.options.burst:
+            responses = self._getAccurateRipResponses()
+
+        return _FinishDiscTask(self, discName, responses)
+
+    def _writeLog(self, discName):
+        """
+        Write the log of the disc once it is verified.
+        """
+        self.write("\n".join(
+            self.program.getAccurateRipResults()) + "\n")
+
+        self.program.saveRipResult()
+
+        # write log file
+        self.program.writeLog(discName, self.logger)
+
+    def _getRipTask(self, jobs):
+        """
+        Get the task ripping the tracks of the disc: first in continuous
+        passes, one for each run of consecutive tracks, when ripping the
+        whole disc or burst first, then one by one.
+
+        When ripping burst first, the passes are burst reads, and the
+        tracks that fail them are ripped with paranoia.
+
+        @type jobs: list of L{_TrackRipJob}
+
+        @rtype: L{_DiscRipTask}
+        """
+        passes = []
+
+        # burst first reads the disc in continuous passes too
+        if not self.options.whole_disc and not self.options.burst:
+            return _DiscRipTask(self, passes, jobs)
+
+        runs = []
+        end = None
+        for job in jobs:
+            if not job.needsRip:
+                end = None
+                continue
+
+            start, stop = self.program.getTrackSpan(job.number)
+            if end is None or start != end + 1:
+                runs.append([])
+            runs[-1].append(job)
+            end = stop
+
+        trackCount = len(self.itable.tracks)
+        paranoia = not self.options.burst
+        for run in runs:
+            # nothing to gain for a single track
+            if len(run) < 2:
+                continue
+
+            what = 'tracks %d to %d of %d' % (
+                run[0].number, run[-1].number, trackCount)
+            t = self.program.getRipDiscTask([j.trackResult for j in run],
+                offset=self.offset,
+                device=self.device,
+                profile=self._profile,
+                overread=self.options.overread,
+                what=what,
+                whats=['track %d of %d' % (j.number, trackCount)
+                    for j in run],
+                responses=self.responses,
+                minConfidence=self.options.accuraterip_confidence,
+                paranoia=paranoia,
+                reader=self.options.reader)
+            passes.append((t, what, run))
+
+        return _DiscRipTask(self, passes, jobs)
+
+    def _copy(self, device, offset):
+        """
+        Get a new me to rip the disc in the given device with the given
+        read offset.  Only what all discs share is taken over from me, see
+        L{_SHARED}; everything else starts over for the disc.
+
+        @rtype: L{Rip}
+        """
+        # the arguments were parsed and handled by me already, so do not
+        # construct; start from my shared state only
+        rip = copy.copy(self)
+        rip.__dict__ = dict((name, value)
+            for name, value in self.__dict__.items()
+            if name in self._SHARED)
+        rip.device = device
+        rip.offset = offset
+        rip.program = program.Program(self.config,
+            record=self.options.record,
+            stdout=sys.stdout,
+            refresh=self.options.refresh_metadata)
+        rip.logger = self.logger.__class__()
+        return rip
+
+    def _doLoop(self):
+        """
+        Rip discs one after the other, until interrupted.
+
+        The drive is ejected as soon as the tracks of a disc are ripped;
+        verifying the disc and writing its log go on in the background
+        while the next disc is loaded and read.
+        """
+        self.config = config.Config()
+        self.runner = task.SyncRunner()
+        self.device = self.options.device
+        background = task.BackgroundRunner()
+
+        finishing = []
+        try:
+            while True:
+                sys.stdout.write('Waiting for a disc in %s; interrupt to '
+                    'stop\n' % self.device)
+                self.runner.run(_WaitForDiscTask(self.device),
+                    verbose=False)
+
+                rip = self._copy(self.device, self.offset)
+                try:
+                    if rip._identifyDisc():
+                        continue
+
+                    jobs = rip._prepareRip()
+                    if jobs is None:
+                        continue
+
+                    self.runner.run(rip._getRipTask(jobs))
+                except TaskException, e:
+                    sys.stdout.write('Ripping the disc failed: %s\n' %
+                        e.exceptionMessage)
+                    continue
+                finally:
+                    utils.eject_device(self.device)
+
+                t = rip._getFinishTask()
+                background.run(t)
+                finishing.append((rip, t))
+        except KeyboardInterrupt:
+            sys.stdout.write('\nStopped waiting for discs\n')
+        finally:
+            if background.running:
+                sys.stdout.write('Waiting for %d discs to be verified\n' %
+                    background.running)
+            background.wait()
+
+        ret = 0
+        for rip, t in finishing:
+            if t.exception:
+                sys.stdout.write('Verifying the disc ripped to %s failed: '
+                    '%s\n' % (rip.program.outdir, t.exceptionMessage))
+                ret = -1
+        return ret
+
+    def _doDrives(self):
+        """
+        Rip the discs in several drives at once.
+
+        The discs are identified one after the other, as that can need
+        input; then all drives read at the same time, sharing the runner
+        and a pool of workers for verifying the encoded tracks.  Each drive
+        finishes and ejects its disc as soon as it is done reading.
+        """
+        self.config = config.Config()
+        self.runner = task.SyncRunner()
+        self.pool = task.WorkerPool()
+
+        rips = []
+        for device in self.options.drives:
+            device = os.path.realpath(device)
+            offset = None
+            info = drive.getDeviceInfo(device)
+            if info:
+                try:
+                    offset = self.config.getReadOffset(*info)
+                except KeyError:
+                    pass
+            if offset is None:
+                sys.stdout.write('Skipping drive %s: its read offset is '
+                    'unconfigured\n' % device)
+                continue
+
+            rip = self._copy(device, offset)
+            rip._prefix = '%s: ' % os.path.basename(rip.device)
+
+            if rip._identifyDisc():
+                sys.stdout.write('Skipping drive %s: unknown disc\n' %
+                    rip.device)
+                continue
+
+            jobs = rip._prepareRip()
+            if jobs is None:
+                continue
+
+            rips.append((rip, _DriveTask(rip, rip._getRipTask(jobs))))
+
+        if not rips:
+            return -1
+
+        # each drive finishes its disc as soon as it is ripped
+        t = _DrivesTask([(os.path.basename(r.device), drivetask)
+            for r, drivetask in rips])
+        self.runner.run(t)
+
+        ret = 0
+        for rip, drivetask in rips:
+            if drivetask.exception:
+                if drivetask.ripTask.exception:
+                    what = 'Ripping'
+                else:
+                    what = 'Finishing'
+                sys.stdout.write('%s the disc in %s failed: %s\n' % (
+                    what, rip.device, drivetask.exceptionMessage))
+                ret = -1
+
+        return ret
+
+    def _getAccurateRipResponses(self):
+        """
+        @rtype: list of L{accurip.AccurateRipResponse} or None
+        """
         url = self.ittoc.getAccurateRipURL()
         sys.stdout.write("AccurateRip URL %s\n" % url)
 
-        accucache = accurip.AccuCache()
         try:
-            responses = accucache.retrieve(url)
+            responses = self.program.getAccurateRipResponses(url)
         except urllib2.URLError, e:
             if isinstance(e.args[0], socket.gaierror):
                 if e.args[0].errno == -2:
@@ -576,16 +1353,7 @@ Log files will log the path to tracks relative to this directory.
                     "AccurateRip response discid different: %s\n" %
                     responses[0].cddbDiscId)
 
-
-        self.program.verifyImage(self.runner, responses)
-
-        sys.stdout.write("\n".join(
-            self.program.getAccurateRipResults()) + "\n")
-
-        self.program.saveRipResult()
-
-        # write log file
-        self.program.writeLog(discName, self.logger)
+        return responses
 
 
 class CD(BaseCommand):
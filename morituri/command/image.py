@@ -57,12 +57,19 @@ Retags the image from the given .cue files with tags obtained from MusicBrainz.
             action="store", dest="country",
             help="Filter releases by country"
         )
+        self.parser.add_argument(
+            '--refresh-metadata',
+            action="store_true", dest="refresh_metadata",
+            help="Look up the images in MusicBrainz again instead of using "
+                 "the cached lookups"
+        )
 
     def do(self):
         # here to avoid import gst eating our options
         from morituri.common import encode
 
-        prog = program.Program(config.Config(), stdout=sys.stdout)
+        prog = program.Program(config.Config(), stdout=sys.stdout,
+            refresh=self.options.refresh_metadata)
         runner = task.SyncRunner()
 
         for arg in self.options.cuefile:
@@ -122,11 +129,17 @@ Verifies the image from the given .cue files against the AccurateRip database.
         runner = task.SyncRunner()
         cache = accurip.AccuCache()
 
+        cueImages = []
         for arg in self.options.cuefile:
             arg = arg.decode('utf-8')
             cueImage = image.Image(arg)
             cueImage.setup(runner)
+            cueImages.append((arg, cueImage))
+
+        # fetch the responses of all images at once
+        cache.prefetch([i.table.getAccurateRipURL() for _, i in cueImages])
 
+        for arg, cueImage in cueImages:
             url = cueImage.table.getAccurateRipURL()
             responses = cache.retrieve(url)
 
@@ -8,7 +8,7 @@ import musicbrainzngs
 
 import morituri
 
-from morituri.command import cd, offset, drive, image, accurip, debug
+from morituri.command import cd, offset, drive, image, accurip, debug, serve
 from morituri.command.basecommand import BaseCommand
 from morituri.common import common, directory
 from morituri.extern.task import task
@@ -21,6 +21,9 @@ def main():
     # set user agent
     musicbrainzngs.set_useragent("whipper", morituri.__version__,
                                  "https://github.com/JoeLametta/whipper")
+    # one request a second, as MusicBrainz asks; musicbrainzngs holds all
+    # requests of the process to it, including those made in threads
+    musicbrainzngs.set_rate_limit(1.0, 1)
     # register plugins with pkg_resources
     distributions, _ = pkg_resources.working_set.find_plugins(
         pkg_resources.Environment([directory.data_path('plugins')])
@@ -69,7 +72,9 @@ You can get help on subcommands by using the -h option to the subcommand.
         'debug':   debug.Debug,
         'drive':   drive.Drive,
         'offset':  offset.Offset,
-        'image':   image.Image
+        'image':   image.Image,
+        'job':     serve.Job,
+        'serve':   serve.Serve
     }
 
     def add_arguments(self):
@@ -24,6 +24,7 @@ import argparse
 import os
 import sys
 import tempfile
+import wave
 
 import gobject
 gobject.threads_init()
@@ -31,7 +32,7 @@ gobject.threads_init()
 from morituri.command.basecommand import BaseCommand
 from morituri.common import accurip, common, config, drive, program
 from morituri.common import task as ctask
-from morituri.program import cdrdao, cdparanoia, utils
+from morituri.program import cdparanoia, cdrom, utils
 
 from morituri.extern.task import task
 
@@ -53,6 +54,14 @@ OFFSETS = "+6, +48, +102, +667, +12, +30, +618, +594, +738, -472, " + \
           "+1127"
 
 
+def _popularity(offset):
+    # known offsets first, in order of popularity
+    known = [int(o) for o in OFFSETS.split(',')]
+    if offset in known:
+        return (0, known.index(offset))
+    return (1, abs(offset))
+
+
 class Find(BaseCommand):
     summary = "find drive read offset"
     description = """Find drive's read offset by ripping tracks from a
@@ -63,7 +72,7 @@ CD in the AccurateRip database."""
     def add_arguments(self):
         self.parser.add_argument(
             '-o', '--offsets',
-            action="store", dest="offsets", default=OFFSETS,
+            action="store", dest="offsets", default="-3000:3000",
             help="list of offsets, comma-separated, colon-separated for ranges"
         )
 
@@ -92,27 +101,16 @@ CD in the AccurateRip database."""
         utils.unmount_device(device)
 
         # first get the Table Of Contents of the CD
-        t = cdrdao.ReadTOCTask(device)
-        table = t.table
+        table = cdrom.getFastToc(device)
 
         logger.debug("CDDB disc id: %r", table.getCDDBDiscId())
         url = table.getAccurateRipURL()
         logger.debug("AccurateRip URL: %s", url)
 
-        # FIXME: download url as a task too
-        responses = []
-        import urllib2
-        try:
-            handle = urllib2.urlopen(url)
-            data = handle.read()
-            responses = accurip.getAccurateRipResponses(data)
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                sys.stdout.write(
-                    'Album not found in AccurateRip database.\n')
-                return 1
-            else:
-                raise
+        responses = accurip.AccuCache().retrieve(url)
+        if not responses:
+            sys.stdout.write('Album not found in AccurateRip database.\n')
+            return 1
 
         if responses:
             logger.debug('%d AccurateRip responses found.' % len(responses))
@@ -121,8 +119,9 @@ CD in the AccurateRip database."""
                 logger.warning("AccurateRip response discid different: %s",
                     responses[0].cddbDiscId)
 
-        # now rip the first track at various offsets, calculating AccurateRip
-        # CRC, and matching it against the retrieved ones
+        # now rip the first track once, calculating the AccurateRip
+        # CRC for all offsets at once, and match them against the
+        # retrieved ones
 
         def match(archecksum, track, responses):
             for i, r in enumerate(responses):
@@ -131,94 +130,108 @@ CD in the AccurateRip database."""
 
             return None, None
 
-        for offset in self._offsets:
-            sys.stdout.write('Trying read offset %d ...\n' % offset)
-            try:
-                archecksum = self._arcs(runner, table, 1, offset)
-            except task.TaskException, e:
-
-                # let MissingDependency fall through
-                if isinstance(e.exception,
-                    common.MissingDependencyException):
-                    raise e
-
-                if isinstance(e.exception, cdparanoia.FileSizeError):
-                    sys.stdout.write(
-                        'WARNING: cannot rip with offset %d...\n' % offset)
-                    continue
-
-                logger.warning("Unknown task exception for offset %d: %r" % (
-                    offset, e))
-                sys.stdout.write(
-                    'WARNING: cannot rip with offset %d...\n' % offset)
-                continue
-
-            logger.debug('AR checksum calculated: %s' % archecksum)
-
-            c, i = match(archecksum, 1, responses)
+        sys.stdout.write('Trying %d read offsets ...\n' % len(self._offsets))
+        try:
+            archecksums = self._arcs(runner, table, 1, self._offsets)
+        except task.TaskException, e:
+            # let MissingDependency fall through
+            if isinstance(e.exception, common.MissingDependencyException):
+                raise e
+
+            logger.warning("Unknown task exception: %r" % (e, ))
+            sys.stdout.write('WARNING: cannot rip track 1.\n')
+            return 1
+
+        # try the matching offsets in order of popularity
+        candidates = []
+        for offset in sorted(self._offsets, key=_popularity):
+            c, i = match(archecksums[offset], 1, responses)
             if c:
-                count = 1
-                logger.debug('MATCHED against response %d' % i)
+                logger.debug('offset %d MATCHED against response %d' % (
+                    offset, i))
+                candidates.append(offset)
+
+        for offset in candidates:
+            count = 1
+            sys.stdout.write(
+                'Offset of device is likely %d, confirming ...\n' %
+                    offset)
+
+            # now try and rip all other tracks as well, except for the
+            # last one (to avoid readers that can't do overread
+            for track in range(2, (len(table.tracks) + 1) - 1):
+                try:
+                    archecksum = self._arcs(runner, table, track,
+                        [offset, ])[offset]
+                except task.TaskException, e:
+                    if isinstance(e.exception, cdparanoia.FileSizeError):
+                        sys.stdout.write(
+                            'WARNING: cannot rip with offset %d...\n' %
+                            offset)
+                        continue
+
+                c, i = match(archecksum, track, responses)
+                if c:
+                    logger.debug('MATCHED track %d against response %d' % (
+                        track, i))
+                    count += 1
+
+            if count == len(table.tracks) - 1:
+                self._foundOffset(device, offset)
+                return 0
+            else:
                 sys.stdout.write(
-                    'Offset of device is likely %d, confirming ...\n' %
-                        offset)
-
-                # now try and rip all other tracks as well, except for the
-                # last one (to avoid readers that can't do overread
-                for track in range(2, (len(table.tracks) + 1) - 1):
-                    try:
-                        archecksum = self._arcs(runner, table, track, offset)
-                    except task.TaskException, e:
-                        if isinstance(e.exception, cdparanoia.FileSizeError):
-                            sys.stdout.write(
-                                'WARNING: cannot rip with offset %d...\n' %
-                                offset)
-                            continue
-
-                    c, i = match(archecksum, track, responses)
-                    if c:
-                        logger.debug('MATCHED track %d against response %d' % (
-                            track, i))
-                        count += 1
-
-                if count == len(table.tracks) - 1:
-                    self._foundOffset(device, offset)
-                    return 0
-                else:
-                    sys.stdout.write(
-                        'Only %d of %d tracks matched, continuing ...\n' % (
-                        count, len(table.tracks)))
+                    'Only %d of %d tracks matched, continuing ...\n' % (
+                    count, len(table.tracks)))
 
         sys.stdout.write('No matching offset found.\n')
         sys.stdout.write('Consider trying again with a different disc.\n')
 
-    # TODO MW: Update this further for ARv2 code
-    def _arcs(self, runner, table, track, offset):
-        # rips the track with the given offset, return the arcs checksum
-        logger.debug('Ripping track %r with offset %d ...', track, offset)
+    def _arcs(self, runner, table, track, offsets):
+        # rips the track once with enough margin for all given offsets,
+        # return the arcs checksum for each offset
+        logger.debug('Ripping track %r for %d offsets ...', track,
+            len(offsets))
+
+        # the margin needs one sample more than the largest offset
+        margin = (max([abs(o) for o in offsets]) + 1) / \
+            common.SAMPLES_PER_FRAME + 1
+
+        audio = [t.number for t in table.tracks if t.audio]
+        start = table.getTrackStart(track)
+        stop = table.getTrackEnd(track)
+        readStart = max(start - margin, 0)
+        readStop = min(stop + margin, table.getTrackEnd(audio[-1]))
 
         fd, path = tempfile.mkstemp(
-            suffix=u'.track%02d.offset%d.morituri.wav' % (
-                track, offset))
+            suffix=u'.track%02d.morituri.wav' % track)
         os.close(fd)
 
-        t = cdparanoia.ReadTrackTask(path, table,
-            table.getTrackStart(track), table.getTrackEnd(track),
-            overread=False, offset=offset, device=self.options.device)
-        t.description = 'Ripping track %d with read offset %d' % (
-            track, offset)
-        runner.run(t)
+        t = cdparanoia.ReadTrackTask(path, table, readStart, readStop,
+            overread=False, offset=0, device=self.options.device)
+        t.description = 'Ripping track %d' % track
+        try:
+            runner.run(t)
+
+            handle = wave.open(path, 'rb')
+            data = handle.readframes(handle.getnframes())
+            handle.close()
+        finally:
+            os.unlink(path)
 
-        # here to avoid import gst eating our options
-        from morituri.common import checksum
+        # audio before the start or after the end of the disc reads
+        # as silence
+        silence = '\0' * common.BYTES_PER_FRAME
+        data = silence * (margin - (start - readStart)) + data + \
+            silence * (margin - (readStop - stop))
 
         # TODO MW: Update this to also use the v2 checksum(s)
-        t = checksum.FastAccurateRipChecksumTask(path, trackNumber=track,
-            trackCount=len(table.tracks), wave=True, v2=False)
-        runner.run(t)
+        checksums = accurip.getOffsetChecksums(data,
+            margin * common.SAMPLES_PER_FRAME,
+            (stop - start + 1) * common.SAMPLES_PER_FRAME,
+            track, table.getAudioTracks(), offsets)
 
-        os.unlink(path)
-        return "%08x" % t.checksum
+        return dict((o, "%08x" % c) for o, c in checksums.items())
 
     def _foundOffset(self, device, offset):
         sys.stdout.write('\nRead offset of device is: %d.\n' %
@@ -0,0 +1,170 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import socket
+import sys
+
+from morituri.command.basecommand import BaseCommand
+from morituri.common import service
+from morituri.extern.task import task
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _addSocketArgument(parser):
+    parser.add_argument('-s', '--socket',
+        action="store", dest="socket",
+        default=service.getSocketPath(),
+        help="path of the socket of the service (default: %(default)s)")
+
+
+class Serve(BaseCommand):
+    summary = "run the rip service"
+    description = """
+Run a local service that rips, verifies, retags and encodes on request.
+
+Jobs are submitted with 'whipper job submit', and queued until the
+resources they need are free: rips wait for their drive, the other jobs
+for a CPU.  The service runs until interrupted.
+"""
+
+    def add_arguments(self):
+        _addSocketArgument(self.parser)
+        self.parser.add_argument('-w', '--workers',
+            action="store", dest="workers", type=int,
+            help="how many jobs not ripping can run at once "
+                 "(default: the number of CPUs)")
+
+    def do(self):
+        t = service.ServiceTask(self.options.socket, self.options.workers)
+        runner = task.SyncRunner(verbose=False)
+        sys.stdout.write('Serving on %s\n' % self.options.socket)
+        try:
+            runner.run(t)
+        except KeyboardInterrupt:
+            sys.stdout.write('Stopping\n')
+        finally:
+            if t.running:
+                t.stop()
+
+
+class _JobCommand(BaseCommand):
+
+    def add_arguments(self):
+        _addSocketArgument(self.parser)
+
+    def do(self):
+        client = service.ServiceClient(self.options.socket)
+        try:
+            return self.doClient(client)
+        except socket.error, e:
+            sys.stderr.write('Cannot reach the service at %s: %s\n' % (
+                self.options.socket, e))
+        except service.ServiceError, e:
+            sys.stderr.write('The service refused: %s\n' % e)
+        return 1
+
+    def doClient(self, client):
+        raise NotImplementedError
+
+
+class Submit(_JobCommand):
+    summary = "submit a job"
+    description = """
+Submit a job to the rip service.
+
+The arguments are those of the whipper command the job runs: 'cd rip' for
+rip, 'image verify' for verify, 'image retag' for retag and 'debug encode'
+for encode.  Give them after --, for example:
+
+  whipper job submit -d /dev/sr0 rip -- --offset 6
+"""
+
+    def add_arguments(self):
+        _JobCommand.add_arguments(self)
+        self.parser.add_argument('kind',
+            choices=sorted(service.KINDS.keys()),
+            help="what the job does")
+        self.parser.add_argument('args', nargs='*',
+            help="arguments of the command of the job")
+        self.parser.add_argument('-d', '--device',
+            action="store", dest="device",
+            help="CD-DA device to rip from")
+
+    def doClient(self, client):
+        job = client.submit(self.options.kind, self.options.args,
+            self.options.device)
+        sys.stdout.write('Submitted job %d\n' % job['id'])
+
+
+class List(_JobCommand):
+    summary = "list jobs"
+    description = """List the jobs of the rip service."""
+
+    def doClient(self, client):
+        for job in client.getJobs():
+            what = job['state']
+            if job['description']:
+                what += ': %s %d %%' % (job['description'],
+                    job['progress'] * 100)
+            sys.stdout.write('%4d %-7s %s\n' % (job['id'], job['kind'],
+                what.encode('utf-8')))
+
+
+class Show(_JobCommand):
+    summary = "show a job"
+    description = """Show the state, output and result of a job as JSON."""
+
+    def add_arguments(self):
+        _JobCommand.add_arguments(self)
+        self.parser.add_argument('id', type=int, help="the id of the job")
+
+    def doClient(self, client):
+        json.dump(client.getJob(self.options.id), sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+class Cancel(_JobCommand):
+    summary = "cancel a job"
+    description = """Cancel a job, stopping it if it runs."""
+
+    def add_arguments(self):
+        _JobCommand.add_arguments(self)
+        self.parser.add_argument('id', type=int, help="the id of the job")
+
+    def doClient(self, client):
+        job = client.cancel(self.options.id)
+        sys.stdout.write('Job %d is %s\n' % (job['id'], job['state']))
+
+
+class Job(BaseCommand):
+    summary = "handle jobs of the rip service"
+    description = """
+Submit, list, show and cancel jobs of the rip service run by
+'whipper serve'.
+"""
+    subcommands = {
+        'submit': Submit,
+        'list': List,
+        'show': Show,
+        'cancel': Cancel,
+    }
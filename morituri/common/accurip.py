@@ -20,101 +20,287 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
-import errno
+import array
+import httplib
 import os
+import re
+import socket
 import struct
+import sys
+import time
 import urlparse
 import urllib2
 
-from morituri.common import directory
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from morituri.common import cache, common, directory
 
 import logging
 logger = logging.getLogger(__name__)
 
 _CACHE_DIR = directory.cache_path()
 
+# the first and last track skip the outer five frames, minus one sample
+# at the start
+_SKIP_SAMPLES = 5 * common.SAMPLES_PER_FRAME
 
-class AccuCache:
+_URL_RE = re.compile(r'dBAR-\d+-(?P<discId1>[0-9a-f]{8})-'
+    r'(?P<discId2>[0-9a-f]{8})-(?P<cddbDiscId>[0-9a-f]{8})\.bin$')
 
-    def __init__(self):
-        if not os.path.exists(_CACHE_DIR):
-            logger.debug('Creating cache directory %s', _CACHE_DIR)
-            os.makedirs(_CACHE_DIR)
 
-    def _getPath(self, url):
-        # split path starts with /
-        return os.path.join(_CACHE_DIR, urlparse.urlparse(url)[2][1:])
+def getKey(url):
+    """
+    Get the key of the responses at an AccurateRip URL.
+
+    @returns: the AccurateRip disc ids and the CDDB disc id, or the URL
+              itself if it is not an AccurateRip URL
+    @rtype:   tuple of (str, str, str) or str
+    """
+    m = _URL_RE.search(url)
+    if not m:
+        return url
 
-    def retrieve(self, url, force=False):
-        logger.debug("Retrieving AccurateRip URL %s", url)
-        path = self._getPath(url)
-        logger.debug("Cached path: %s", path)
-        if force:
-            logger.debug("forced to download")
-            self.download(url)
-        elif not os.path.exists(path):
-            logger.debug("%s does not exist, downloading", path)
-            self.download(url)
-
-        if not os.path.exists(path):
-            logger.debug("%s does not exist, not in database", path)
+    return m.group('discId1', 'discId2', 'cddbDiscId')
+
+
+class _ConnectionPool:
+    """
+    I keep a connection open to each server I fetch from, so that fetching
+    many files from it does not connect for each.
+    """
+
+    timeout = 30
+
+    def __init__(self):
+        self._connections = {}
+
+    def fetch(self, url):
+        """
+        @returns: the data at the URL, or None if it is not found
+        @rtype:   str
+
+        @raises urllib2.URLError: if it cannot be fetched
+        """
+        parts = urlparse.urlparse(url)
+        host = parts.netloc
+
+        while True:
+            connection = self._connections.get(host)
+            reused = connection is not None
+            if not reused:
+                connection = httplib.HTTPConnection(host,
+                    timeout=self.timeout)
+                self._connections[host] = connection
+
+            try:
+                connection.request('GET', parts.path)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (socket.error, httplib.HTTPException), e:
+                connection.close()
+                del self._connections[host]
+                # the server can close a connection kept open
+                if reused:
+                    logger.debug('connection to %s lost, reconnecting', host)
+                    continue
+                raise urllib2.URLError(e)
+
+        logger.debug('fetched %s: %d', url, response.status)
+        if response.status == 404:
             return None
+        if response.status != 200:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                response.msg, None)
 
-        data = self._read(url)
+        return data
 
-        return getAccurateRipResponses(data)
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = {}
 
-    def download(self, url):
-        # FIXME: download url as a task too
-        try:
-            handle = urllib2.urlopen(url)
+
+class AccuCache:
+    """
+    I store the AccurateRip responses of discs, parsed, indexed by their
+    disc ids, with when they were fetched.  That a disc is not in the
+    database is stored too.
+
+    Responses older than the time to live are fetched again when asked
+    for; if that fails, the stored ones are used.
+    """
+
+    def __init__(self, path=None, ttl=7 * 86400):
+        """
+        @param path: the directory to store in
+        @type  path: unicode
+        @param ttl:  how long stored responses are used, in seconds
+        @type  ttl:  float
+        """
+        self._path = path or _CACHE_DIR
+        if not os.path.exists(self._path):
+            logger.debug('Creating cache directory %s', self._path)
+            os.makedirs(self._path)
+        self._indexPath = os.path.join(self._path, 'accuraterip.pickle')
+        self._index = cache.Persister(self._indexPath, default={})
+        self._ttl = ttl
+
+    def _getEntry(self, url):
+        key = getKey(url)
+        entry = self._index.object.get(key)
+        if entry:
+            return entry
+
+        # before the index, each file was stored at the path of its URL
+        path = os.path.join(self._path, urlparse.urlparse(url)[2][1:])
+        if os.path.exists(path):
+            logger.debug('Reading %s from cache', path)
+            handle = open(path, 'rb')
             data = handle.read()
+            handle.close()
+            return {
+                'time': os.path.getmtime(path),
+                'responses': getAccurateRipResponses(data),
+            }
+
+        return None
+
+    def _isFresh(self, entry):
+        return entry and time.time() - entry['time'] < self._ttl
+
+    def _fetch(self, pool, url):
+        data = pool.fetch(url)
+        responses = None
+        if data is not None:
+            responses = getAccurateRipResponses(data)
+        return {'time': time.time(), 'responses': responses}
+
+    def _store(self, entries):
+        if not entries:
+            return
+
+        # others can have stored since we loaded the index
+        index = cache.Persister(self._indexPath, default={})
+        index.object.update(entries)
+        index.persist()
+        self._index = index
 
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                return None
-            else:
-                raise
+    def retrieve(self, url, force=False):
+        """
+        @param force: whether to fetch the responses even if they are stored
 
-        self._cache(url, data)
-        return data
+        @returns: the responses, or None if the disc is not in the database
+        @rtype:   list of L{AccurateRipResponse}
+        """
+        logger.debug("Retrieving AccurateRip URL %s", url)
+        entry = self._getEntry(url)
+        if not force and self._isFresh(entry):
+            return entry['responses']
 
-    def _cache(self, url, data):
-        path = self._getPath(url)
+        pool = _ConnectionPool()
         try:
-            os.makedirs(os.path.dirname(path))
-        except OSError, e:
-            logger.debug('Could not make dir %s: %r' % (
-                path, str(e)))
-            if e.errno != errno.EEXIST:
+            fetched = self._fetch(pool, url)
+        except urllib2.URLError, e:
+            if not entry:
                 raise
+            logger.warning('Could not fetch %s, using the responses '
+                'stored: %r', url, e)
+            return entry['responses']
+        finally:
+            pool.close()
+
+        self._store({getKey(url): fetched})
+        return fetched['responses']
+
+    def prefetch(self, urls):
+        """
+        Fetch the responses of many discs over a single connection, for
+        those not stored, or stored longer than the time to live.
+
+        Those that cannot be fetched keep the responses stored; once the
+        server cannot be reached, no more are fetched.
+
+        @type  urls: list of str
+
+        @returns: how many were fetched
+        @rtype:   int
+        """
+        fetched = {}
+        pool = _ConnectionPool()
+        try:
+            for url in urls:
+                key = getKey(url)
+                if key in fetched or self._isFresh(self._getEntry(url)):
+                    continue
+                try:
+                    fetched[key] = self._fetch(pool, url)
+                except urllib2.HTTPError, e:
+                    logger.warning('Could not fetch %s: %r', url, e)
+                except urllib2.URLError, e:
+                    logger.warning('Could not fetch %s, not fetching any '
+                        'more: %r', url, e)
+                    break
+        finally:
+            pool.close()
+            self._store(fetched)
+
+        logger.debug('prefetched %d of %d AccurateRip URLs', len(fetched),
+            len(urls))
+        return len(fetched)
 
-        handle = open(path, 'wb')
-        handle.write(data)
-        handle.close()
 
-    def _read(self, url):
-        logger.debug("Reading %s from cache", url)
-        path = self._getPath(url)
-        handle = open(path, 'rb')
-        data = handle.read()
-        handle.close()
-        return data
+def getAccurateRipResponses(data):
+    """
+    Parse the responses of the AccurateRip database for a disc.
 
+    @type  data: str
 
-def getAccurateRipResponses(data):
+    @rtype: list of L{AccurateRipResponse}
+    """
     ret = []
 
-    while data:
-        trackCount = struct.unpack("B", data[0])[0]
-        nbytes = 1 + 12 + trackCount * (1 + 8)
-
-        ret.append(AccurateRipResponse(data[:nbytes]))
-        data = data[nbytes:]
+    offset = 0
+    while offset < len(data):
+        response = AccurateRipResponse(data, offset)
+        ret.append(response)
+        offset += 13 + response.trackCount * 9
 
     return ret
 
 
+def getMatchConfidence(responses, trackNumber, checksums):
+    """
+    Get the highest confidence of the responses that match the track.
+
+    AccurateRip v1 and v2 checksums are stored in separate responses, so
+    each given checksum is looked up in every response.
+
+    @param responses:   the responses for the disc
+    @type  responses:   list of L{AccurateRipResponse}
+    @param trackNumber: the number of the track, starting from 1
+    @type  trackNumber: int
+    @param checksums:   the checksums calculated for the track
+    @type  checksums:   list of int
+
+    @returns: the highest confidence, or None if no response matches
+    @rtype:   int or None
+    """
+    wanted = ["%08x" % c for c in checksums if c is not None]
+
+    confidence = None
+    for r in responses or []:
+        if trackNumber > len(r.checksums):
+            continue
+        if r.checksums[trackNumber - 1] in wanted:
+            confidence = max(confidence, r.confidences[trackNumber - 1])
+
+    return confidence
+
+
 class AccurateRipResponse(object):
     """
     I represent the response of the AccurateRip online database.
@@ -129,19 +315,238 @@ class AccurateRipResponse(object):
     confidences = None
     checksums = None
 
-    def __init__(self, data):
-        self.trackCount = struct.unpack("B", data[0])[0]
-        self.discId1 = "%08x" % struct.unpack("<L", data[1:5])[0]
-        self.discId2 = "%08x" % struct.unpack("<L", data[5:9])[0]
-        self.cddbDiscId = "%08x" % struct.unpack("<L", data[9:13])[0]
-
-        self.confidences = []
-        self.checksums = []
-
-        pos = 13
-        for _ in range(self.trackCount):
-            confidence = struct.unpack("B", data[pos])[0]
-            checksum = "%08x" % struct.unpack("<L", data[pos + 1:pos + 5])[0]
-            pos += 9
-            self.confidences.append(confidence)
-            self.checksums.append(checksum)
+    def __init__(self, data, offset=0):
+        """
+        @param data:   the data of the responses for the disc
+        @type  data:   str
+        @param offset: where in the data this response starts
+        @type  offset: int
+        """
+        self.trackCount, discId1, discId2, cddbDiscId = struct.unpack_from(
+            "<BLLL", data, offset)
+        self.discId1 = "%08x" % discId1
+        self.discId2 = "%08x" % discId2
+        self.cddbDiscId = "%08x" % cddbDiscId
+
+        # confidence, checksum and checksum of frame 450 by track
+        tracks = struct.unpack_from("<" + "BL4x" * self.trackCount, data,
+            offset + 13)
+        self.confidences = list(tracks[0::2])
+        self.checksums = ["%08x" % c for c in tracks[1::2]]
+
+
+class AccurateRipChecksum(object):
+    """
+    I calculate the AccurateRip v1 and v2 checksums of a track in a single
+    pass over its audio.
+
+    Audio is fed with L{update} as little-endian signed 16-bit stereo
+    samples, in chunks of any size.  The samples at the end of the last
+    track that are excluded from the checksum are held back, so the length
+    of the track does not need to be known up front.
+
+    If numpy is available, whole chunks are summed at once; otherwise I
+    fall back to a pure Python loop.
+
+    @ivar samples: the number of samples received so far
+    @type samples: int
+    """
+
+    samples = 0
+
+    def __init__(self, trackNumber, trackCount):
+        """
+        @param trackNumber: the number of the track, starting from 1
+        @type  trackNumber: int
+        @param trackCount:  the number of audio tracks on the disc
+        @type  trackCount:  int
+        """
+        self._first = trackNumber == 1
+        self._last = trackNumber == trackCount
+        self._v1 = 0
+        self._v2 = 0
+        self._position = 1 # 1-based position of the next counted sample
+        self._partial = '' # bytes of an incomplete sample
+        self._tail = '' # samples held back on the last track
+
+    def update(self, data):
+        """
+        Add audio to the checksums.
+
+        @type data: C{str}
+        """
+        if self._partial:
+            data = self._partial + data
+        size = len(data) - len(data) % 4
+        self._partial = data[size:]
+        data = data[:size]
+        self.samples += size / 4
+
+        if self._last:
+            data = self._tail + data
+            keep = _SKIP_SAMPLES * 4
+            self._tail = data[-keep:]
+            data = data[:-keep]
+
+        if not data:
+            return
+
+        start = self._position
+        self._position += len(data) / 4
+
+        if self._first and start < _SKIP_SAMPLES:
+            skip = _SKIP_SAMPLES - start
+            data = data[skip * 4:]
+            start = _SKIP_SAMPLES
+            if not data:
+                return
+
+        if numpy is not None:
+            v1, v2 = _sumNumpy(data, start)
+        else:
+            v1, v2 = _sumPython(data, start)
+
+        self._v1 = (self._v1 + v1) & 0xFFFFFFFF
+        self._v2 = (self._v2 + v2) & 0xFFFFFFFF
+
+    @property
+    def v1(self):
+        """
+        @rtype: int
+        """
+        return self._v1
+
+    @property
+    def v2(self):
+        """
+        @rtype: int
+        """
+        return self._v2
+
+
+def _sumNumpy(data, start):
+    """
+    Return the v1 and v2 sums of the samples in data, weighted by their
+    positions counted from start.
+    """
+    values = numpy.frombuffer(data, dtype='<u4').astype(numpy.uint64)
+    positions = numpy.arange(start, start + len(values), dtype=numpy.uint64)
+    products = positions * values
+    # uint64 sums wrap around, which is fine modulo 2 ** 32
+    v1 = int(products.sum(dtype=numpy.uint64)) & 0xFFFFFFFF
+    high = int((products >> numpy.uint64(32)).sum(dtype=numpy.uint64))
+    return v1, (v1 + high) & 0xFFFFFFFF
+
+
+def _sumPython(data, start):
+    values = array.array('I', data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    v1 = 0
+    high = 0
+    position = start
+    for value in values:
+        product = position * value
+        v1 += product
+        high += product >> 32
+        position += 1
+
+    v1 &= 0xFFFFFFFF
+    return v1, (v1 + high) & 0xFFFFFFFF
+
+
+def getOffsetChecksums(data, start, length, trackNumber, trackCount, offsets):
+    """
+    Calculate the AccurateRip v1 checksums of a track for many read offsets
+    at once, from a single read of the track with some margin around it.
+
+    The v1 checksum slides: with prefix sums of the samples and of the
+    samples weighted by their position, the checksum of the track at any
+    offset takes a constant number of operations.  All arithmetic is done
+    modulo 2 ** 32.
+
+    @param data:    audio read with offset 0, as 16-bit stereo samples
+    @type  data:    C{str}
+    @param start:   the sample in data where the track starts at offset 0
+    @type  start:   int
+    @param length:  the length of the track, in samples
+    @type  length:  int
+    @param offsets: the read offsets to calculate checksums for, in samples
+    @type  offsets: list of int
+
+    @returns: the v1 checksum for each offset
+    @rtype:   dict of int -> int
+    """
+    total = len(data) / 4
+
+    # positions counted in the checksum, 1-based
+    first = 1
+    last = length
+    if trackNumber == 1:
+        first = _SKIP_SAMPLES
+    if trackNumber == trackCount:
+        last = length - _SKIP_SAMPLES
+
+    # for offset o, position i of the track is sample (i + base) of data,
+    # with base = start + o - 1; the checksum is then
+    # sum(i * x[i + base]) = (P1[hi] - P1[lo]) - base * (P0[hi] - P0[lo])
+    # with Pn[k] = sum(j ** n * x[j] for j < k)
+    bases = []
+    for offset in offsets:
+        base = start + offset - 1
+        if base + first < 0 or base + last + 1 > total:
+            raise ValueError('offset %d is outside of the read audio' % offset)
+        bases.append(base)
+
+    if numpy is not None:
+        sums = _prefixSumsNumpy(data, total, bases, first, last)
+    else:
+        sums = _prefixSumsPython(data, total, bases, first, last)
+
+    ret = {}
+    for offset, base in zip(offsets, bases):
+        lo0, lo1 = sums[base + first]
+        hi0, hi1 = sums[base + last + 1]
+        ret[offset] = ((hi1 - lo1) - base * (hi0 - lo0)) & 0xFFFFFFFF
+
+    return ret
+
+
+def _prefixSumsNumpy(data, total, bases, first, last):
+    """
+    Return a dict of index -> (P0, P1) for the indexes needed.
+    """
+    # uint32 arithmetic wraps, which is fine modulo 2 ** 32
+    values = numpy.frombuffer(data, dtype='<u4', count=total).astype(
+        numpy.uint32)
+    p0 = numpy.zeros(total + 1, dtype=numpy.uint32)
+    numpy.cumsum(values, dtype=numpy.uint32, out=p0[1:])
+    weighted = numpy.arange(total, dtype=numpy.uint32)
+    weighted *= values
+    p1 = numpy.zeros(total + 1, dtype=numpy.uint32)
+    numpy.cumsum(weighted, dtype=numpy.uint32, out=p1[1:])
+    del weighted
+
+    indexes = set([b + first for b in bases] + [b + last + 1 for b in bases])
+    return dict((i, (int(p0[i]), int(p1[i]))) for i in indexes)
+
+
+def _prefixSumsPython(data, total, bases, first, last):
+    values = array.array('I', data[:total * 4])
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    indexes = set([b + first for b in bases] + [b + last + 1 for b in bases])
+    ret = {}
+    p0 = 0
+    p1 = 0
+    for j, value in enumerate(values):
+        if j in indexes:
+            ret[j] = (p0, p1)
+        p0 = (p0 + value) & 0xFFFFFFFF
+        p1 = (p1 + j * value) & 0xFFFFFFFF
+    if total in indexes:
+        ret[total] = (p0, p1)
+
+    return ret
@@ -24,6 +24,8 @@ import os
 import os.path
 import glob
 import tempfile
+import threading
+import time
 import shutil
 
 from morituri.result import result
@@ -130,14 +132,20 @@ class PersistedCache:
             if e.errno != 17: # FIXME
                 raise
 
-    def _getPath(self, key):
+    def getPath(self, key):
+        """
+        Returns the path of the file the object for the given key is
+        persisted in, whether it exists or not.
+
+        @rtype: str
+        """
         return os.path.join(self.path, '%s.pickle' % key)
 
     def get(self, key):
         """
         Returns the persister for the given key.
         """
-        persister = Persister(self._getPath(key))
+        persister = Persister(self.getPath(key))
         if persister.object:
             if hasattr(persister.object, 'instanceVersion'):
                 o = persister.object
@@ -227,3 +235,116 @@ class TableCache:
             ptable = self._pcache.get('mbdiscid.' + mbdiscid)
 
         return ptable
+
+
+class MusicBrainzCache:
+    """
+    I cache the results of MusicBrainz lookups: the releases of disc ids,
+    and the details of releases.
+
+    A result is fresh for its time to live.  For the stale time after that,
+    it is still used, but looked up again in the background; older results
+    are looked up again before they are used.
+
+    When the cache grows over its size, the results used the longest ago
+    are removed.
+    """
+
+    def __init__(self, path=None, ttl=7 * 86400, stale=30 * 86400,
+            size=50 * 1024 * 1024):
+        """
+        @param ttl:   how long a result is fresh, in seconds
+        @type  ttl:   float
+        @param stale: how long after that a result is still used while it
+                      is looked up again, in seconds
+        @type  stale: float
+        @param size:  how large the cache can grow, in bytes
+        @type  size:  int
+        """
+        self._path = path or directory.cache_path('musicbrainz')
+        self._pcache = PersistedCache(self._path)
+        self._ttl = ttl
+        self._stale = stale
+        self._size = size
+        self._used = None # bytes, counted when first storing
+        self._lock = threading.Lock()
+        self._revalidating = {}
+
+    def get(self, key, lookup, refresh=False):
+        """
+        Get a result from the cache, or look it up.
+
+        @param key:     the key of the result, safe to use as a file name
+        @type  key:     str
+        @param lookup:  looks the result up when it is not in the cache
+        @type  lookup:  callable
+        @param refresh: whether to look the result up even if it is cached
+        @type  refresh: bool
+        """
+        persister = self._pcache.get(key)
+        entry = persister.object
+
+        if entry and not refresh:
+            age = time.time() - entry['time']
+            if age < self._ttl + self._stale:
+                logger.debug('musicbrainz %r cached %d s ago', key, age)
+                # the file time tells what was used last, for eviction
+                os.utime(self._pcache.getPath(key), None)
+                if age >= self._ttl:
+                    self._revalidate(key, lookup)
+                return entry['result']
+
+        logger.debug('musicbrainz %r not cached, looking up', key)
+        result = lookup()
+        self._store(key, result)
+        return result
+
+    def _revalidate(self, key, lookup):
+        def run():
+            try:
+                self._store(key, lookup())
+                logger.debug('musicbrainz %r revalidated', key)
+            except Exception, e:
+                logger.debug('musicbrainz %r not revalidated: %r', key, e)
+            finally:
+                with self._lock:
+                    del self._revalidating[key]
+
+        with self._lock:
+            if key in self._revalidating:
+                return
+            thread = threading.Thread(target=run, name='Revalidate')
+            thread.daemon = True
+            self._revalidating[key] = thread
+        thread.start()
+
+    def _store(self, key, result):
+        persister = self._pcache.get(key)
+        path = self._pcache.getPath(key)
+        with self._lock:
+            old = os.path.exists(path) and os.path.getsize(path) or 0
+            persister.persist({'time': time.time(), 'result': result})
+
+            if self._used is None:
+                self._used = sum([os.path.getsize(p)
+                    for p in glob.glob(os.path.join(self._path, '*.pickle'))])
+            else:
+                self._used += os.path.getsize(path) - old
+
+            if self._used > self._size:
+                self._evict()
+
+    def _evict(self):
+        # remove down to below the size, so that evicting is not done for
+        # every result stored
+        paths = [(os.path.getmtime(p), os.path.getsize(p), p)
+            for p in glob.glob(os.path.join(self._path, '*.pickle'))]
+        paths.sort()
+        self._used = sum([size for _, size, _ in paths])
+
+        for _, size, path in paths:
+            if self._used <= self._size * 0.9:
+                break
+            logger.debug('evicting musicbrainz %r', path)
+            os.unlink(path)
+            self._used -= size
@@ -26,13 +26,13 @@ import zlib
 
 import gst
 
-from morituri.common import common, task
+from morituri.common import accurip, common, task
 from morituri.common import gstreamer as cgstreamer
 
 from morituri.extern.task import gstreamer
 from morituri.extern.task import task as etask
 
-from morituri.program.arc import accuraterip_checksum
+from morituri.program.arc import accuraterip_checksums
 
 import logging
 logger = logging.getLogger(__name__)
@@ -242,9 +242,12 @@ class ChecksumTask(gstreamer.GstPipelineTask):
         # see http://bugzilla.gnome.org/show_bug.cgi?id=576505
         self._adapter.push(buf)
 
-        while self._adapter.available() >= common.BYTES_PER_FRAME:
+        available = self._adapter.available()
+        size = available - available % common.BYTES_PER_FRAME
+        if size:
+            # take all complete frames at once
             # FIXME: in 0.10.14.1, take_buffer leaks a ref
-            buf = self._adapter.take_buffer(common.BYTES_PER_FRAME)
+            buf = self._adapter.take_buffer(size)
 
             self._checksum = self.do_checksum_buffer(buf, self._checksum)
             self._bytes += len(buf)
@@ -274,7 +277,36 @@ class CRC32Task(ChecksumTask):
         return zlib.crc32(buf, checksum)
 
 
+class AnalysisTask(ChecksumTask):
+    """
+    I decode audio once, and feed each buffer to a set of digests.
+
+    @ivar digests: objects with an update(data) method, like the ones in
+                   L{morituri.common.digest}
+    """
+
+    description = 'Analyzing audio'
+
+    def __init__(self, path, digests, sampleStart=0, sampleLength=-1):
+        ChecksumTask.__init__(self, path, sampleStart, sampleLength)
+        self.digests = digests
+
+    def do_checksum_buffer(self, buf, checksum):
+        data = buf.data
+        for digest in self.digests:
+            digest.update(data)
+        return checksum
+
+
 class FastAccurateRipChecksumTask(etask.Task):
+    """
+    I calculate the AccurateRip checksums of a file without GStreamer.
+
+    @ivar checksum: the v1 checksum, or the v2 checksum if asked for
+    @ivar v1:       the AccurateRip v1 checksum
+    @ivar v2:       the AccurateRip v2 checksum
+    """
+
     description = 'Calculating (Fast) AccurateRip checksum'
 
     def __init__(self, path, trackNumber, trackCount, wave, v2=False):
@@ -284,15 +316,22 @@ class FastAccurateRipChecksumTask(etask.Task):
         self._wave = wave
         self._v2 = v2
         self.checksum = None
+        self.v1 = None
+        self.v2 = None
 
     def start(self, runner):
         etask.Task.start(self, runner)
         self.schedule(0.0, self._arc)
 
     def _arc(self):
-        arc = accuraterip_checksum(self.path, self.trackNumber, self.trackCount,
-                self._wave, self._v2)
-        self.checksum = arc
+        checksums = accuraterip_checksums(self.path, self.trackNumber,
+                self.trackCount, self._wave)
+        if checksums is not None:
+            self.v1, self.v2 = checksums
+            if self._v2:
+                self.checksum = self.v2
+            else:
+                self.checksum = self.v1
 
         self.stop()
 
@@ -302,6 +341,8 @@ class AccurateRipChecksumTask(ChecksumTask):
     I implement the AccurateRip checksum.
 
     See http://www.accuraterip.com/
+
+    @ivar v2: the AccurateRip v2 checksum, calculated alongside
     """
 
     description = 'Calculating AccurateRip checksum'
@@ -311,48 +352,21 @@ class AccurateRipChecksumTask(ChecksumTask):
         ChecksumTask.__init__(self, path, sampleStart, sampleLength)
         self._trackNumber = trackNumber
         self._trackCount = trackCount
-        self._discFrameCounter = 0 # 1-based
+        self._accurip = accurip.AccurateRipChecksum(trackNumber, trackCount)
+        self.v2 = None
 
     def __repr__(self):
         return "<AccurateRipCheckSumTask of track %d in %r>" % (
             self._trackNumber, self._path)
 
     def do_checksum_buffer(self, buf, checksum):
-        self._discFrameCounter += 1
-
-        # on first track ...
-        if self._trackNumber == 1:
-            # ... skip first 4 CD frames
-            if self._discFrameCounter <= 4:
-                gst.debug('skipping frame %d' % self._discFrameCounter)
-                return checksum
-            # ... on 5th frame, only use last value
-            elif self._discFrameCounter == 5:
-                values = struct.unpack("<I", buf[-4:])
-                checksum += common.SAMPLES_PER_FRAME * 5 * values[0]
-                checksum &= 0xFFFFFFFF
-                return checksum
-
-        # on last track, skip last 5 CD frames
-        if self._trackNumber == self._trackCount:
-            discFrameLength = self._sampleLength / common.SAMPLES_PER_FRAME
-            if self._discFrameCounter > discFrameLength - 5:
-                logger.debug('skipping frame %d', self._discFrameCounter)
-                return checksum
-
-        # self._bytes is updated after do_checksum_buffer
-        factor = self._bytes / 4 + 1
-        values = struct.unpack("<%dI" % (len(buf) / 4), buf)
-        for value in values:
-            checksum += factor * value
-            factor += 1
-            # offset = self._bytes / 4 + i + 1
-            # if offset % common.SAMPLES_PER_FRAME == 0:
-            #   print 'frame %d, ends before %d, last value %08x, CRC %08x' % (
-            #     offset / common.SAMPLES_PER_FRAME, offset, value, sum)
-
-        checksum &= 0xFFFFFFFF
-        return checksum
+        self._accurip.update(buf.data)
+        return self._accurip.v1
+
+    def stopped(self):
+        ChecksumTask.stopped(self)
+        if self.checksum is not None:
+            self.v2 = self._accurip.v2
 
 
 class TRMTask(task.GstPipelineTask):
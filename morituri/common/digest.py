@@ -0,0 +1,177 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_digest -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Digests calculated over decoded audio.
+
+A digest is any object with an update(data) method taking little-endian
+signed 16-bit stereo samples, in chunks of any size.  This allows a single
+pass over the audio to feed several digests at once; see
+L{accurip.AccurateRipChecksum} for the AccurateRip one.
+"""
+
+import array
+import sys
+import zlib
+
+
+class CRC32Digest(object):
+    """
+    I calculate the CRC32 of audio.
+    """
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+    @property
+    def checksum(self):
+        """
+        @rtype: int
+        """
+        return self._crc % 2 ** 32
+
+
+class SegmentDigest(object):
+    """
+    I calculate the CRC32 of each consecutive segment of a given size of
+    audio, so two reads can be compared segment by segment.
+    """
+
+    def __init__(self, size):
+        """
+        @param size: the size of a segment, in bytes
+        @type  size: int
+        """
+        self._size = size
+        self._left = size # bytes left in the current segment
+        self._crc = 0
+        self._checksums = []
+
+    def update(self, data):
+        while data:
+            chunk = data[:self._left]
+            data = data[len(chunk):]
+            self._crc = zlib.crc32(chunk, self._crc)
+            self._left -= len(chunk)
+
+            if not self._left:
+                self._checksums.append(self._crc % 2 ** 32)
+                self._crc = 0
+                self._left = self._size
+
+    @property
+    def checksums(self):
+        """
+        The CRC32 of each segment; the last one can be shorter.
+
+        @rtype: list of int
+        """
+        if self._left == self._size:
+            return list(self._checksums)
+        return self._checksums + [self._crc % 2 ** 32]
+
+
+class PeakDigest(object):
+    """
+    I find the highest absolute sample value of audio.
+    """
+
+    def __init__(self):
+        self._max = 0
+        self._partial = ''
+
+    def update(self, data):
+        if self._partial:
+            data = self._partial + data
+        size = len(data) - len(data) % 2
+        self._partial = data[size:]
+        if not size:
+            return
+
+        values = array.array('h', data[:size])
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        self._max = max(self._max, max(values), -min(values))
+
+    @property
+    def peak(self):
+        """
+        The peak level, from 0.0 to 1.0, as reported by sox as maximum
+        amplitude.
+
+        @rtype: float
+        """
+        return self._max / 32768.0
+
+
+class SplitDigest(object):
+    """
+    I split audio into consecutive parts of given sizes, and feed each part
+    to its own digests.  Audio beyond the last part is ignored.
+
+    Digests with a close() method are closed at the end of their part, or
+    when I am closed before reaching it.
+    """
+
+    def __init__(self, sizes, digests):
+        """
+        @param sizes:   the size of each part, in bytes
+        @type  sizes:   list of int
+        @param digests: the digests for each part
+        @type  digests: list of list of objects with an update(data) method
+        """
+        assert len(sizes) == len(digests), \
+            "%d sizes for %d parts" % (len(sizes), len(digests))
+
+        self._sizes = sizes
+        self._digests = digests
+        self._part = 0
+        self._left = sizes and sizes[0] or 0 # bytes left in this part
+
+    def update(self, data):
+        while data and self._part < len(self._sizes):
+            chunk = data[:self._left]
+            data = data[self._left:]
+            for d in self._digests[self._part]:
+                d.update(chunk)
+
+            self._left -= len(chunk)
+            if not self._left:
+                self._closePart()
+
+    def close(self):
+        """
+        Close the digests of all parts that did not end yet.
+        """
+        while self._part < len(self._sizes):
+            self._closePart()
+
+    def _closePart(self):
+        for d in self._digests[self._part]:
+            if hasattr(d, 'close'):
+                d.close()
+
+        self._part += 1
+        if self._part < len(self._sizes):
+            self._left = self._sizes[self._part]
@@ -20,6 +20,7 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
+import fcntl
 import os
 
 import logging
@@ -71,3 +72,24 @@ def getDeviceInfo(path):
     ok, vendor, model, release = device.get_hwinfo()
 
     return (vendor, model, release)
+
+
+# from linux/cdrom.h
+_CDROM_DRIVE_STATUS = 0x5326
+_CDSL_CURRENT = 2 ** 31 - 1
+_CDS_DISC_OK = 4
+
+
+def hasDisc(path):
+    """
+    Whether the drive has a disc loaded and ready.
+
+    @rtype: bool
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        status = fcntl.ioctl(fd, _CDROM_DRIVE_STATUS, _CDSL_CURRENT)
+    finally:
+        os.close(fd)
+
+    return status == _CDS_DISC_OK
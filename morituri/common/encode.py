@@ -20,17 +20,15 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
-import math
 import os
 import shutil
 import tempfile
 
-from morituri.common import common
+from morituri.common import common, digest
 from morituri.common import gstreamer as cgstreamer
 from morituri.common import task as ctask
 
 from morituri.extern.task import task, gstreamer
-from morituri.program import sox
 
 import logging
 logger = logging.getLogger(__name__)
@@ -167,53 +165,63 @@ LOSSY_PROFILES = {
 ALL_PROFILES = PROFILES.copy()
 ALL_PROFILES.update(LOSSY_PROFILES)
 
-class SoxPeakTask(task.Task):
-    description = 'Calculating peak level'
+# raw audio as read by cdparanoia
+_RAW_CAPS = 'audio/x-raw-int,rate=44100,signed=(boolean)true,endianness=1234'
 
-    def __init__(self, track_path):
-        self.track_path = track_path
-        self.peak = None
-
-    def start(self, runner):
-        task.Task.start(self, runner)
-        self.schedule(0.0, self._sox_peak)
-
-    def _sox_peak(self):
-        self.peak = sox.peak_level(self.track_path)
-        self.stop()
 
 class EncodeTask(ctask.GstPipelineTask):
     """
-    I am a task that encodes a .wav file.
+    I am a task that encodes a .wav file, or raw audio read from a file
+    descriptor.
     I set tags too.
-    I also calculate the peak level of the track.
-
-    @param peak: the peak volume, from 0.0 to 1.0.  This is the sqrt of the
-                 peak power.
-    @type  peak: float
+    I also calculate the peak level of the track, and feed the decoded
+    audio to any other digests given, so the input is only decoded once.
+
+    @param peak:    the peak volume, from 0.0 to 1.0.  This is the highest
+                    absolute sample value.
+    @type  peak:    float
+    @param samples: the number of samples encoded
+    @type  samples: int
     """
 
     logCategory = 'EncodeTask'
 
     description = 'Encoding'
     peak = None
+    samples = 0
 
-    def __init__(self, inpath, outpath, profile, taglist=None, what="track"):
+    def __init__(self, inpath, outpath, profile, taglist=None, what="track",
+                 digests=None, fd=None, length=None):
         """
+        If inpath is None, raw little-endian 16-bit stereo audio is read
+        from fd instead until end of file.
+
         @param profile: encoding profile
         @type  profile: L{Profile}
+        @param digests: digests to feed the decoded audio to
+        @type  digests: list of objects with an update(data) method
+        @param fd:      file descriptor to read raw audio from; I close it
+                        when done
+        @type  fd:      int
+        @param length:  the number of samples to expect from fd, for
+                        progress
+        @type  length:  int
         """
-        assert type(inpath) is unicode, "inpath %r is not unicode" % inpath
+        assert inpath is not None or fd is not None, \
+            "need either inpath or fd"
+        assert inpath is None or type(inpath) is unicode, \
+            "inpath %r is not unicode" % inpath
         assert type(outpath) is unicode, \
             "outpath %r is not unicode" % outpath
 
         self._inpath = inpath
+        self._fd = fd
         self._outpath = outpath
         self._taglist = taglist
-        self._length = 0 # in samples
+        self._length = length or 0 # in samples
 
-        self._level = None
-        self._peakdB = None
+        self._peak = digest.PeakDigest()
+        self._digests = [self._peak] + list(digests or [])
         self._profile = profile
 
         self.description = "Encoding %s" % what
@@ -221,20 +229,31 @@ class EncodeTask(ctask.GstPipelineTask):
 
         cgstreamer.removeAudioParsers()
 
+    def start(self, runner):
+        try:
+            ctask.GstPipelineTask.start(self, runner)
+        except:
+            self._closeFd()
+            raise
+
     def getPipelineDesc(self):
-        # start with an emit interval of one frame, because we end up setting
-        # the final interval after paused and after processing some samples
-        # already, which is too late
-        interval = int(self.gst.SECOND / 75.0)
+        if self._inpath is None:
+            source = '''
+                fdsrc fd=%d !
+                %s''' % (self._fd, _RAW_CAPS)
+        else:
+            source = '''
+                filesrc location="%s" !
+                decodebin name=decoder''' % (
+                    gstreamer.quoteParse(self._inpath).encode('utf-8'), )
+
         return '''
-            filesrc location="%s" !
-            decodebin name=decoder !
+            %s !
             audio/x-raw-int,width=16,depth=16,channels=2 !
-            level name=level interval=%d !
+            identity name=tap !
             %s ! identity name=identity !
             filesink location="%s" name=sink''' % (
-                gstreamer.quoteParse(self._inpath).encode('utf-8'),
-                interval,
+                source,
                 self._profile.pipeline,
                 gstreamer.quoteParse(self._outpath).encode('utf-8'))
 
@@ -250,7 +269,18 @@ class EncodeTask(ctask.GstPipelineTask):
             except AttributeError, e:
                 logger.warning('Could not merge tags: %r', str(e))
 
+        # add a probe so we can feed the digests and track progress;
+        # add it before pausing so we also get the prerolled buffer
+        srcpad = self.pipeline.get_by_name('tap').get_static_pad('src')
+        self.gst.debug('adding srcpad buffer probe to %r' % srcpad)
+        ret = srcpad.add_buffer_probe(self._probe_handler)
+        self.gst.debug('added srcpad buffer probe to %r: %r' % (srcpad, ret))
+
     def paused(self):
+        # raw audio from a file descriptor has no duration to query
+        if self._inpath is None:
+            return
+
         # get length
         identity = self.pipeline.get_by_name('identity')
         logger.debug('query duration')
@@ -269,43 +299,17 @@ class EncodeTask(ctask.GstPipelineTask):
         logger.debug('total length: %r', length)
         self._length = length
 
-        duration = None
-        try:
-            duration, qformat = identity.query_duration(self.gst.FORMAT_TIME)
-        except self.gst.QueryError, e:
-            logger.debug('Could not query duration')
-        self._duration = duration
-
-        # set up level callbacks
-        # FIXME: publicize bus and reuse it instead of regetting and adding ?
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-
-        bus.connect('message::element', self._message_element_cb)
-        self._level = self.pipeline.get_by_name('level')
-
-        # set an interval that is smaller than the duration
-        # FIXME: check level and make sure it emits level up to the last
-        # sample, even if input is small
-        interval = self.gst.SECOND
-        if interval > duration:
-            interval = duration / 2
-        logger.debug('Setting level interval to %s, duration %s',
-            self.gst.TIME_ARGS(interval), self.gst.TIME_ARGS(duration))
-        self._level.set_property('interval', interval)
-        # add a probe so we can track progress
-        # we connect to level because this gives us offset in samples
-        srcpad = self._level.get_static_pad('src')
-        self.gst.debug('adding srcpad buffer probe to %r' % srcpad)
-        ret = srcpad.add_buffer_probe(self._probe_handler)
-        self.gst.debug('added srcpad buffer probe to %r: %r' % (srcpad, ret))
-
     def _probe_handler(self, pad, buffer):
-        # update progress based on buffer offset (expected to be in samples)
-        # versus length in samples
+        data = buffer.data
+        for d in self._digests:
+            d.update(data)
+        self.samples += len(data) / 4
+
+        # update progress based on samples seen versus length in samples
         # marshal to main thread
-        self.schedule(0, self.setProgress,
-            float(buffer.offset) / self._length)
+        if self._length:
+            self.schedule(0, self.setProgress,
+                float(self.samples) / self._length)
 
         # don't drop the buffer
         return True
@@ -314,45 +318,69 @@ class EncodeTask(ctask.GstPipelineTask):
         logger.debug('eos, scheduling stop')
         self.schedule(0, self.stop)
 
-    def _message_element_cb(self, bus, message):
-        if message.src != self._level:
-            return
+    def stopped(self):
+        self._closeFd()
+        self.peak = self._peak.peak
+        logger.debug('peak %r', self.peak)
 
-        s = message.structure
-        if s.get_name() != 'level':
-            return
+    def _closeFd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
 
-        if self._peakdB is None:
-            self._peakdB = s['peak'][0]
+class DecodeTask(ctask.GstPipelineTask):
+    """
+    I am a task that decodes a file to raw little-endian signed 16-bit
+    stereo audio, written to a file descriptor.
+    """
 
-        for p in s['peak']:
-            if self._peakdB < p:
-                logger.debug('higher peakdB found, now %r', self._peakdB)
-                self._peakdB = p
+    logCategory = 'DecodeTask'
 
-        # FIXME: works around a bug on F-15 where buffer probes don't seem
-        # to get triggered to update progress
-        if self._duration is not None:
-            self.schedule(0, self.setProgress,
-                float(s['stream-time'] + s['duration']) / self._duration)
+    description = 'Decoding'
 
-    def stopped(self):
-        if self._peakdB is not None:
-            logger.debug('peakdB %r', self._peakdB)
-            self.peak = math.sqrt(math.pow(10, self._peakdB / 10.0))
-            return
+    def __init__(self, inpath, fd):
+        """
+        @param fd: file descriptor to write the audio to; I close it when
+                   done
+        @type  fd: int
+        """
+        assert type(inpath) is unicode, "inpath %r is not unicode" % inpath
+
+        self._inpath = inpath
+        self._fd = fd
+
+        cgstreamer.removeAudioParsers()
+
+    def start(self, runner):
+        try:
+            ctask.GstPipelineTask.start(self, runner)
+        except:
+            self._closeFd()
+            raise
 
-        logger.warning('No peak found.')
+    def getPipelineDesc(self):
+        return '''
+            filesrc location="%s" !
+            decodebin name=decoder !
+            audioconvert !
+            %s,width=16,depth=16,channels=2 !
+            fdsink fd=%d sync=false''' % (
+                gstreamer.quoteParse(self._inpath).encode('utf-8'),
+                _RAW_CAPS, self._fd)
+
+    def bus_eos_cb(self, bus, message):
+        logger.debug('eos, scheduling stop')
+        self.schedule(0, self.stop)
+
+    def stopped(self):
+        self._closeFd()
 
-        self.peak = 0.0
+    def _closeFd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
-        if self._duration:
-            logger.warning('GStreamer level element did not send messages.')
-            # workaround for when the file is too short to have volume ?
-            if self._length == common.SAMPLES_PER_FRAME:
-                logger.warning('only one frame of audio, setting peak to 0.0')
-                self.peak = 0.0
 
 class TagReadTask(ctask.GstPipelineTask):
     """
@@ -255,14 +255,57 @@ def _getMetadata(releaseShort, release, discid, country=None):
 #     ripper.py
 
 
-def musicbrainz(discid, country=None, record=False):
+def _lookup(cache, key, refresh, function, *args, **kwargs):
+    # call a musicbrainzngs function, through the cache if any
+    if not cache:
+        return function(*args, **kwargs)
+
+    return cache.get(key, lambda: function(*args, **kwargs), refresh=refresh)
+
+
+# what _getMetadata needs of a release, and a disc id lookup can include
+_INCLUDES = ["artists", "artist-credits", "recordings", "release-groups",
+             "labels", "discids"]
+
+
+def _isComplete(release, discid):
+    """
+    Whether a release from a disc id lookup has all that L{_getMetadata}
+    needs, so that it does not need to be looked up by itself.
+    """
+    if 'artist-credit' not in release or 'medium-list' not in release:
+        return False
+
+    for medium in release['medium-list']:
+        if 'disc-list' not in medium:
+            return False
+        if discid not in [disc['id'] for disc in medium['disc-list']]:
+            continue
+        if 'track-list' not in medium:
+            return False
+        for t in medium['track-list']:
+            if 'artist-credit' not in t.get('recording', {}):
+                return False
+
+    return True
+
+
+def musicbrainz(discid, country=None, record=False, cache=None,
+        refresh=False):
     """
     Based on a MusicBrainz disc id, get a list of DiscMetadata objects
     for the given disc id.
 
+    The releases are looked up with the disc id in a single request; only
+    releases missing details in its response are looked up by themselves.
+
     Example disc id: Mj48G109whzEmAbPBoGvd4KyCS4-
 
-    @type  discid: str
+    @type  discid:  str
+    @param cache:   the cache of lookups to use, if any
+    @type  cache:   L{morituri.common.cache.MusicBrainzCache}
+    @param refresh: whether to look up again what is in the cache
+    @type  refresh: bool
 
     @rtype: list of L{DiscMetadata}
     """
@@ -272,8 +315,9 @@ def musicbrainz(discid, country=None, record=False):
     ret = []
 
     try:
-        result = musicbrainzngs.get_releases_by_discid(discid,
-            includes=["artists", "recordings", "release-groups"])
+        result = _lookup(cache, 'discid.' + discid, refresh,
+            musicbrainzngs.get_releases_by_discid, discid,
+            includes=_INCLUDES)
     except musicbrainzngs.ResponseError, e:
         if isinstance(e.cause, urllib2.HTTPError):
             if e.cause.code == 404:
@@ -297,16 +341,25 @@ def musicbrainz(discid, country=None, record=False):
             logger.debug('result %s: artist %r, title %r' % (
                 formatted, release['artist-credit-phrase'], release['title']))
 
-            # to get titles of recordings, we need to query the release with
-            # artist-credits
-
-            res = musicbrainzngs.get_release_by_id(
-                release['id'], includes=["artists", "artist-credits",
-                                         "recordings", "discids", "labels"])
-            _record(record, 'release', release['id'], res)
-            releaseDetail = res['release']
-            formatted = json.dumps(releaseDetail, sort_keys=False, indent=4)
-            logger.debug('release %s' % formatted)
+            releaseDetail = release
+            if not _isComplete(release, discid):
+                # to get titles of recordings, we need to query the release
+                # with artist-credits
+                logger.debug('release %r incomplete, looking it up',
+                    release['id'])
+                try:
+                    res = _lookup(cache, 'release.' + release['id'], refresh,
+                        musicbrainzngs.get_release_by_id,
+                        release['id'], includes=["artists", "artist-credits",
+                                                 "recordings", "discids",
+                                                 "labels"])
+                except musicbrainzngs.ResponseError, e:
+                    raise MusicBrainzException(e)
+                _record(record, 'release', release['id'], res)
+                releaseDetail = res['release']
+                formatted = json.dumps(releaseDetail, sort_keys=False,
+                    indent=4)
+                logger.debug('release %s' % formatted)
 
             md = _getMetadata(release, releaseDetail, discid, country)
             if md:
@@ -27,11 +27,12 @@ Common functionality and class for all programs using morituri.
 import musicbrainzngs
 import os
 import sys
-import time
+import threading
 
-from morituri.common import common, mbngs, cache, path
-from morituri.program import cdrdao, cdparanoia
+from morituri.common import accurip, common, mbngs, cache, path
+from morituri.program import cdrdao, cdparanoia, cdrom
 from morituri.image import image
+from morituri.result import result
 from morituri.extern.task import task, gstreamer
 
 import logging
@@ -41,6 +42,37 @@ logger = logging.getLogger(__name__)
 # FIXME: should Program have a runner ?
 
 
+class _Lookup(threading.Thread):
+    """
+    I call a function in a thread, keeping what it returns or raises.
+    """
+
+    _result = None
+    _excInfo = None
+
+    def __init__(self, function, *args):
+        threading.Thread.__init__(self, name='Lookup')
+        self.daemon = True
+        self._function = function
+        self._args = args
+
+    def run(self):
+        try:
+            self._result = self._function(*self._args)
+        except:
+            self._excInfo = sys.exc_info()
+
+    def getResult(self):
+        """
+        Wait for the function to return, and return what it returned, or
+        raise what it raised.
+        """
+        self.join()
+        if self._excInfo:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._result
+
+
 class Program:
     """
     I maintain program state and functionality.
@@ -61,14 +93,19 @@ class Program:
 
     _stdout = None
 
-    def __init__(self, config, record=False, stdout=sys.stdout):
+    def __init__(self, config, record=False, stdout=sys.stdout,
+            refresh=False):
         """
-        @param record: whether to record results of API calls for playback.
+        @param record:  whether to record results of API calls for playback.
+        @param refresh: whether to look up metadata again instead of using
+                        cached lookups.
         """
         self._record = record
+        self._refresh = refresh
         self._cache = cache.ResultCache()
         self._stdout = stdout
         self._config = config
+        self._lookups = {}
 
         d = {}
 
@@ -85,6 +122,19 @@ class Program:
 
         self._filter = path.PathFilter(**d)
 
+        # the musicbrainz section configures the cache of lookups
+        d = {}
+        for key, unit in {
+            'ttl': 86400, # days
+            'stale': 86400, # days
+            'size': 1024 * 1024, # MiB
+        }.items():
+            value = self._config.get('musicbrainz', 'cache_' + key)
+            if value is not None:
+                d[key] = float(value) * unit
+
+        self._mbcache = cache.MusicBrainzCache(**d)
+
     def setWorkingDirectory(self, workingDirectory):
         if workingDirectory:
             logger.info('Changing to working directory %s' % workingDirectory)
@@ -93,24 +143,15 @@ class Program:
     def getFastToc(self, runner, toc_pickle, device):
         """
         Retrieve the normal TOC table from a toc pickle or the drive.
-        Also retrieves the cdrdao version
 
-        @rtype: tuple of L{table.Table}, str
+        @rtype: L{table.Table}
         """
         def function(r, t):
             r.run(t)
 
         ptoc = cache.Persister(toc_pickle or None)
         if not ptoc.object:
-            from pkg_resources import parse_version as V
-            version = cdrdao.getCDRDAOVersion()
-            if V(version) < V('1.2.3rc2'):
-                sys.stdout.write('Warning: cdrdao older than 1.2.3 has a '
-                    'pre-gap length bug.\n'
-                    'See http://sourceforge.net/tracker/?func=detail'
-                    '&aid=604751&group_id=2171&atid=102171\n')
-            t = cdrdao.ReadTOCTask(device)
-            ptoc.persist(t.table)
+            ptoc.persist(cdrom.getFastToc(device))
         toc = ptoc.object
         assert toc.hasTOC()
         return toc
@@ -137,8 +178,20 @@ class Program:
             logger.debug('getTable: cddbdiscid %s, mbdiscid %s not in cache for offset %s, '
                 'reading table' % (
                 cddbdiscid, mbdiscid, offset))
-            t = cdrdao.ReadTableTask(device)
-            itable = t.table
+            try:
+                itable = cdrom.readTable(device)
+            except EnvironmentError, e:
+                logger.info('Cannot scan %s natively (%s), using cdrdao',
+                    device, e)
+                from pkg_resources import parse_version as V
+                version = cdrdao.getCDRDAOVersion()
+                if V(version) < V('1.2.3rc2'):
+                    sys.stdout.write('Warning: cdrdao older than 1.2.3 has a '
+                        'pre-gap length bug.\n'
+                        'See http://sourceforge.net/tracker/?func=detail'
+                        '&aid=604751&group_id=2171&atid=102171\n')
+                t = cdrdao.ReadTableTask(device)
+                itable = t.table
             tdict[offset] = itable
             ptable.persist(tdict)
             logger.debug('getTable: read table %r' % itable)
@@ -262,16 +315,60 @@ class Program:
 
         return ret
 
+    def prefetch(self, ittoc, mbdiscid, country=None):
+        """
+        Start looking up the disc in MusicBrainz, FreeDB and AccurateRip in
+        the background, so that the lookups overlap reading the full table.
+
+        L{getMusicBrainz}, L{getCDDB} and L{getAccurateRipResponses} then
+        wait for the lookups started for the same arguments instead of
+        doing them again.
+
+        @type  ittoc: L{morituri.image.table.Table}
+        """
+        for function, args in [
+            (self._queryMusicBrainz, (mbdiscid, country)),
+            (self._queryCDDB, (ittoc.getCDDBValues(), )),
+            (self._retrieveAccurateRip, (ittoc.getAccurateRipURL(), )),
+        ]:
+            lookup = _Lookup(function, *args)
+            self._lookups[(function.__name__, repr(args))] = lookup
+            lookup.start()
+
+    def _lookup(self, function, *args):
+        """
+        Call the function, or get the result of its prefetched call.
+        """
+        lookup = self._lookups.pop((function.__name__, repr(args)), None)
+        if lookup:
+            logger.debug('using prefetched %s%r', function.__name__, args)
+            return lookup.getResult()
+
+        return function(*args)
+
+    def _queryCDDB(self, cddbdiscid):
+        import CDDB
+        return CDDB.query(cddbdiscid)
+
+    def _retrieveAccurateRip(self, url):
+        return accurip.AccuCache().retrieve(url)
+
+    def getAccurateRipResponses(self, url):
+        """
+        @param url: the AccurateRip URL of the disc
+
+        @rtype: list of L{accurip.AccurateRipResponse} or None
+        """
+        return self._lookup(self._retrieveAccurateRip, url)
+
     def getCDDB(self, cddbdiscid):
         """
         @param cddbdiscid: list of id, tracks, offsets, seconds
 
         @rtype: str
         """
-        # FIXME: convert to nonblocking?
-        import CDDB
         try:
-            code, md = CDDB.query(cddbdiscid)
+            code, md = self._lookup(self._queryCDDB, cddbdiscid)
             logger.debug('CDDB query result: %r, %r', code, md)
             if code == 200:
                 return md['title']
@@ -285,36 +382,52 @@ class Program:
 
         return None
 
-    def getMusicBrainz(self, ittoc, mbdiscid, release=None, country=None, prompt=False):
+    def _queryMusicBrainz(self, mbdiscid, country):
         """
-        @type  ittoc: L{morituri.image.table.Table}
+        @returns: the releases found, the last error and the warnings to
+                  show
         """
-        # look up disc on musicbrainz
-        self._stdout.write('Disc duration: %s, %d audio tracks\n' % (
-            common.formatTime(ittoc.duration() / 1000.0),
-            ittoc.getAudioTracks()))
-        logger.debug('MusicBrainz submit url: %r',
-            ittoc.getMusicBrainzSubmitURL())
-        ret = None
-
         metadatas = None
         e = None
+        warnings = []
 
         for _ in range(0, 4):
             try:
                 metadatas = mbngs.musicbrainz(mbdiscid,
                     country=country,
-                    record=self._record)
+                    record=self._record,
+                    cache=self._mbcache,
+                    refresh=self._refresh)
+                break
             except mbngs.NotFoundException, e:
                 break
             except musicbrainzngs.NetworkError, e:
-                self._stdout.write("Warning: network error: %r\n" % (e, ))
+                warnings.append("Warning: network error: %r\n" % (e, ))
                 break
             except mbngs.MusicBrainzException, e:
-                self._stdout.write("Warning: %r\n" % (e, ))
-                time.sleep(5)
+                # musicbrainzngs spaces the tries by its rate limit
+                warnings.append("Warning: %r\n" % (e, ))
                 continue
 
+        return metadatas, e, warnings
+
+    def getMusicBrainz(self, ittoc, mbdiscid, release=None, country=None, prompt=False):
+        """
+        @type  ittoc: L{morituri.image.table.Table}
+        """
+        # look up disc on musicbrainz
+        self._stdout.write('Disc duration: %s, %d audio tracks\n' % (
+            common.formatTime(ittoc.duration() / 1000.0),
+            ittoc.getAudioTracks()))
+        logger.debug('MusicBrainz submit url: %r',
+            ittoc.getMusicBrainzSubmitURL())
+        ret = None
+
+        metadatas, e, warnings = self._lookup(self._queryMusicBrainz,
+            mbdiscid, country)
+        for warning in warnings:
+            self._stdout.write(warning)
+
         if not metadatas:
             if e:
                 self._stdout.write("Error: %r\n" % (e, ))
@@ -537,9 +650,17 @@ class Program:
             else:
                 raise
 
-        ret = trackResult.testcrc == t.checksum
+        # a single read has no test read to compare to, and the track
+        # is neither when segments of it were read again
+        expected = trackResult.testcrc
+        if trackResult.singleRead:
+            expected = trackResult.copycrc
+        elif trackResult.rereadSegments:
+            expected = trackResult.rereadcrc
+
+        ret = expected == t.checksum
         logger.debug('verifyTrack: track result crc %r, file crc %r, result %r',
-                     trackResult.testcrc, t.checksum, ret)
+                     expected, t.checksum, ret)
         return ret
 
     def ripTrack(self, runner, trackResult, offset, device, profile, taglist,
@@ -553,11 +674,42 @@ class Program:
         @param number:      track number (1-based)
         @type  number:      int
         """
-        if trackResult.number == 0:
-            start, stop = self.getHTOA()
-        else:
-            start = self.result.table.getTrackStart(trackResult.number)
-            stop = self.result.table.getTrackEnd(trackResult.number)
+        t = self.getRipTrackTask(trackResult, offset, device, profile,
+            taglist, overread, what)
+
+        runner.run(t)
+
+        self.setRipTrackResult(trackResult, t)
+
+    def getRipTrackTask(self, trackResult, offset, device, profile, taglist,
+        overread, what=None, verify=True, responses=None, minConfidence=1,
+        paranoia=True, resumable=False, reader='cdparanoia'):
+        """
+        Get the task ripping the track, to run separately.  Once it ran,
+        pass it to L{setRipTrackResult}.
+
+        @param verify: whether the task also verifies the encoded track;
+                       otherwise its getVerifyTask() needs to be run.
+        @type  verify: bool
+        @param responses:     AccurateRip responses; if given, the track is
+                              read only once if it matches one of them
+        @type  responses:     list of L{accurip.AccurateRipResponse}
+        @param minConfidence: the confidence needed for a single read
+        @type  minConfidence: int
+        @param paranoia:      whether to read with paranoia, or in burst
+                              mode
+        @type  paranoia:      bool
+        @param resumable:     whether to checkpoint the reads in the rip
+                              result as they go, and resume them from
+                              there if they were interrupted before
+        @type  resumable:     bool
+        @param reader:        what reads the track; one of
+                              L{cdparanoia.BACKENDS}
+        @type  reader:        str
+
+        @rtype: L{cdparanoia.ReadVerifyTrackTask}
+        """
+        start, stop = self.getTrackSpan(trackResult.number)
 
         dirname = os.path.dirname(trackResult.filename)
         if not os.path.exists(dirname):
@@ -566,16 +718,102 @@ class Program:
         if not what:
             what='track %d' % (trackResult.number, )
 
-        t = cdparanoia.ReadVerifyTrackTask(trackResult.filename,
+        # HTOA is not covered by AccurateRip
+        trackNumber = trackCount = None
+        if trackResult.number > 0:
+            trackNumber = trackResult.number
+            trackCount = self.result.table.getAudioTracks()
+
+        onCheckpoint = None
+        if resumable:
+            if not trackResult.checkpoint:
+                trackResult.checkpoint = result.Checkpoint()
+            onCheckpoint = self.saveRipResult
+
+        return cdparanoia.ReadVerifyTrackTask(trackResult.filename,
             self.result.table, start, stop, overread,
             offset=offset,
             device=device,
             profile=profile,
             taglist=taglist,
-            what=what)
+            what=what,
+            trackNumber=trackNumber,
+            trackCount=trackCount,
+            verify=verify,
+            responses=responses,
+            minConfidence=minConfidence,
+            paranoia=paranoia,
+            checkpoint=resumable and trackResult.checkpoint or None,
+            onCheckpoint=onCheckpoint,
+            reader=reader)
+
+    def getTrackSpan(self, number):
+        """
+        @param number: the track number, or 0 for the hidden track one audio
 
-        runner.run(t)
+        @returns: the first and last frame of the track
+        @rtype:   tuple of (int, int)
+        """
+        if number == 0:
+            return self.getHTOA()
+
+        return (self.result.table.getTrackStart(number),
+            self.result.table.getTrackEnd(number))
+
+    def getRipDiscTask(self, trackResults, offset, device, profile, overread,
+        what=None, whats=None, responses=None, minConfidence=1,
+        paranoia=True, reader='cdparanoia'):
+        """
+        Get the task ripping consecutive tracks in one continuous read, to
+        run separately.  Once it ran, pass each of its tracks that has a
+        checksum to L{setRipTrackResult}.
+
+        @param trackResults: the results of the tracks to rip, in order;
+                             each track starts right after the previous one
+        @type  trackResults: list of L{result.TrackResult}
+
+        See L{getRipTrackTask} for the other parameters.
+
+        @rtype: L{cdparanoia.ReadVerifyDiscTask}
+        """
+        numbers = [r.number for r in trackResults]
+
+        for r in trackResults:
+            dirname = os.path.dirname(r.filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+        if not what:
+            what = 'tracks %d to %d' % (numbers[0], numbers[-1])
 
+        # HTOA is not covered by AccurateRip
+        trackNumbers = [n or None for n in numbers]
+
+        return cdparanoia.ReadVerifyDiscTask(
+            [r.filename for r in trackResults],
+            self.result.table, [self.getTrackSpan(n) for n in numbers],
+            overread,
+            offset=offset,
+            device=device,
+            profile=profile,
+            taglists=[self.getTagList(n) for n in numbers],
+            what=what,
+            whats=whats or ['track %d' % n for n in numbers],
+            trackNumbers=trackNumbers,
+            trackCount=self.result.table.getAudioTracks(),
+            responses=responses,
+            minConfidence=minConfidence,
+            paranoia=paranoia,
+            reader=reader)
+
+    def setRipTrackResult(self, trackResult, t):
+        """
+        Store the results of a rip task that ran into trackResult.
+
+        @type  trackResult: L{result.TrackResult}
+        @type  t:           L{cdparanoia.ReadVerifyTrackTask} or
+                            L{cdparanoia.DiscTrackRead}
+        """
         logger.debug('ripped track')
         logger.debug('test speed %.3f/%.3f seconds' % (
             t.testspeed, t.testduration))
@@ -583,8 +821,18 @@ class Program:
             t.copyspeed, t.copyduration))
         trackResult.testcrc = t.testchecksum
         trackResult.copycrc = t.copychecksum
+        trackResult.rereadSegments = t.rereadSegments
+        trackResult.rereadcrc = None
+        if t.rereadSegments:
+            trackResult.rereadcrc = t.checksum
+        trackResult.singleRead = t.singleRead
         trackResult.peak = t.peak
+        trackResult.ARCRC = t.arv1
+        trackResult.ARCRCv2 = t.arv2
         trackResult.quality = t.quality
+        if t.readCounts is not None:
+            trackResult.readCounts = cdparanoia.encodeReadCounts(
+                t.readCounts)
         trackResult.testspeed = t.testspeed
         trackResult.copyspeed = t.copyspeed
         # we want rerips to add cumulatively to the time
@@ -595,6 +843,11 @@ class Program:
             trackResult.filename = t.path
             logger.info('Filename changed to %r', trackResult.filename)
 
+        # the reads are done with
+        if trackResult.checkpoint:
+            cdparanoia.clearCheckpoint(trackResult.checkpoint)
+            trackResult.checkpoint = None
+
     def retagImage(self, runner, taglists):
         cueImage = image.Image(self.cuePath)
         t = image.ImageRetagTask(cueImage, taglists)
@@ -607,17 +860,34 @@ class Program:
         Needs an initialized self.result.
         Will set accurip and friends on each TrackResult.
         """
+        runner.run(self.getVerifyImageTask(responses))
 
-        logger.debug('verifying Image against %d AccurateRip responses',
-            len(responses or []))
+    def getVerifyImageTask(self, responses):
+        """
+        Get the task verifying our image against the given AccurateRip
+        responses, to run separately; see L{verifyImage}.
 
-        cueImage = image.Image(self.cuePath)
-        verifytask = image.ImageVerifyTask(cueImage)
-        cuetask = image.AccurateRipChecksumTask(cueImage)
-        runner.run(verifytask)
-        runner.run(cuetask)
+        @rtype: L{VerifyImageTask}
+        """
+        return VerifyImageTask(self, responses)
 
-        self._verifyImageWithChecksums(responses, cuetask.checksums)
+    def getRippedChecksums(self, tracks):
+        """
+        Get the AccurateRip checksums calculated while ripping.
+
+        @param tracks: the number of tracks
+        @type  tracks: int
+
+        @returns: the checksum of each track, or None if a track lacks one
+        @rtype:   list of int or None
+        """
+        checksums = []
+        for i in range(tracks):
+            trackResult = self.result.getTrackResult(i + 1)
+            if not trackResult or trackResult.ARCRC is None:
+                return None
+            checksums.append(trackResult.ARCRC)
+        return checksums
 
     def _verifyImageWithChecksums(self, responses, checksums):
         # loop over tracks to set our calculated AccurateRip CRC's
@@ -737,3 +1007,61 @@ class Program:
         self.logPath = logPath
 
         return logPath
+
+
+class VerifyImageTask(task.MultiSeparateTask):
+    """
+    I verify the image of a program against AccurateRip responses.
+
+    The checksums are calculated while ripping; I only decode the image
+    again if a track lacks one.
+    """
+
+    description = "Verifying image"
+
+    def __init__(self, program, responses):
+        """
+        @type program:   L{Program}
+        @type responses: list of L{accurip.AccurateRipResponse} or None
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        logger.debug('verifying Image against %d AccurateRip responses',
+            len(responses or []))
+
+        self._program = program
+        self._responses = responses
+        self._image = image.Image(program.cuePath)
+        self._checksumtask = None
+        self.addTask(image.ImageVerifyTask(self._image))
+
+    ### ITaskListener methods
+    def described(self, taskk, description):
+        self.setDescription(description)
+
+    def stopped(self, taskk):
+        if not taskk.exception:
+            checksums = None
+            if taskk is self._checksumtask:
+                checksums = taskk.checksums
+            else:
+                checksums = self._program.getRippedChecksums(
+                    len(self._image.cue.table.tracks))
+                if checksums is None:
+                    self._checksumtask = image.AccurateRipChecksumTask(
+                        self._image)
+                    self.addTask(self._checksumtask)
+                else:
+                    logger.debug('using AccurateRip checksums calculated '
+                        'while ripping')
+
+            if checksums is not None:
+                try:
+                    self._program._verifyImageWithChecksums(
+                        self._responses, checksums)
+                except Exception, e:
+                    self.setException(e)
+                    self.stop()
+                    return
+
+        task.MultiSeparateTask.stopped(self, taskk)
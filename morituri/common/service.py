@@ -0,0 +1,701 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_service -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A local rip service: a long-running process that owns the drives and runs
+rip, image verify, image retag and encode jobs, submitted through an HTTP
+API on a unix socket.
+
+Jobs run whipper commands in processes forked from a worker process that
+loaded everything once, so they start without paying for it again.  A job
+waits in the queue until the resources it needs are free: its drive for a
+rip, a CPU for the other jobs.
+
+The API speaks JSON:
+ - POST /jobs with kind, args and, for rips, device: submit a job
+ - GET /jobs: the state of all jobs
+ - GET /jobs/<id>: the state of a job, with its output and result
+ - DELETE /jobs/<id>: cancel a job
+"""
+
+import BaseHTTPServer
+import SocketServer
+import httplib
+import json
+import multiprocessing
+import os
+import re
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from morituri.common import directory
+from morituri.extern.task import task
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def getSocketPath():
+    """
+    @returns: the default path of the socket of the service
+    @rtype:   unicode
+    """
+    return os.path.join(directory.cache_path(), u'serve.sock')
+
+
+def _getRipArgv(device, args):
+    if not device:
+        raise ValueError('a rip needs a device')
+    # one lock per drive, whatever path it is known by
+    device = os.path.realpath(device)
+    return ['cd', '-d', device, 'rip'] + args, ['drive:%s' % device]
+
+
+# kind -> function getting the command line and resources of a job from
+# its device and arguments
+KINDS = {
+    'rip': _getRipArgv,
+    'verify': lambda device, args: (['image', 'verify'] + args, ['cpu']),
+    'retag': lambda device, args: (['image', 'retag'] + args, ['cpu']),
+    'encode': lambda device, args: (['debug', 'encode'] + args, ['cpu']),
+}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def describeRipResult(ripResult, logPath=None):
+    """
+    Describe the result of a rip for the API.
+
+    @type  ripResult: L{morituri.result.result.RipResult}
+    @param logPath:   the path of the log of the rip
+
+    @rtype: dict
+    """
+    tracks = []
+    for t in ripResult.tracks:
+        tracks.append({
+            'number': t.number,
+            'filename': t.filename,
+            'peak': t.peak,
+            'quality': t.quality,
+            'testcrc': t.testcrc,
+            'copycrc': t.copycrc,
+            'rereadSegments': t.rereadSegments,
+            'accurip': t.accurip,
+            'ARCRC': t.ARCRC,
+            'ARDBCRC': t.ARDBCRC,
+            'ARDBConfidence': t.ARDBConfidence,
+        })
+
+    return {
+        'artist': ripResult.artist,
+        'title': ripResult.title,
+        'offset': ripResult.offset,
+        'log': logPath,
+        'tracks': tracks,
+    }
+
+
+def runCommand(argv):
+    """
+    Run a whipper command.
+
+    @param argv: the arguments, without the program name
+    @type  argv: list of str
+
+    @returns: the return code of the command, and the result of the rip
+              it did, if any
+    @rtype:   tuple of (int, dict or None)
+    """
+    from morituri.command import main
+
+    cmd = main.Whipper(argv, 'whipper', None)
+    ret = cmd.do()
+
+    # the result of the innermost subcommand, when it ripped
+    while hasattr(cmd, 'cmd'):
+        cmd = cmd.cmd
+    prog = getattr(cmd, 'program', None)
+    res = None
+    if prog and prog.result:
+        res = describeRipResult(prog.result, prog.logPath)
+
+    return ret or 0, res
+
+
+class Job:
+    """
+    I am a job of the service.
+
+    @ivar id:          the id of the job
+    @type id:          int
+    @ivar kind:        the kind of the job; one of L{KINDS}
+    @ivar argv:        the command the job runs
+    @type argv:        list of str
+    @ivar resources:   what the job needs for itself while it runs
+    @type resources:   list of str
+    @ivar state:       one of L{QUEUED}, L{RUNNING}, L{DONE}, L{FAILED} or
+                       L{CANCELLED}
+    @ivar description: what the job does now, as described by its task
+    @ivar progress:    the progress of that, from 0.0 to 1.0
+    @ivar output:      the last lines the job wrote
+    @type output:      list of str
+    @ivar result:      the result of the rip the job did, if any
+    @type result:      dict
+    """
+
+    description = None
+    progress = 0.0
+    result = None
+    returncode = None
+    pid = None
+    started = None
+    ended = None
+
+    _OUTPUT_LINES = 100
+
+    def __init__(self, id, kind, device, args):
+        if kind not in KINDS:
+            raise ValueError('unknown kind of job %r' % kind)
+
+        self.id = id
+        self.kind = kind
+        self.device = device
+        self.args = args
+        self.argv, self.resources = KINDS[kind](device, args)
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.output = []
+
+    def addLine(self, line):
+        self.output.append(line)
+        del self.output[:-self._OUTPUT_LINES]
+
+    def setStatus(self, description, progress):
+        self.description = description
+        self.progress = progress
+
+    def describe(self, output=False):
+        """
+        @param output: whether to include the output and the result
+
+        @rtype: dict
+        """
+        d = {
+            'id': self.id,
+            'kind': self.kind,
+            'device': self.device,
+            'args': self.args,
+            'state': self.state,
+            'description': self.description,
+            'progress': self.progress,
+            'returncode': self.returncode,
+            'submitted': self.submitted,
+            'started': self.started,
+            'ended': self.ended,
+        }
+        if output:
+            d['output'] = self.output
+            d['result'] = self.result
+        return d
+
+
+class _EventWriter:
+    """
+    I write the output of a job as events of the worker.  Text ending in a
+    carriage return is the status line of a runner, for terminals; it is
+    left out, as the tasks run are followed by a L{_JobListener}.
+    """
+
+    def __init__(self, fd, job):
+        self._fd = fd
+        self._job = job
+        self._partial = ''
+
+    def write(self, data):
+        data = self._partial + data
+        parts = re.split('([\r\n])', data)
+        self._partial = parts.pop()
+        for text, end in zip(parts[::2], parts[1::2]):
+            if end == '\n':
+                self.send({'line': text.decode('utf-8', 'replace')})
+
+    def flush(self):
+        pass
+
+    def send(self, event):
+        _sendJobEvent(self._fd, self._job, event)
+
+
+class _JobListener(task.ITaskListener):
+    """
+    I send the description and progress of the tasks a job runs as events
+    of the worker, when they change by a percent or more.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._sent = None
+
+    def _send(self, description, progress):
+        status = (description, int(progress * 100))
+        if status == self._sent:
+            return
+        self._sent = status
+        if isinstance(description, str):
+            description = description.decode('utf-8', 'replace')
+        self._writer.send({'description': description,
+            'progress': progress})
+
+    ### ITaskListener methods
+    def progressed(self, task, value):
+        self._send(task.description, value)
+
+    def described(self, task, description):
+        self._send(description, task.progress)
+
+
+# the processes of all jobs write to the same pipe; writes up to PIPE_BUF
+# bytes are atomic, so longer events are written in parts
+_PART = 1500
+
+
+def _sendJobEvent(fd, job, event):
+    data = json.dumps(event)
+    while len(data) > _PART:
+        _send(fd, {'job': job, 'part': data[:_PART]})
+        data = data[_PART:]
+    _send(fd, {'job': job, 'last': data})
+
+
+def _send(fd, event):
+    data = json.dumps(event) + '\n'
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _runJob(events, job, argv, run):
+    """
+    Run a job in a process forked by the worker.
+    """
+    writer = _EventWriter(events, job)
+    task.SyncRunner.listeners = [_JobListener(writer)]
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+    sys.stdout = writer
+
+    ret, res = 1, None
+    try:
+        ret, res = run(argv)
+    except SystemExit, e:
+        ret = e.code
+    except:
+        for line in traceback.format_exc().splitlines():
+            writer.send({'line': line})
+
+    if writer._partial:
+        writer.write('\n')
+    writer.send({'result': res})
+    os._exit(ret and 1 or 0)
+
+
+def _work(requests, events, run):
+    """
+    Fork a process for each job requested, and tell when it exits.
+    """
+    pids = {}
+    buf = ''
+    while True:
+        ready, _, _ = select.select([requests], [], [], 0.5)
+
+        while pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            if os.WIFEXITED(status):
+                returncode = os.WEXITSTATUS(status)
+            else:
+                returncode = -os.WTERMSIG(status)
+            _send(events, {'job': pids.pop(pid), 'returncode': returncode})
+
+        if not ready:
+            continue
+
+        data = os.read(requests, 4096)
+        if not data:
+            # the service is gone
+            break
+
+        lines = (buf + data).split('\n')
+        buf = lines.pop()
+        for line in lines:
+            request = json.loads(line)
+            pid = os.fork()
+            if not pid:
+                os.close(requests)
+                _runJob(events, request['job'], request['argv'], run)
+            pids[pid] = request['job']
+            _send(events, {'job': request['job'], 'pid': pid})
+
+    os._exit(0)
+
+
+class _Worker:
+    """
+    I am the process forking a process for each job.  I am forked before
+    the main loop of the service runs, so that the processes of jobs do not
+    share its state.
+    """
+
+    def __init__(self, run):
+        requests, self._requests = os.pipe()
+        self.events, events = os.pipe()
+
+        self.pid = os.fork()
+        if not self.pid:
+            os.close(self._requests)
+            os.close(self.events)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                _work(requests, events, run)
+            finally:
+                os._exit(1)
+
+        os.close(requests)
+        os.close(events)
+        self._buffer = ''
+
+    def start(self, job):
+        _send(self._requests, {'job': job.id, 'argv': job.argv})
+
+    def read(self):
+        """
+        @returns: the events available, or None once the worker is gone
+        @rtype:   list of dict
+        """
+        data = os.read(self.events, 65536)
+        if not data:
+            return None
+
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()
+        return [json.loads(line) for line in lines]
+
+    def stop(self):
+        os.close(self._requests)
+        os.waitpid(self.pid, 0)
+        os.close(self.events)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    timeout = 10
+
+    def log_message(self, format, *args):
+        logger.debug('request: ' + format, *args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _getJob(self):
+        m = re.match(r'^/jobs/(\d+)$', self.path)
+        job = m and self.server.service.jobs.get(int(m.group(1)))
+        if not job:
+            self._reply(404, {'error': 'no job at %s' % self.path})
+        return job
+
+    def do_GET(self):
+        if self.path == '/jobs':
+            service = self.server.service
+            self._reply(200, [service.jobs[i].describe()
+                for i in sorted(service.jobs)])
+            return
+
+        job = self._getJob()
+        if job:
+            self._reply(200, job.describe(output=True))
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self._reply(404, {'error': 'cannot submit to %s' % self.path})
+            return
+
+        try:
+            length = int(self.headers.getheader('Content-Length') or 0)
+            spec = json.loads(self.rfile.read(length))
+            job = self.server.service.submit(spec['kind'],
+                spec.get('device'), [str(a) for a in spec.get('args', [])])
+        except (KeyError, ValueError, TypeError), e:
+            self._reply(400, {'error': str(e)})
+            return
+
+        self._reply(201, job.describe())
+
+    def do_DELETE(self):
+        job = self._getJob()
+        if job:
+            self.server.service.cancel(job)
+            self._reply(200, job.describe())
+
+
+class _Server(SocketServer.UnixStreamServer):
+
+    def __init__(self, path, service):
+        SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        self.service = service
+
+
+class ServiceTask(task.Task):
+    """
+    I serve the API of the service, and run its jobs, until stopped.
+
+    @ivar jobs: all jobs submitted, by id
+    @type jobs: dict of int -> L{Job}
+    """
+
+    description = 'Serving'
+
+    def __init__(self, path=None, cpus=None, run=runCommand):
+        """
+        @param path: the path of the socket to serve on
+        @type  path: unicode
+        @param cpus: how many jobs needing a CPU can run at once; defaults
+                     to the number of CPUs
+        @type  cpus: int
+        @param run:  runs the command of a job in its process; see
+                     L{runCommand}
+
+        The process forking the processes of jobs is started here, so
+        create me before running a main loop.
+        """
+        self.path = path or getSocketPath()
+        self.jobs = {}
+        self._capacity = {'cpu': cpus or multiprocessing.cpu_count()}
+        self._busy = {}
+        self._worker = _Worker(run)
+        self._server = None
+        self._parts = {}
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = _Server(self.path, self)
+        logger.info('serving on %s', self.path)
+
+        self.watch(self._server.fileno(), self._accept)
+        self.watch(self._worker.events, self._read)
+
+    def stop(self):
+        for job in self.jobs.values():
+            if job.state == RUNNING and job.pid:
+                os.kill(job.pid, signal.SIGTERM)
+
+        if self._server:
+            self._server.server_close()
+            os.unlink(self.path)
+            self._server = None
+        if self._worker:
+            self._worker.stop()
+            self._worker = None
+
+        task.Task.stop(self)
+
+    def submit(self, kind, device=None, args=None):
+        """
+        Queue a job.
+
+        @rtype: L{Job}
+        """
+        job = Job(len(self.jobs) + 1, kind, device, args or [])
+        self.jobs[job.id] = job
+        logger.debug('queued job %d: %r', job.id, job.argv)
+        self.schedule(0, self._startJobs)
+        return job
+
+    def cancel(self, job):
+        """
+        Cancel a job, stopping it if it runs.
+        """
+        if job.state == QUEUED:
+            job.state = CANCELLED
+        elif job.state == RUNNING and job.pid:
+            job.state = CANCELLED
+            os.kill(job.pid, signal.SIGTERM)
+
+    def _free(self, job):
+        for r in job.resources:
+            if self._busy.get(r, 0) >= self._capacity.get(r, 1):
+                return False
+        return True
+
+    def _startJobs(self):
+        if not self.running:
+            return
+
+        # in order, skipping the jobs waiting for resources
+        for i in sorted(self.jobs):
+            job = self.jobs[i]
+            if job.state != QUEUED or not self._free(job):
+                continue
+
+            for r in job.resources:
+                self._busy[r] = self._busy.get(r, 0) + 1
+            job.state = RUNNING
+            job.started = time.time()
+            logger.debug('starting job %d', job.id)
+            self._worker.start(job)
+
+    def _accept(self):
+        if not self.running:
+            return False
+
+        self._server.handle_request()
+        return True
+
+    def _read(self):
+        if not self.running:
+            return False
+
+        events = self._worker.read()
+        if events is None:
+            self.setException(RuntimeError('the worker process exited'))
+            self.stop()
+            return False
+
+        for event in events:
+            job = self.jobs[event['job']]
+            if 'part' in event:
+                self._parts.setdefault(job.id, []).append(event['part'])
+                continue
+            if 'last' in event:
+                parts = self._parts.pop(job.id, [])
+                event = json.loads(''.join(parts + [event['last']]))
+            self._handle(job, event)
+        return True
+
+    def _handle(self, job, event):
+        if 'pid' in event:
+            job.pid = event['pid']
+            # cancelled before it started
+            if job.state == CANCELLED:
+                os.kill(job.pid, signal.SIGTERM)
+        elif 'line' in event:
+            job.addLine(event['line'])
+        elif 'progress' in event:
+            job.setStatus(event['description'], event['progress'])
+        elif 'result' in event:
+            job.result = event['result']
+        elif 'returncode' in event:
+            job.returncode = event['returncode']
+            job.ended = time.time()
+            job.pid = None
+            if job.state != CANCELLED:
+                job.state = job.returncode == 0 and DONE or FAILED
+                if job.state == DONE:
+                    job.progress = 1.0
+            logger.debug('job %d %s', job.id, job.state)
+
+            for r in job.resources:
+                self._busy[r] -= 1
+            self.schedule(0, self._startJobs)
+
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceClient:
+    """
+    I talk to the service.
+    """
+
+    def __init__(self, path=None):
+        self._path = path or getSocketPath()
+
+    def _request(self, method, url, body=None):
+        connection = _UnixHTTPConnection(self._path)
+        try:
+            headers = {}
+            if body is not None:
+                body = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, url, body, headers)
+            response = connection.getresponse()
+            data = json.loads(response.read())
+        finally:
+            connection.close()
+
+        if response.status >= 400:
+            raise ServiceError(data.get('error'))
+        return data
+
+    def submit(self, kind, args=None, device=None):
+        """
+        @returns: the state of the submitted job
+        @rtype:   dict
+        """
+        return self._request('POST', '/jobs',
+            {'kind': kind, 'device': device, 'args': args or []})
+
+    def getJobs(self):
+        """
+        @rtype: list of dict
+        """
+        return self._request('GET', '/jobs')
+
+    def getJob(self, id):
+        """
+        @returns: the state of the job, with its output and result
+        @rtype:   dict
+        """
+        return self._request('GET', '/jobs/%d' % id)
+
+    def cancel(self, id):
+        """
+        @rtype: dict
+        """
+        return self._request('DELETE', '/jobs/%d' % id)
@@ -1,11 +1,13 @@
 # -*- Mode: Python -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import multiprocessing
 import os
 import signal
 import subprocess
 
-from morituri.extern import asyncsub
+import gobject
+
 from morituri.extern.task import task, gstreamer
 
 import logging
@@ -16,6 +18,75 @@ class SyncRunner(task.SyncRunner):
     pass
 
 
+class BackgroundRunner(SyncRunner):
+    """
+    I run tasks in the background: they start right away, and make progress
+    whenever a main loop runs, such as while a L{SyncRunner} runs another
+    task.  Call L{wait} to run until all of them stopped.
+
+    Check the exception of each task once it stopped.
+    """
+
+    def __init__(self):
+        SyncRunner.__init__(self, verbose=False)
+        self._tasks = []
+        self._loop = None
+
+    def run(self, task):
+        """
+        Start the given task in the background.
+        """
+        self.debug('run task %r in the background', task)
+        self._tasks.append(task)
+        task.addListener(self)
+        for listener in self.listeners:
+            if listener not in (task._listeners or []):
+                task.addListener(listener)
+        gobject.timeout_add(0L, self._startWrap, task)
+
+    @property
+    def running(self):
+        """
+        The number of tasks that did not stop yet.
+
+        @rtype: int
+        """
+        return len(self._tasks)
+
+    def wait(self):
+        """
+        Run until all tasks stopped.
+        """
+        if not self._tasks:
+            return
+
+        self._loop = gobject.MainLoop()
+        self._loop.run()
+        self._loop = None
+
+    ### ITaskListener methods
+    def progressed(self, task, value):
+        pass
+
+    def described(self, task, description):
+        pass
+
+    def stopped(self, task):
+        if task.running:
+            # a scheduled call or watch of the task, or of a task it runs,
+            # failed; stop it, so that whoever runs it learns of the failure
+            self.debug('stopping failed task %r', task)
+            task.stop()
+            return
+        if task not in self._tasks:
+            return
+
+        self.debug('stopped background task %r', task)
+        self._tasks.remove(task)
+        if not self._tasks and self._loop:
+            self._loop.quit()
+
+
 class LoggableTask(task.Task):
     pass
 
@@ -28,13 +99,86 @@ class GstPipelineTask(gstreamer.GstPipelineTask):
     pass
 
 
+class MultiParallelTask(task.BaseMultiTask):
+    """
+    I perform multiple tasks at the same time, all on the same runner.
+    I track progress as the average progress of all tasks.
+
+    I stop once all of my tasks have stopped.  If any of them failed, I
+    take over the exception of the first one that did.
+    """
+
+    description = 'Doing various tasks in parallel'
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        self._running = len(self.tasks)
+        self._progress = {}
+
+        if not self.tasks:
+            self.warning('no tasks')
+            self.stop()
+            return
+
+        # start all tasks, even if one fails to start; they may depend on
+        # each other to finish
+        for t in self.tasks:
+            t.addListener(self)
+        for t in self.tasks:
+            try:
+                t.start(runner)
+            except Exception, e:
+                logger.debug('exception starting %r: %r', t, e)
+                t.setException(e)
+                self.stopped(t)
+
+    ### ITaskListener methods
+    def progressed(self, task, value):
+        self._progress[task] = value
+        self.setProgress(sum(self._progress.values()) / len(self.tasks))
+
+    def described(self, task, description):
+        pass
+
+    def stopped(self, task):
+        if task.exception and not self.exception:
+            self.exception = task.exception
+            self.exceptionMessage = task.exceptionMessage
+            self.exceptionTraceback = task.exceptionTraceback
+
+        self._running -= 1
+        if not self._running:
+            self.stop()
+
+
+class LineBuffer:
+    """
+    I split output read in chunks of any size into complete lines.
+    """
+
+    def __init__(self):
+        self._partial = ''
+
+    def feed(self, data):
+        """
+        @returns: the lines completed by data, without line endings
+        @rtype:   list of str
+        """
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        return lines
+
+
 class PopenTask(task.Task):
     """
     I am a task that runs a command using Popen.
+
+    Its output is read whenever it becomes available, without polling.
     """
 
     logCategory = 'PopenTask'
-    bufsize = 1024
+    bufsize = 65536 # maximum number of bytes read at once
     command = None
     cwd = None
 
@@ -42,8 +186,7 @@ class PopenTask(task.Task):
         task.Task.start(self, runner)
 
         try:
-            self._popen = asyncsub.Popen(self.command,
-                bufsize=self.bufsize,
+            self._popen = subprocess.Popen(self.command,
                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE, close_fds=True, cwd=self.cwd)
         except OSError, e:
@@ -56,44 +199,35 @@ class PopenTask(task.Task):
         logger.debug('Started %r with pid %d', self.command,
             self._popen.pid)
 
-        self.schedule(1.0, self._read, runner)
+        self._open = 2 # pipes not at end of file yet
+        self.watch(self._popen.stdout.fileno(), self._read,
+            self._popen.stdout, 'stdout', self.readbytesout)
+        self.watch(self._popen.stderr.fileno(), self._read,
+            self._popen.stderr, 'stderr', self.readbyteserr)
 
-    def _read(self, runner):
-        try:
-            read = False
-
-            ret = self._popen.recv()
+    def _read(self, pipe, name, callback):
+        if not self.running:
+            return False
 
-            if ret:
-                logger.debug("read from stdout: %s", ret)
-                self.readbytesout(ret)
-                read = True
-
-            ret = self._popen.recv_err()
+        try:
+            ret = os.read(pipe.fileno(), self.bufsize)
 
             if ret:
-                logger.debug("read from stderr: %s", ret)
-                self.readbyteserr(ret)
-                read = True
-
-            # if we read anything, we might have more to read, so
-            # reschedule immediately
-            if read and self.runner:
-                self.schedule(0.0, self._read, runner)
-                return
-
-            # if we didn't read anything, give the command more time to
-            # produce output
-            if self._popen.poll() is None and self.runner:
-                # not finished yet
-                self.schedule(1.0, self._read, runner)
-                return
-
-            self._done()
+                logger.debug("read from %s: %s", name, ret)
+                callback(ret)
+                return True
+
+            pipe.close()
+            self._open -= 1
+            if not self._open:
+                self._popen.wait()
+                self._done()
+            return False
         except Exception, e:
             logger.debug('exception during _read(): %r', str(e))
             self.setException(e)
             self.stop()
+            return False
 
     def _done(self):
             assert self._popen.returncode is not None, "No returncode"
@@ -151,3 +285,238 @@ class PopenTask(task.Task):
         pass
 
 
+class PipelineTask(task.Task, task.ITaskListener):
+    """
+    I run jobs through two stages that overlap: while the second stage
+    runs for a job, the first stage already runs for the next one.
+    Each stage runs one task at a time, and jobs are committed in order.
+
+    Jobs are objects with these methods:
+     - getFirstTask(): return the task for the first stage, or None
+     - getSecondTask(): return the task for the second stage, or None;
+       only called once the first stage succeeded
+     - retry(exception): called when a stage failed; return True to run
+       the job again from the first stage, before any other job
+     - commit(): called in order once a job passed both stages
+
+    If a job can't be retried, I stop with its exception once the tasks
+    still running are done.
+
+    @ivar jobs: the jobs to run, in order
+    @type jobs: list
+    """
+
+    description = 'Running jobs'
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        self._waiting = [list(self.jobs), []] # for each stage
+        self._running = [None, None] # (job, task) for each stage
+        self._passed = []
+        self._committed = 0
+        self._shown = None # the task whose progress we show
+
+        self._advance()
+
+    def _advance(self):
+        if not self.running:
+            return
+
+        while not self.exception:
+            # commit finished jobs in order
+            while (self._committed < len(self.jobs) and
+                   self.jobs[self._committed] in self._passed):
+                job = self.jobs[self._committed]
+                self._committed += 1
+                try:
+                    job.commit()
+                except Exception, e:
+                    self.setException(e)
+                    break
+
+            if self.exception:
+                break
+
+            if not self._startStage(0) and not self._startStage(1):
+                break
+
+        if self._running == [None, None] and (
+                self.exception or self._committed == len(self.jobs)):
+            self.stop()
+
+    def _startStage(self, stage):
+        """
+        Start the next task for the given stage, if possible.
+
+        @returns: whether a job moved on
+        """
+        if self._running[stage] or not self._waiting[stage]:
+            return False
+
+        job = self._waiting[stage].pop(0)
+        try:
+            if stage == 0:
+                t = job.getFirstTask()
+            else:
+                t = job.getSecondTask()
+        except Exception, e:
+            self.setException(e)
+            return False
+
+        if not t:
+            self._passStage(stage, job)
+            return True
+
+        self._running[stage] = (job, t)
+        t.addListener(self)
+        self._show(t)
+        try:
+            t.start(self.runner)
+        except Exception, e:
+            t.setException(e)
+            self.stopped(t)
+
+        return True
+
+    def _passStage(self, stage, job):
+        if stage == 0:
+            self._waiting[1].append(job)
+        else:
+            self._passed.append(job)
+
+    def _show(self, t):
+        if self._shown is t:
+            return
+        self._shown = t
+        self.progress = 0.0
+        self.setDescription(t.description)
+        self.setProgress(t.progress)
+
+    ### ITaskListener methods
+    def progressed(self, task, value):
+        if task is self._shown:
+            self.setProgress(value)
+
+    def described(self, task, description):
+        if task is self._shown:
+            self.setDescription(description)
+
+    def stopped(self, task):
+        stage = [r and r[1] for r in self._running].index(task)
+        job = self._running[stage][0]
+        self._running[stage] = None
+
+        if task.exception:
+            logger.debug('job %r failed in stage %d: %r', job, stage + 1,
+                task.exceptionMessage)
+            try:
+                retry = job.retry(task.exception)
+            except Exception, e:
+                self.setException(e)
+                retry = False
+
+            if retry:
+                self._waiting[0].insert(0, job)
+            elif not self.exception:
+                self.exception = task.exception
+                self.exceptionMessage = task.exceptionMessage
+                self.exceptionTraceback = task.exceptionTraceback
+        else:
+            self._passStage(stage, job)
+
+        # show the other stage while this one is idle
+        other = self._running[1 - stage]
+        if other:
+            self._show(other[1])
+
+        self.schedule(0, self._advance)
+
+
+class WorkerPool:
+    """
+    I limit how many CPU-bound tasks run at the same time, for any number of
+    users sharing me on the same runner.  Tasks I wrap wait for a free
+    worker before they start.
+
+    @ivar workers: how many tasks can run at the same time
+    @type workers: int
+    """
+
+    def __init__(self, workers=None):
+        """
+        @param workers: how many tasks can run at the same time; defaults
+                        to the number of CPUs
+        @type  workers: int
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self._busy = 0
+        self._waiting = []
+
+    def wrap(self, t):
+        """
+        @returns: a task running the given task once a worker is free
+        @rtype:   L{PooledTask}
+        """
+        return PooledTask(self, t)
+
+    def _acquire(self, pooled):
+        if self._busy < self.workers:
+            self._busy += 1
+            pooled.schedule(0, pooled._run)
+        else:
+            self._waiting.append(pooled)
+
+    def _release(self):
+        if self._waiting:
+            pooled = self._waiting.pop(0)
+            pooled.schedule(0, pooled._run)
+        else:
+            self._busy -= 1
+
+
+class PooledTask(task.Task, task.ITaskListener):
+    """
+    I run a task once a worker of a L{WorkerPool} is free for it, and stop
+    with its exception, if any.
+
+    @ivar task: the task to run
+    @type task: L{task.Task}
+    """
+
+    def __init__(self, pool, t):
+        self.task = t
+        self._pool = pool
+        self.description = t.description
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.setDescription('Waiting to start: %s' % self.task.description)
+        self._pool._acquire(self)
+
+    def _run(self):
+        self.setDescription(self.task.description)
+        self.task.addListener(self)
+        try:
+            self.task.start(self.runner)
+        except Exception, e:
+            self.task.setException(e)
+            self.stopped(self.task)
+
+    ### ITaskListener methods
+    def progressed(self, task, value):
+        self.setProgress(value)
+
+    def described(self, task, description):
+        self.setDescription(description)
+
+    def stopped(self, task):
+        self._pool._release()
+        if task.exception:
+            self.exception = task.exception
+            self.exceptionMessage = task.exceptionMessage
+            self.exceptionTraceback = task.exceptionTraceback
+        self.stop()
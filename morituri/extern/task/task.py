@@ -217,6 +217,12 @@ class Task(LogStub):
             return
         self.runner.schedule(self, delta, callable, *args, **kwargs)
 
+    def watch(self, fd, callable, *args, **kwargs):
+        if not self.runner:
+            print "ERROR: watching on a task that's already stopped"
+            import traceback; traceback.print_stack()
+            return
+        self.runner.watch(self, fd, callable, *args, **kwargs)
 
     def addListener(self, listener):
         """
@@ -453,11 +459,28 @@ class TaskRunner(LogStub):
         """
         raise NotImplementedError
 
+    def watch(self, fd, callable, *args, **kwargs):
+        """
+        Call callable each time the file descriptor can be read from
+        without blocking, including at end of file, for as long as the
+        callable returns True.
+
+        Subclasses should implement this.
+
+        @type  fd: int
+        """
+        raise NotImplementedError
+
 
 class SyncRunner(TaskRunner, ITaskListener):
     """
     I run the task synchronously in a gobject MainLoop.
+
+    @cvar listeners: listeners added to every task run, besides the runner
+                     itself; for a process to follow all tasks it runs
     """
+    listeners = ()
+
     def __init__(self, verbose=True):
         self._verbose = verbose
         self._longest = 0 # longest string shown; for clearing
@@ -472,6 +495,9 @@ class SyncRunner(TaskRunner, ITaskListener):
 
         self._loop = gobject.MainLoop()
         self._task.addListener(self)
+        for listener in self.listeners:
+            if listener not in (self._task._listeners or []):
+                self._task.addListener(listener)
         # only start the task after going into the mainloop,
         # otherwise the task might complete before we are in it
         gobject.timeout_add(0L, self._startWrap, self._task)
@@ -521,6 +547,25 @@ class SyncRunner(TaskRunner, ITaskListener):
 
         gobject.timeout_add(int(delta * 1000L), c)
 
+    def watch(self, task, fd, callable, *args, **kwargs):
+        def c(source, condition):
+            try:
+                self.log('watch: calling %r(*args=%r, **kwargs=%r)',
+                    callable, args, kwargs)
+                return callable(*args, **kwargs)
+            except Exception, e:
+                self.debug('exception when calling watch callable %r',
+                    callable)
+                task.setException(e)
+                self.stopped(task)
+                raise
+        self.log('watch: watching %d for %r(*args=%r, **kwargs=%r)',
+            fd, callable, args, kwargs)
+
+        gobject.io_add_watch(fd,
+            gobject.IO_IN | gobject.IO_PRI | gobject.IO_ERR | gobject.IO_HUP,
+            c)
+
     ### ITaskListener methods
     def progressed(self, task, value):
         if not self._verboseRun:
@@ -26,8 +26,8 @@ Reading .cue files
 See http://digitalx.org/cuesheetsyntax.php
 """
 
+import io
 import re
-import codecs
 
 from morituri.common import common
 from morituri.image import table
@@ -59,6 +59,14 @@ _INDEX_RE = re.compile(r"""
     :(\d\d)$    # frames
 """, re.VERBOSE)
 
+# the lines, by the keyword they start with
+_KEYWORD_RES = {
+    'REM': _REM_RE,
+    'FILE': _FILE_RE,
+    'TRACK': _TRACK_RE,
+    'INDEX': _INDEX_RE,
+}
+
 
 class CueFile(object):
     """
@@ -88,32 +96,35 @@ class CueFile(object):
         counter = 0
 
         logger.info('Parsing .cue file %r', self._path)
-        handle = codecs.open(self._path, 'r', 'utf-8')
+        handle = io.open(self._path, 'r', encoding='utf-8')
 
-        for number, line in enumerate(handle.readlines()):
+        for number, line in enumerate(handle):
             line = line.rstrip()
 
-            m = _REM_RE.search(line)
-            if m:
-                tag = m.expand('\\1')
-                value = m.expand('\\2')
+            # dispatch on the keyword the line starts with
+            words = line.split(None, 1)
+            if not words or words[0] not in _KEYWORD_RES:
+                continue
+            keyword = words[0]
+            m = _KEYWORD_RES[keyword].match(line)
+            if not m:
+                continue
+
+            if keyword == 'REM':
+                tag = m.group(1)
+                value = m.group(2)
                 if state != 'HEADER':
                     self.message(number, 'REM %s outside of header' % tag)
                 else:
                     self._rems[tag] = value
-                continue
 
-            # look for FILE lines
-            m = _FILE_RE.search(line)
-            if m:
+            elif keyword == 'FILE':
                 counter += 1
                 filePath = m.group('name')
                 fileFormat = m.group('format')
                 currentFile = File(filePath, fileFormat)
 
-            # look for TRACK lines
-            m = _TRACK_RE.search(line)
-            if m:
+            elif keyword == 'TRACK':
                 if not currentFile:
                     self.message(number, 'TRACK without preceding FILE')
                     continue
@@ -126,20 +137,17 @@ class CueFile(object):
                 logger.debug('found track %d', trackNumber)
                 currentTrack = table.Track(trackNumber)
                 self.table.tracks.append(currentTrack)
-                continue
 
-            # look for INDEX lines
-            m = _INDEX_RE.search(line)
-            if m:
+            elif keyword == 'INDEX':
                 if not currentTrack:
                     self.message(number, 'INDEX without preceding TRACK')
                     print 'ouch'
                     continue
 
-                indexNumber = int(m.expand('\\1'))
-                minutes = int(m.expand('\\2'))
-                seconds = int(m.expand('\\3'))
-                frames = int(m.expand('\\4'))
+                indexNumber = int(m.group(1))
+                minutes = int(m.group(2))
+                seconds = int(m.group(3))
+                frames = int(m.group(4))
                 frameOffset = frames \
                     + seconds * common.FRAMES_PER_SECOND \
                     + minutes * common.FRAMES_PER_SECOND * 60
@@ -150,7 +158,8 @@ class CueFile(object):
                 currentTrack.index(indexNumber,
                     path=currentFile.path, relative=frameOffset,
                     counter=counter)
-                continue
+
+        handle.close()
 
     def message(self, number, message):
         """
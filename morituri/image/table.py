@@ -54,7 +54,20 @@ CDTEXT_FIELDS = [
 ]
 
 
-class Track:
+def _getSlots(o):
+    return dict([(name, getattr(o, name)) for name in o.__slots__])
+
+
+def _setSlots(o, state):
+    # Track and Index were classic classes before, pickled with only the
+    # attributes set on the instance; the others keep their defaults
+    o.__init__()
+    for name, value in state.items():
+        if name in o.__slots__:
+            setattr(o, name, value)
+
+
+class Track(object):
     """
     I represent a track entry in an Table.
 
@@ -71,22 +84,28 @@ class Track:
     @type pre_emphasis: bool
     """
 
-    number = None
-    audio = None
-    indexes = None
-    isrc = None
-    cdtext = None
-    session = None
-    pre_emphasis = None
+    # a disc can have a hundred tracks, and each is kept in several tables
+    __slots__ = ('number', 'audio', 'indexes', 'isrc', 'cdtext', 'session',
+        'pre_emphasis')
 
     def __repr__(self):
         return '<Track %02d>' % self.number
 
-    def __init__(self, number, audio=True, session=None):
+    def __init__(self, number=None, audio=True, session=None):
+        # number can be left out only when unpickling
         self.number = number
         self.audio = audio
         self.indexes = {}
+        self.isrc = None
         self.cdtext = {}
+        self.session = session
+        self.pre_emphasis = None
+
+    def __getstate__(self):
+        return _getSlots(self)
+
+    def __setstate__(self, state):
+        _setSlots(self, state)
 
     def index(self, number, absolute=None, path=None, relative=None,
               counter=None):
@@ -131,19 +150,16 @@ class Track:
         return self.indexes[1].absolute - self.indexes[0].absolute
 
 
-class Index:
+class Index(object):
     """
     @ivar counter: counter for the index source; distinguishes between
                    the matching FILE lines in .cue files for example
     @type path:    unicode or None
     """
-    number = None
-    absolute = None
-    path = None
-    relative = None
-    counter = None
 
-    def __init__(self, number, absolute=None, path=None, relative=None,
+    __slots__ = ('number', 'absolute', 'path', 'relative', 'counter')
+
+    def __init__(self, number=None, absolute=None, path=None, relative=None,
                  counter=None):
 
         if path is not None:
@@ -155,11 +171,35 @@ class Index:
         self.relative = relative
         self.counter = counter
 
+    def __getstate__(self):
+        return _getSlots(self)
+
+    def __setstate__(self, state):
+        _setSlots(self, state)
+
     def __repr__(self):
         return '<Index %02d absolute %r path %r relative %r counter %r>' % (
             self.number, self.absolute, self.path, self.relative, self.counter)
 
 
+def _cached(method):
+    """
+    Decorate a method of L{Table} to only compute what it returns once,
+    until the table changes.  What is returned is shared, and should not
+    be changed.
+    """
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        cache = self._getCache()
+        if key not in cache:
+            cache[key] = method(self, *args, **kwargs)
+        return cache[key]
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
 class Table(object):
     """
     I represent a table of indexes on a CD.
@@ -177,6 +217,8 @@ class Table(object):
     cdtext = None
     mbdiscid = None
 
+    _cache = None # (tracks and leadout, dict of what _cached methods return)
+
     classVersion = 4
 
     def __init__(self, tracks=None):
@@ -194,6 +236,40 @@ class Table(object):
         self.logName = "Table 0x%08x v%d" % (id(self), self.instanceVersion)
         logger.debug('set logName')
 
+    def __getstate__(self):
+        # the cache is computed again after unpickling
+        state = self.__dict__.copy()
+        state.pop('_cache', None)
+        return state
+
+    def _getCache(self):
+        # the cache is invalidated by the methods changing the table;
+        # tracks still being added or the leadout being set while the
+        # table is built are noticed too
+        key = (len(self.tracks), self.leadout)
+        if self._cache is None or self._cache[0] != key:
+            self._cache = (key, {})
+        return self._cache[1]
+
+    def _invalidate(self):
+        self._cache = None
+
+    @_cached
+    def _getBoundaries(self):
+        """
+        @returns: the start and end of each track, or None if not all
+                  tracks have an absolute index 1 or the leadout is unknown
+        @rtype:   list of (int, int) or None
+        """
+        if self.leadout is None:
+            return None
+        for track in self.tracks:
+            if 1 not in track.indexes or track.indexes[1].absolute is None:
+                return None
+
+        return [(self.tracks[i].indexes[1].absolute, self._getTrackEnd(i + 1))
+            for i in range(len(self.tracks))]
+
     def getTrackStart(self, number):
         """
         @param number: the track number, 1-based
@@ -202,6 +278,10 @@ class Table(object):
         @returns: the start of the given track number's index 1, in CD frames
         @rtype:   int
         """
+        boundaries = self._getBoundaries()
+        if boundaries:
+            return boundaries[number - 1][0]
+
         track = self.tracks[number - 1]
         return track.getIndex(1).absolute
 
@@ -213,6 +293,13 @@ class Table(object):
         @returns: the end of the given track number (ie index 1 of next track)
         @rtype:   int
         """
+        boundaries = self._getBoundaries()
+        if boundaries:
+            return boundaries[number - 1][1]
+
+        return self._getTrackEnd(number)
+
+    def _getTrackEnd(self, number):
         # default to end of disc
         end = self.leadout - 1
 
@@ -239,6 +326,7 @@ class Table(object):
         """
         return self.getTrackEnd(number) - self.getTrackStart(number) + 1
 
+    @_cached
     def getAudioTracks(self):
         """
         @returns: the number of audio tracks on the CD
@@ -260,6 +348,7 @@ class Table(object):
 
         return ret
 
+    @_cached
     def getCDDBValues(self):
         """
         Get all CDDB values needed to calculate disc id and lookup URL.
@@ -395,6 +484,7 @@ class Table(object):
         self.mbdiscid = result
         return result
 
+    @_cached
     def getMusicBrainzSubmitURL(self):
         host = 'musicbrainz.org'
 
@@ -410,6 +500,7 @@ class Table(object):
         return urlparse.urlunparse((
             'https', host, '/cdtoc/attach', '', query, ''))
 
+    @_cached
     def getFrameLength(self, data=False):
         """
         Get the length in frames (excluding HTOA)
@@ -434,6 +525,7 @@ class Table(object):
         """
         return int(self.getFrameLength() * 1000.0 / common.FRAMES_PER_SECOND)
 
+    @_cached
     def _getMusicBrainzValues(self):
         """
         Get all MusicBrainz values needed to calculate disc id and submit URL.
@@ -482,6 +574,7 @@ class Table(object):
         logger.debug('Musicbrainz values: %r', result)
         return result
 
+    @_cached
     def getAccurateRipIds(self):
         """
         Calculate the two AccurateRip ID's.
@@ -513,6 +606,7 @@ class Table(object):
 
         return ("%08x" % discId1, "%08x" % discId2)
 
+    @_cached
     def getAccurateRipURL(self):
         """
         Return the full AccurateRip URL.
@@ -696,6 +790,7 @@ class Table(object):
         """
         logger.debug('setFile: track %d, index %d, path %r, '
             'length %r, counter %r', track, index, path, length, counter)
+        self._invalidate()
 
         t = self.tracks[track - 1]
         i = t.indexes[index]
@@ -731,6 +826,7 @@ class Table(object):
 
         #for t in self.tracks: print t, t.indexes
         logger.debug('absolutizing')
+        self._invalidate()
         while True:
             track = self.tracks[t - 1]
             index = track.getIndex(i)
@@ -764,6 +860,7 @@ class Table(object):
 
         @type  other: L{Table}
         """
+        self._invalidate()
         gap = self._getSessionGap(session)
 
         trackCount = len(self.tracks)
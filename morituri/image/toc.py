@@ -26,8 +26,9 @@ Reading .toc files
 The .toc file format is described in the man page of cdrdao
 """
 
+import bisect
+import io
 import re
-import codecs
 
 from morituri.common import common
 from morituri.image import table
@@ -93,6 +94,20 @@ _INDEX_RE = re.compile(r"""
     \s(?P<offset>.+)$ # start offset
 """, re.VERBOSE)
 
+# the records, by the keyword they start with
+_KEYWORD_RES = {
+    'CATALOG': _CATALOG_RE,
+    'PRE_EMPHASIS': _PRE_EMPHASIS_RE,
+    'TRACK': _TRACK_RE,
+    'ISRC': _ISRC_RE,
+    'SILENCE': _SILENCE_RE,
+    'ZERO': _ZERO_RE,
+    'FILE': _FILE_RE,
+    'DATAFILE': _DATAFILE_RE,
+    'START': _START_RE,
+    'INDEX': _INDEX_RE,
+}
+
 
 class Sources:
     """
@@ -103,6 +118,9 @@ class Sources:
 
     def __init__(self):
         self._sources = []
+        self._offsets = [] # offsets of the sources, to bisect
+        self._counterStarts = {} # counter -> offset of its first source
+        self._sorted = True
 
     def append(self, counter, offset, source):
         """
@@ -111,14 +129,22 @@ class Sources:
         @type  counter: int
         @param offset:  the absolute disc offset where this source starts
         """
-        logger.debug('Appending source, counter %d, abs offset %d, source %r' % (
-            counter, offset, source))
+        logger.debug('Appending source, counter %d, abs offset %d, '
+            'source %r', counter, offset, source)
+        if self._offsets and offset < self._offsets[-1]:
+            self._sorted = False
         self._sources.append((counter, offset, source))
+        self._offsets.append(offset)
+        self._counterStarts.setdefault(counter, offset)
 
     def get(self, offset):
         """
         Retrieve the source used at the given offset.
         """
+        if self._sorted:
+            i = bisect.bisect_right(self._offsets, offset)
+            return self._sources[i - 1]
+
         for i, (c, o, s) in enumerate(self._sources):
             if offset < o:
                 return self._sources[i - 1]
@@ -129,9 +155,8 @@ class Sources:
         """
         Retrieve the absolute offset of the first source for this counter
         """
-        for i, (c, o, s) in enumerate(self._sources):
-            if c == counter:
-                return self._sources[i][1]
+        if counter in self._counterStarts:
+            return self._counterStarts[counter]
 
         return self._sources[-1][1]
 
@@ -154,8 +179,8 @@ class TocFile(object):
         absolute = absoluteOffset + trackOffset
         # this may be in a new source, so calculate relative
         c, o, s = self._sources.get(absolute)
-        logger.debug('at abs offset %d, we are in source %r' % (
-            absolute, s))
+        logger.debug('at abs offset %d, we are in source %r',
+            absolute, s)
         counterStart = self._sources.getCounterStart(c)
         relative = absolute - counterStart
 
@@ -191,13 +216,13 @@ class TocFile(object):
         # the first track's INDEX 1 can only be gotten from the .toc
         # file once the first pregap is calculated; so we add INDEX 1
         # at the end of each parsed  TRACK record
-        handle = codecs.open(self._path, "r", "utf-8")
+        handle = io.open(self._path, "r", encoding="utf-8")
 
-        for number, line in enumerate(handle.readlines()):
+        for number, line in enumerate(handle):
             line = line.rstrip()
 
             # look for CDTEXT stuff in either header or tracks
-            m = _CDTEXT_CANDIDATE_RE.search(line)
+            m = '"' in line and _CDTEXT_CANDIDATE_RE.search(line)
             if m:
                 key = m.group('key')
                 value = m.group('value')
@@ -218,15 +243,22 @@ class TocFile(object):
                                 key, value)
                             currentTrack.cdtext[key] = value
 
-            # look for header elements
-            m = _CATALOG_RE.search(line)
-            if m:
+            # the other lines are records starting with a keyword;
+            # the lines of CD_TEXT blocks are indented
+            if not line or line[0].isspace():
+                continue
+            keyword = line.split(None, 1)[0]
+            if keyword not in _KEYWORD_RES:
+                continue
+            m = _KEYWORD_RES[keyword].match(line)
+            if not m:
+                continue
+
+            if keyword == 'CATALOG':
                 self.table.catalog = m.group('catalog')
                 logger.debug("Found catalog number %s", self.table.catalog)
 
-            # look for TRACK lines
-            m = _TRACK_RE.search(line)
-            if m:
+            elif keyword == 'TRACK':
                 state = 'TRACK'
 
                 # set index 1 of previous track if there was one, using
@@ -255,24 +287,16 @@ class TocFile(object):
                 indexNumber = 1
                 pregapLength = 0
 
-                continue
-
-            # look for PRE_EMPHASIS lines
-            m = _PRE_EMPHASIS_RE.search(line)
-            if m:
+            elif keyword == 'PRE_EMPHASIS':
                 currentTrack.pre_emphasis = True
                 logger.debug('Track has PRE_EMPHASIS')
 
-            # look for ISRC lines
-            m = _ISRC_RE.search(line)
-            if m:
+            elif keyword == 'ISRC':
                 isrc = m.group('isrc')
                 currentTrack.isrc = isrc
                 logger.debug('Found ISRC code %s', isrc)
 
-            # look for SILENCE lines
-            m = _SILENCE_RE.search(line)
-            if m:
+            elif keyword == 'SILENCE':
                 length = m.group('length')
                 logger.debug('SILENCE of %r', length)
                 self._sources.append(counter, absoluteOffset, None)
@@ -283,9 +307,7 @@ class TocFile(object):
                     currentFile = None
                 currentLength += common.msfToFrames(length)
 
-            # look for ZERO lines
-            m = _ZERO_RE.search(line)
-            if m:
+            elif keyword == 'ZERO':
                 if currentFile is not None:
                     logger.debug('ZERO after FILE, increasing counter')
                     counter += 1
@@ -294,36 +316,29 @@ class TocFile(object):
                 length = m.group('length')
                 currentLength += common.msfToFrames(length)
 
-            # look for FILE lines
-            m = _FILE_RE.search(line)
-            if m:
+            elif keyword == 'FILE':
                 filePath = m.group('name')
-                start = m.group('start')
-                length = m.group('length')
+                start = common.msfToFrames(m.group('start'))
+                length = common.msfToFrames(m.group('length'))
                 logger.debug('FILE %s, start %r, length %r',
-                    filePath, common.msfToFrames(start),
-                    common.msfToFrames(length))
+                    filePath, start, length)
                 if not currentFile or filePath != currentFile.path:
                     counter += 1
                     relativeOffset = 0
                     logger.debug('track %d, switched to new FILE, '
                                'increased counter to %d',
                         trackNumber, counter)
-                currentFile = File(filePath, common.msfToFrames(start),
-                    common.msfToFrames(length))
+                currentFile = File(filePath, start, length)
                 self._sources.append(counter, absoluteOffset + currentLength,
                     currentFile)
                 #absoluteOffset += common.msfToFrames(start)
-                currentLength += common.msfToFrames(length)
+                currentLength += length
 
-            # look for DATAFILE lines
-            m = _DATAFILE_RE.search(line)
-            if m:
+            elif keyword == 'DATAFILE':
                 filePath = m.group('name')
-                length = m.group('length')
+                length = common.msfToFrames(m.group('length'))
                 # print 'THOMAS', length
-                logger.debug('FILE %s, length %r',
-                    filePath, common.msfToFrames(length))
+                logger.debug('FILE %s, length %r', filePath, length)
                 if not currentFile or filePath != currentFile.path:
                     counter += 1
                     relativeOffset = 0
@@ -331,16 +346,13 @@ class TocFile(object):
                         'increased counter to %d',
                         trackNumber, counter)
                 # FIXME: assume that a MODE2_FORM_MIX track always starts at 0
-                currentFile = File(filePath, 0, common.msfToFrames(length))
+                currentFile = File(filePath, 0, length)
                 self._sources.append(counter, absoluteOffset + currentLength,
                     currentFile)
                 #absoluteOffset += common.msfToFrames(start)
-                currentLength += common.msfToFrames(length)
-
+                currentLength += length
 
-            # look for START lines
-            m = _START_RE.search(line)
-            if m:
+            elif keyword == 'START':
                 if not currentTrack:
                     self.message(number, 'START without preceding TRACK')
                     print 'ouch'
@@ -348,8 +360,8 @@ class TocFile(object):
 
                 length = common.msfToFrames(m.group('length'))
                 c, o, s = self._sources.get(absoluteOffset)
-                logger.debug('at abs offset %d, we are in source %r' % (
-                    absoluteOffset, s))
+                logger.debug('at abs offset %d, we are in source %r',
+                    absoluteOffset, s)
                 counterStart = self._sources.getCounterStart(c)
                 relativeOffset = absoluteOffset - counterStart
 
@@ -362,9 +374,7 @@ class TocFile(object):
                 # track on the next iteration
                 pregapLength = length
 
-            # look for INDEX lines
-            m = _INDEX_RE.search(line)
-            if m:
+            elif keyword == 'INDEX':
                 if not currentTrack:
                     self.message(number, 'INDEX without preceding TRACK')
                     print 'ouch'
@@ -374,6 +384,8 @@ class TocFile(object):
                 offset = common.msfToFrames(m.group('offset'))
                 self._index(currentTrack, indexNumber, absoluteOffset, offset)
 
+        handle.close()
+
         # handle index 1 of final track, if any
         if currentTrack:
             self._index(currentTrack, 1, absoluteOffset, pregapLength)
@@ -1,52 +1,110 @@
-from os.path import exists
+import wave as wavemod
 from subprocess import Popen, PIPE
 
+from morituri.common import accurip, common
+
 import logging
 logger = logging.getLogger(__name__)
 
-ARB = 'accuraterip-checksum'
 FLAC = 'flac'
 
-def accuraterip_checksum(f, track, tracks, wave=False, v2=False):
-    v = '--accuraterip-v1'
-    if v2:
-        v = '--accuraterip-v2'
+# read 64 frames of audio at a time
+_BLOCK_FRAMES = 64
 
-    track, tracks = str(track), str(tracks)
 
-    if not wave:
-        flac = Popen([FLAC, '-cds', f], stdout=PIPE)
+def _readWave(f, checksum):
+    try:
+        handle = wavemod.open(f, 'rb')
+    except (wavemod.Error, EOFError), e:
+        logger.warning('ARC calculation failed: %s', e)
+        return False
 
-        arc = Popen([ARB, v, '/dev/stdin', track, tracks],
-                    stdin=flac.stdout, stdout=PIPE, stderr=PIPE)
-    else:
-        arc = Popen([ARB, v, f, track, tracks],
-                    stdout=PIPE, stderr=PIPE)
+    try:
+        if handle.getnchannels() != 2 or handle.getsampwidth() != 2:
+            logger.warning('ARC calculation failed: %r is not 16-bit stereo',
+                           f)
+            return False
 
-    if not wave:
-        flac.stdout.close()
+        while True:
+            data = handle.readframes(_BLOCK_FRAMES * common.SAMPLES_PER_FRAME)
+            if not data:
+                break
+            checksum.update(data)
+    finally:
+        handle.close()
 
-    out, err = arc.communicate()
+    return True
 
-    if not wave:
-        flac.wait()
-        flac_rc = flac.returncode
 
-    arc_rc = arc.returncode
+def _readFlac(f, checksum):
+    try:
+        flac = Popen([FLAC, '-d', '-c', '-s', '--force-raw-format',
+                      '--endian=little', '--sign=signed', f],
+                     stdout=PIPE)
+    except OSError, e:
+        logger.warning('ARC calculation failed: could not run %s: %s',
+                       FLAC, e)
+        return False
 
-    if not wave and flac_rc != 0:
+    while True:
+        data = flac.stdout.read(_BLOCK_FRAMES * common.BYTES_PER_FRAME)
+        if not data:
+            break
+        checksum.update(data)
+
+    flac.stdout.close()
+    flac.wait()
+
+    if flac.returncode != 0:
         logger.warning('ARC calculation failed: flac return code is non zero')
+        return False
+
+    return True
+
+
+def _isFlac(f):
+    handle = open(f, 'rb')
+    try:
+        return handle.read(4) == 'fLaC'
+    finally:
+        handle.close()
+
+
+def accuraterip_checksums(f, track, tracks, wave=False):
+    """
+    Calculate both AccurateRip checksums of a file in a single pass.
+
+    @param wave: whether the file is expected to be a WAV file; FLAC files
+                 are recognized and decoded with flac either way
+    @type  wave: bool
+
+    @returns: (v1, v2), or None if the file could not be read
+    @rtype:   tuple of (int, int) or None
+    """
+    checksum = accurip.AccurateRipChecksum(track, tracks)
+
+    try:
+        flac = not wave or _isFlac(f)
+    except IOError, e:
+        logger.warning('ARC calculation failed: %s', e)
         return None
 
-    if arc_rc != 0:
-        logger.warning('ARC calculation failed: arc return code is non zero')
+    if flac:
+        ok = _readFlac(f, checksum)
+    else:
+        ok = _readWave(f, checksum)
+
+    if not ok:
         return None
 
-    out = out.strip()
-    try:
-        outh = int('0x%s' % out, base=16)
-    except ValueError:
-        logger.warning('ARC output is not usable')
+    return checksum.v1, checksum.v2
+
+
+def accuraterip_checksum(f, track, tracks, wave=False, v2=False):
+    checksums = accuraterip_checksums(f, track, tracks, wave)
+    if checksums is None:
         return None
 
-    return outh
+    if v2:
+        return checksums[1]
+    return checksums[0]
@@ -20,6 +20,7 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 import errno
 import os
 import re
@@ -27,11 +28,11 @@ import shutil
 import stat
 import subprocess
 import tempfile
+import threading
 import time
 
-from morituri.common import common
+from morituri.common import accurip, common, digest
 from morituri.common import task as ctask
-from morituri.extern import asyncsub
 from morituri.extern.task import task
 
 import logging
@@ -80,6 +81,63 @@ _ERROR_RE = re.compile("^scsi_read error:")
 # number of single-channel samples, ie. 2 bytes (word) per unit, and absolute
 
 
+def getReadHistogram(counts):
+    """
+    @param counts: how many times each frame was read
+    @type  counts: sequence of int
+
+    @returns: how many frames were read how many times
+    @rtype:   dict of int -> int
+    """
+    histogram = {}
+    for c in counts:
+        histogram[c] = histogram.get(c, 0) + 1
+    return histogram
+
+
+def getQuality(counts):
+    """
+    Get the read quality of frames, from how many times each was read.
+
+    cdparanoia reads each frame up to twice to verify it; a frame read
+    more often has a quality of 2 divided by its reads, and a frame that
+    was never read has none.  The quality of all frames is their average.
+
+    @param counts: how many times each frame was read
+    @type  counts: sequence of int
+
+    @rtype: float
+    """
+    if not counts:
+        return 1.0
+
+    total = 0.0
+    for reads, frames in getReadHistogram(counts).items():
+        if reads:
+            total += frames * min(2.0 / reads, 1.0)
+    return total / len(counts)
+
+
+def encodeReadCounts(counts):
+    """
+    Compress the read count of each frame by run-length encoding it.
+
+    @param counts: how many times each frame was read
+    @type  counts: sequence of int
+
+    @returns: a list of (reads, frames) for each run of frames read the same
+              number of times
+    @rtype:   list of (int, int)
+    """
+    runs = []
+    for c in counts:
+        if runs and runs[-1][0] == c:
+            runs[-1][1] += 1
+        else:
+            runs.append([c, 1])
+    return [tuple(r) for r in runs]
+
+
 class ProgressParser:
     read = 0 # last [read] frame
     wrote = 0 # last [wrote] frame
@@ -101,7 +159,12 @@ class ProgressParser:
         # FIXME: privatize
         self.read = start
 
-        self._reads = {} # read count for each sector
+        # the difference in read count between each frame and the one
+        # before it, so a read of any number of frames is marked in
+        # constant time; one more for the frame after stop
+        self._deltas = array.array('l', [0]) * (stop - start + 2)
+        self._counts = None # read count for each frame, once calculated
+        self.events = {} # how many times each progress event happened
 
     def parse(self, line):
         """
@@ -110,17 +173,27 @@ class ProgressParser:
         m = _PROGRESS_RE.search(line)
         if m:
             # code = int(m.group('code'))
-            function = m.group('function')
-            wordOffset = int(m.group('offset'))
-            if function == 'read':
-                self._parse_read(wordOffset)
-            elif function == 'wrote':
-                self._parse_wrote(wordOffset)
+            self.event(m.group('function'), int(m.group('offset')))
 
         m = _ERROR_RE.search(line)
         if m:
             self.errors += 1
 
+    def event(self, function, wordOffset):
+        """
+        Handle a progress event of cdparanoia.
+
+        @param function:   the name of the event, as cdparanoia prints it
+        @type  function:   str
+        @param wordOffset: the position of the event, in words
+        @type  wordOffset: int
+        """
+        self.events[function] = self.events.get(function, 0) + 1
+        if function == 'read':
+            self._parse_read(wordOffset)
+        elif function == 'wrote':
+            self._parse_wrote(wordOffset)
+
     def _parse_read(self, wordOffset):
         if wordOffset % common.WORDS_PER_FRAME != 0:
             print 'THOMAS: not a multiple of %d: %d' % (
@@ -162,13 +235,6 @@ class ProgressParser:
             markStart = frameOffset # - self._firstFrames
             markEnd = frameOffset
 
-        # FIXME: doing this is way too slow even for a testcase, so disable
-        if False:
-            for frame in range(markStart, markEnd):
-                if not frame in self._reads.keys():
-                    self._reads[frame] = 0
-                self._reads[frame] += 1
-
         # cdparanoia reads quite a bit beyond the current track before it
         # goes back to verify; don't count those
         # markStart, markEnd of 0, 21 with stop 0 should give 1 read
@@ -176,6 +242,13 @@ class ProgressParser:
             markEnd = self.stop + 1
         if markStart > self.stop + 1:
             markStart = self.stop + 1
+        markStart = max(markStart, self.start)
+        markEnd = max(markEnd, self.start)
+
+        if markEnd > markStart:
+            self._deltas[markStart - self.start] += 1
+            self._deltas[markEnd - self.start] -= 1
+            self._counts = None
 
         self.reads += markEnd - markStart
 
@@ -187,18 +260,50 @@ class ProgressParser:
         frameOffset = (wordOffset + 1) / common.WORDS_PER_FRAME
         self.wrote = frameOffset
 
-    def getTrackQuality(self):
+    def getReadCounts(self, start=None, stop=None):
+        """
+        @param start: first frame to get the read count of; defaults to the
+                      first frame to rip
+        @param stop:  last frame to get the read count of (inclusive);
+                      defaults to the last frame to rip
+
+        @returns: how many times each frame was read
+        @rtype:   L{array.array}
+        """
+        if self._counts is None:
+            self._counts = array.array('l', [0]) * (self.stop - self.start + 1)
+            count = 0
+            for i in xrange(len(self._counts)):
+                count += self._deltas[i]
+                self._counts[i] = count
+
+        if start is None:
+            start = self.start
+        if stop is None:
+            stop = self.stop
+        return self._counts[start - self.start:stop - self.start + 1]
+
+    def getReadHistogram(self, start=None, stop=None):
+        """
+        See L{getReadCounts} for the parameters.
+
+        @returns: how many frames were read how many times
+        @rtype:   dict of int -> int
+        """
+        return getReadHistogram(self.getReadCounts(start, stop))
+
+    def getTrackQuality(self, start=None, stop=None):
         """
         Each frame gets read twice.
         More than two reads for a frame reduce track quality.
+
+        See L{getReadCounts} for the parameters.
         """
-        frames = self.stop - self.start + 1 # + 1 since stop is inclusive
-        reads = self.reads
-        logger.debug('getTrackQuality: frames %d, reads %d' % (frames, reads))
+        counts = self.getReadCounts(start, stop)
+        logger.debug('getTrackQuality: frames %d, reads %d' % (
+            len(counts), sum(counts)))
 
-        # don't go over a 100%; we know cdparanoia reads each frame at least
-        # twice
-        return min(frames * 2.0 / reads, 1.0)
+        return getQuality(counts)
 
 
 # FIXME: handle errors
@@ -208,22 +313,39 @@ class ReadTrackTask(task.Task):
     """
     I am a task that reads a track using cdparanoia.
 
+    Without a path, I stream the audio as raw little-endian 16-bit stereo
+    samples instead of writing a .wav file: either to the given stdout
+    file descriptor, or to the given digests.
+
+    Without paranoia, I read in burst mode: cdparanoia does not verify
+    or correct what the drive returns, which is a lot faster on discs that
+    read cleanly.
+
     @ivar reads: how many reads were done to rip the track
+    @ivar readCounts: how many times each frame was read; set at end of
+                      reading
+    @type readCounts: L{array.array}
     """
 
     description = "Reading track"
     quality = None # set at end of reading
+    readCounts = None
     speed = None
     duration = None # in seconds
 
     _MAXERROR = 100 # number of errors detected by parser
+    _STREAM_BYTES = 64 * common.BYTES_PER_FRAME # read from stdout at once
+    _STDERR_BYTES = 65536 # read from stderr at once
+
+    _stdout = None
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-        device=None, action="Reading", what="track"):
+        device=None, action="Reading", what="track", digests=None,
+        stdout=None, paranoia=True):
         """
         Read the given track.
 
-        @param path:   where to store the ripped track
+        @param path:   where to store the ripped track, or None to stream
         @type  path:   unicode
         @param table:  table of contents of CD
         @type  table:  L{table.Table}
@@ -239,10 +361,24 @@ class ReadTrackTask(task.Task):
         @type  action: str
         @param what:   a string representing what's being read; e.g. Track
         @type  what:   str
+        @param digests: when streaming, digests to feed the audio to
+        @type  digests: list of objects with an update(data) method
+        @param stdout: when streaming, a file descriptor to write the audio
+                       to instead; I close it once cdparanoia is started
+        @type  stdout: int
+        @param paranoia: whether cdparanoia verifies and corrects the reads;
+                         otherwise the track is read in burst mode
+        @type  paranoia: bool
         """
-        assert type(path) is unicode, "%r is not unicode" % path
+        assert path is None or type(path) is unicode, \
+            "%r is not unicode" % path
 
         self.path = path
+        self._digests = digests or []
+        self._stdout = stdout
+        # whether I read the streamed audio myself
+        self._streaming = path is None and stdout is None
+        self._bytes = 0 # streamed to digests
         self._table = table
         self._start = start
         self._stop = stop
@@ -251,8 +387,9 @@ class ReadTrackTask(task.Task):
         self._device = device
         self._start_time = None
         self._overread = overread
+        self._paranoia = paranoia
 
-        self._buffer = "" # accumulate characters
+        self._lines = ctask.LineBuffer()
         self._errors = []
         self.description = "%s %s" % (action, what)
 
@@ -280,24 +417,32 @@ class ReadTrackTask(task.Task):
         logger.debug('Stopping at track %d, offset %d',
             stopTrack, stopOffset)
 
-        bufsize = 1024
         if self._overread:
             argv = ["cdparanoia", "--stderr-progress",
                 "--sample-offset=%d" % self._offset, "--force-overread", ]
         else:
             argv = ["cdparanoia", "--stderr-progress",
                 "--sample-offset=%d" % self._offset, ]
+        if not self._paranoia:
+            argv.append("--disable-paranoia")
         if self._device:
             argv.extend(["--force-cdrom-device", self._device, ])
+        path = self.path
+        if path is None:
+            argv.append("--output-raw-little-endian")
+            path = "-"
         argv.extend(["%d[%s]-%d[%s]" % (
                 startTrack, common.framesToHMSF(startOffset),
                 stopTrack, common.framesToHMSF(stopOffset)),
-            self.path])
+            path])
         logger.debug('Running %s' % (" ".join(argv), ))
+
+        stdout = subprocess.PIPE
+        if self._stdout is not None:
+            stdout = self._stdout
         try:
-            self._popen = asyncsub.Popen(argv,
-                bufsize=bufsize,
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            self._popen = subprocess.Popen(argv,
+                stdin=subprocess.PIPE, stdout=stdout,
                 stderr=subprocess.PIPE, close_fds=True)
         except OSError, e:
             import errno
@@ -305,67 +450,91 @@ class ReadTrackTask(task.Task):
                 raise common.MissingDependencyException('cdparanoia')
 
             raise
+        finally:
+            # cdparanoia has its own copy now; closing ours makes the
+            # reader see the end of the stream when cdparanoia exits
+            if self._stdout is not None:
+                os.close(self._stdout)
+                self._stdout = None
 
         self._start_time = time.time()
-        self.schedule(1.0, self._read, runner)
-
-    def _read(self, runner):
-        ret = self._popen.recv_err()
-        if not ret:
-            if self._popen.poll() is not None:
-                self._done()
-                return
-            self.schedule(0.01, self._read, runner)
-            return
-
-        self._buffer += ret
 
-        # parse buffer into lines if possible, and parse them
-        if "\n" in self._buffer:
-            lines = self._buffer.split('\n')
-            if lines[-1] != "\n":
-                # last line didn't end yet
-                self._buffer = lines[-1]
-                del lines[-1]
-            else:
-                self._buffer = ""
-
-            for line in lines:
-                self._parser.parse(line)
-
-            # fail if too many errors
-            if self._parser.errors > self._MAXERROR:
-                logger.debug('%d errors, terminating', self._parser.errors)
-                self._popen.terminate()
-
-            num = self._parser.wrote - self._start + 1
-            den = self._stop - self._start + 1
-            assert den != 0, "stop %d should be >= start %d" % (
-                self._stop, self._start)
-            progress = float(num) / float(den)
-            if progress < 1.0:
-                self.setProgress(progress)
-
-        # 0 does not give us output before we complete, 1.0 gives us output
-        # too late
-        self.schedule(0.01, self._read, runner)
-
-    def _poll(self, runner):
-        if self._popen.poll() is None:
-            self.schedule(1.0, self._poll, runner)
-            return
-
-        self._done()
+        # cdparanoia is done once it closed all pipes we read from
+        self._open = 1
+        self.watch(self._popen.stderr.fileno(), self._readerr)
+        if self._streaming:
+            self._open += 1
+            self.watch(self._popen.stdout.fileno(), self._readout)
+
+    def _readout(self):
+        # feed all audio available on stdout to the digests
+        if not self.running:
+            return False
+
+        data = os.read(self._popen.stdout.fileno(), self._STREAM_BYTES)
+        if not data:
+            self._closed(self._popen.stdout)
+            return False
+
+        self._bytes += len(data)
+        for d in self._digests:
+            d.update(data)
+        return True
+
+    def _readerr(self):
+        if not self.running:
+            return False
+
+        data = os.read(self._popen.stderr.fileno(), self._STDERR_BYTES)
+        if not data:
+            self._closed(self._popen.stderr)
+            return False
+
+        lines = self._lines.feed(data)
+        if not lines:
+            return True
+
+        for line in lines:
+            self._parser.parse(line)
+
+        # fail if too many errors
+        if self._parser.errors > self._MAXERROR:
+            logger.debug('%d errors, terminating', self._parser.errors)
+            self._popen.terminate()
+
+        num = self._parser.wrote - self._start + 1
+        den = self._stop - self._start + 1
+        assert den != 0, "stop %d should be >= start %d" % (
+            self._stop, self._start)
+        progress = float(num) / float(den)
+        if progress < 1.0:
+            self.setProgress(progress)
+
+        return True
+
+    def _closed(self, pipe):
+        pipe.close()
+        self._open -= 1
+        if not self._open:
+            self._popen.wait()
+            self._done()
 
     def _done(self):
         end_time = time.time()
         self.setProgress(1.0)
 
         # check if the length matches
-        size = os.stat(self.path)[stat.ST_SIZE]
-        # wav header is 44 bytes
         offsetLength = self._stop - self._start + 1
-        expected = offsetLength * common.BYTES_PER_FRAME + 44
+        if self.path is not None:
+            size = os.stat(self.path)[stat.ST_SIZE]
+            # wav header is 44 bytes
+            expected = offsetLength * common.BYTES_PER_FRAME + 44
+        elif self._streaming:
+            size = self._bytes
+            expected = offsetLength * common.BYTES_PER_FRAME
+        else:
+            # streamed elsewhere; the reader checks the length
+            size = expected = None
         if size != expected:
             # FIXME: handle errors better
             logger.warning('file size %d did not match expected size %d',
@@ -388,6 +557,7 @@ class ReadTrackTask(task.Task):
                 self.exception = ReturnCodeError(self._popen.returncode)
 
         self.quality = self._parser.getTrackQuality()
+        self.readCounts = self._parser.getReadCounts()
         self.duration = end_time - self._start_time
         self.speed = (offsetLength / 75.0) / self.duration
 
@@ -395,16 +565,1038 @@ class ReadTrackTask(task.Task):
         return
 
 
+BACKENDS = ('cdparanoia', 'libcdio')
+
+
+def checkReader(reader):
+    """
+    Check that what reads tracks can be used.
+
+    @param reader: one of L{BACKENDS}: the cdparanoia program, or
+                   libcdio-paranoia in-process
+    @type  reader: str
+
+    @raises common.MissingDependencyException: if libcdio-paranoia is
+                                               missing
+    """
+    assert reader in BACKENDS, "unknown reader %r" % reader
+    if reader == 'libcdio':
+        from morituri.program import paranoia
+        if not paranoia.isAvailable():
+            raise common.MissingDependencyException('libcdio-paranoia')
+
+
+def createReadTrackTask(*args, **kwargs):
+    """
+    Create a task reading a track.  It takes the arguments of
+    L{ReadTrackTask}, and what reads the track as the reader keyword
+    argument, one of L{BACKENDS}; the cdparanoia program by default.
+
+    @rtype: L{ReadTrackTask} or L{paranoia.ReadTrackTask}
+    """
+    reader = kwargs.pop('reader', 'cdparanoia')
+    assert reader in BACKENDS, "unknown reader %r" % reader
+    if reader == 'libcdio':
+        from morituri.program import paranoia
+        return paranoia.ReadTrackTask(*args, **kwargs)
+    return ReadTrackTask(*args, **kwargs)
+
+
+def _createCheckpointFile(suffix):
+    """
+    Create a checkpoint file in the working directory.
+
+    @rtype: unicode
+    """
+    fd, path = tempfile.mkstemp(prefix=u'morituri.', suffix=suffix,
+        dir=os.getcwdu())
+    os.close(fd)
+    return path
+
+
+def clearCheckpoint(checkpoint):
+    """
+    Remove the files of a checkpoint and start it over.
+
+    @type checkpoint: L{morituri.result.result.Checkpoint}
+    """
+    for path in (checkpoint.testpath, checkpoint.copypath):
+        if path and os.path.exists(path):
+            logger.debug('Removing checkpoint file %r', path)
+            os.unlink(path)
+
+    checkpoint.testpath = checkpoint.copypath = None
+    checkpoint.testframes = checkpoint.copyframes = 0
+
+
+class _CheckpointFeedTask(task.Task):
+    """
+    I am a task that feeds the audio kept in a checkpoint file to digests,
+    followed by the audio read from a file descriptor, which I also append
+    to the checkpoint file.
+
+    Feeding is done in a thread, so that digests can write to pipes
+    without blocking the main loop.
+
+    @ivar bytes: how many bytes I fed to the digests so far
+    """
+
+    description = 'Feeding audio'
+
+    bytes = 0
+
+    def __init__(self, path, frames, fd, digests):
+        """
+        @param path:    the checkpoint file
+        @type  path:    unicode
+        @param frames:  how many frames of the checkpoint file to feed; the
+                        rest of it is cut off
+        @type  frames:  int
+        @param fd:      the file descriptor to read more audio from, or None;
+                        I close it when done
+        @type  fd:      int
+        @param digests: the digests to feed the audio to; those with a
+                        close() method are closed when done
+        @type  digests: list of objects with an update(data) method
+        """
+        self._path = path
+        self._frames = frames
+        self._fd = fd
+        self._digests = digests
+        self._written = frames * common.BYTES_PER_FRAME # in the file
+        self._lock = threading.Lock()
+        self._file = None
+        self._error = None
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        try:
+            self._file = os.open(self._path, os.O_RDWR | os.O_CREAT, 0644)
+            os.ftruncate(self._file, self._written)
+        except:
+            self._closeStreams()
+            raise
+
+        self._thread = threading.Thread(target=self._run,
+            name='CheckpointFeedThread')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def sync(self):
+        """
+        Make sure the audio appended to the checkpoint file so far is on
+        disk.
+
+        @returns: how many frames of audio the checkpoint file holds
+        @rtype:   int
+        """
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                os.fsync(self._file)
+            return self._written / common.BYTES_PER_FRAME
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        try:
+            self._feed()
+        except Exception, e:
+            logger.debug('feeding audio failed: %r', e)
+            self._error = e
+        finally:
+            self._closeStreams()
+            self._lock.acquire()
+            try:
+                os.fsync(self._file)
+                os.close(self._file)
+                self._file = None
+            finally:
+                self._lock.release()
+            self.schedule(0, self._done)
+
+    def _feed(self):
+        left = self._written
+        os.lseek(self._file, 0, os.SEEK_SET)
+        while left:
+            data = os.read(self._file,
+                min(left, ReadTrackTask._STREAM_BYTES))
+            if not data:
+                break
+            left -= len(data)
+            self._update(data)
+
+        if self._fd is None:
+            return
+
+        while True:
+            data = os.read(self._fd, ReadTrackTask._STREAM_BYTES)
+            if not data:
+                break
+            self._lock.acquire()
+            try:
+                _writeAll(self._file, data)
+                self._written += len(data)
+            finally:
+                self._lock.release()
+            self._update(data)
+
+    def _closeStreams(self):
+        for d in self._digests:
+            if hasattr(d, 'close'):
+                d.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _update(self, data):
+        self.bytes += len(data)
+        for d in self._digests:
+            d.update(data)
+
+    def _done(self):
+        self._thread.join()
+        if self._error:
+            self.setException(self._error)
+        self.stop()
+
+
+def _writeAll(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+class ResumableReadTask(ctask.MultiParallelTask):
+    """
+    I am a task that reads a track using cdparanoia, streaming the audio to
+    digests like L{ReadTrackTask}, and keep the audio in a checkpoint file.
+
+    If the checkpoint file already holds the start of the track, from an
+    earlier read that was interrupted, that audio is fed to the digests
+    first and cdparanoia only reads the rest.
+
+    The read statistics only cover what cdparanoia read now; the read
+    counts are only set if it read the whole track.
+
+    @ivar reader: the task reading the rest of the track, or None if the
+                  checkpoint file holds all of it
+    @type reader: L{ReadTrackTask}
+    @ivar resumed: how many frames were resumed from the checkpoint file
+    """
+
+    reader = None
+    quality = None
+    readCounts = None
+    speed = 0.0
+    duration = 0.0
+    resumed = 0
+
+    def __init__(self, checkpoint, frames, table, start, stop, overread,
+                 offset=0, device=None, action="Reading", what="track",
+                 digests=None, paranoia=True, reader='cdparanoia'):
+        """
+        @param checkpoint: the checkpoint file
+        @type  checkpoint: unicode
+        @param frames:     how many frames of the checkpoint file are known
+                           to be good; anything after them is read again
+        @type  frames:     int
+        @param reader:     what reads the track; see L{createReadTrackTask}
+        @type  reader:     str
+
+        See L{ReadTrackTask} for the other parameters.
+        """
+        ctask.MultiParallelTask.__init__(self)
+
+        self._checkpoint = checkpoint
+        self._frames = frames
+        self._table = table
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._action = action
+        self._what = what
+        self._digests = digests or []
+        self._paranoia = paranoia
+        self._reader = reader
+        self._feeder = None
+        self.description = "%s %s" % (action, what)
+
+    def start(self, runner):
+        length = self._stop - self._start + 1
+        frames = 0
+        if os.path.exists(self._checkpoint):
+            size = os.stat(self._checkpoint)[stat.ST_SIZE]
+            frames = min(self._frames, size / common.BYTES_PER_FRAME, length)
+        self.resumed = frames
+        if frames:
+            logger.info('Resuming read of %s at %s from %r', self._what,
+                common.framesToMSF(frames), self._checkpoint)
+
+        readfd = None
+        self.tasks = []
+        if frames < length:
+            readfd, writefd = os.pipe()
+            self.reader = createReadTrackTask(None, self._table,
+                self._start + frames, self._stop, self._overread,
+                offset=self._offset, device=self._device,
+                action=self._action, what=self._what, stdout=writefd,
+                paranoia=self._paranoia, reader=self._reader)
+            self.tasks.append(self.reader)
+
+        self._feeder = _CheckpointFeedTask(self._checkpoint, frames, readfd,
+            self._digests)
+        self.tasks.append(self._feeder)
+
+        ctask.MultiParallelTask.start(self, runner)
+
+    def sync(self):
+        """
+        @returns: how many frames of the track are on disk in the
+                  checkpoint file
+        @rtype:   int
+        """
+        if not self._feeder:
+            return self._frames
+        return self._feeder.sync()
+
+    def stop(self):
+        expected = (self._stop - self._start + 1) * common.BYTES_PER_FRAME
+        if not self.exception and self._feeder.bytes != expected:
+            msg = "Read %d bytes instead of the expected %d" % (
+                self._feeder.bytes, expected)
+            logger.warning(msg)
+            self.setExceptionAndTraceback(
+                FileSizeError(self._checkpoint, msg))
+
+        if self.reader:
+            self.quality = self.reader.quality
+            self.speed = self.reader.speed
+            self.duration = self.reader.duration
+            if not self.resumed:
+                self.readCounts = self.reader.readCounts
+
+        ctask.MultiParallelTask.stop(self)
+
+
+class ReadEncodeTrackTask(ctask.MultiParallelTask):
+    """
+    I am a task that reads a track using cdparanoia and encodes it at the
+    same time, streaming the audio through a pipe instead of a temporary
+    file.
+
+    @ivar reader:  the task reading the track
+    @type reader:  L{ReadTrackTask}, or L{ResumableReadTask} with a
+                   checkpoint file
+    @ivar encoder: the task encoding the track
+    @type encoder: L{morituri.common.encode.EncodeTask}
+    """
+
+    reader = None
+    encoder = None
+
+    def __init__(self, path, table, start, stop, overread, offset=0,
+                 device=None, profile=None, taglist=None, digests=None,
+                 action="Reading", what="track", paranoia=True,
+                 checkpoint=None, frames=0, reader='cdparanoia'):
+        """
+        @param path:    where to store the encoded track
+        @type  path:    unicode
+        @param digests: digests to feed the audio to while encoding
+        @type  digests: list of objects with an update(data) method
+        @param checkpoint: the file to keep the audio read in, to resume
+                           from; see L{ResumableReadTask}
+        @type  checkpoint: unicode
+        @param frames:  how many frames of the checkpoint file are good
+        @param reader:  what reads the track; see L{createReadTrackTask}
+        @type  reader:  str
+
+        See L{ReadTrackTask} and L{morituri.common.encode.EncodeTask} for
+        the other parameters.
+        """
+        ctask.MultiParallelTask.__init__(self)
+
+        self.path = path
+        self._table = table
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._profile = profile
+        self._taglist = taglist
+        self._digests = digests
+        self._action = action
+        self._what = what
+        self._paranoia = paranoia
+        self._checkpoint = checkpoint
+        self._frames = frames
+        self._reader = reader
+        self.description = "%s and encoding %s" % (action, what)
+
+    def start(self, runner):
+        # the pipe is only created now, so it can't leak if I'm never
+        # started; the reader and the encoder each close their end
+        readfd, writefd = os.pipe()
+
+        if self._checkpoint:
+            self.reader = ResumableReadTask(self._checkpoint, self._frames,
+                self._table, self._start, self._stop, self._overread,
+                offset=self._offset, device=self._device,
+                action=self._action, what=self._what,
+                digests=[_PipeWriter(writefd)], paranoia=self._paranoia,
+                reader=self._reader)
+        else:
+            self.reader = createReadTrackTask(None, self._table,
+                self._start, self._stop, self._overread, offset=self._offset,
+                device=self._device, action=self._action, what=self._what,
+                stdout=writefd, paranoia=self._paranoia, reader=self._reader)
+
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        self.encoder = encode.EncodeTask(None, self.path, self._profile,
+            taglist=self._taglist, what=self._what, digests=self._digests,
+            fd=readfd, length=self._getLength())
+
+        # cdparanoia needs to be started before the encoder can preroll
+        self.tasks = [self.reader, self.encoder]
+        ctask.MultiParallelTask.start(self, runner)
+
+    def stop(self):
+        # the reader can't check the length of what it streamed
+        if not self.exception and self.encoder.samples != self._getLength():
+            msg = "Encoded %d samples instead of the expected %d" % (
+                self.encoder.samples, self._getLength())
+            logger.warning(msg)
+            self.setExceptionAndTraceback(FileSizeError(self.path, msg))
+
+        ctask.MultiParallelTask.stop(self)
+
+    def _getLength(self):
+        return (self._stop - self._start + 1) * common.SAMPLES_PER_FRAME
+
+
+def _createPartFile(path):
+    """
+    Create the file to encode a track to before moving it to its path.
+
+    @returns: the path, shortened if it was too long, and the part file
+    @rtype:   tuple of (unicode, unicode)
+    """
+    try:
+        tmppath = path + u'.part'
+        open(tmppath, 'wb').close()
+    except IOError, e:
+        if errno.ENAMETOOLONG != e.errno:
+            raise
+        path = common.shrinkPath(path)
+        tmppath = path + u'.part'
+        open(tmppath, 'wb').close()
+
+    return path, tmppath
+
+
+class _PipeWriter(object):
+    """
+    I write audio to a pipe, as a digest.  Once the pipe can't be written
+    to, for example because its reader stopped, I drop the audio.
+    """
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def update(self, data):
+        while data and self._fd is not None:
+            try:
+                written = os.write(self._fd, data)
+            except OSError, e:
+                logger.debug('could not write to pipe: %r', e)
+                self.close()
+                return
+            data = data[written:]
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _SplitThread(threading.Thread):
+    """
+    I read raw audio from a file descriptor until end of file and feed it
+    to a L{digest.SplitDigest}, then close both.
+
+    I run in a thread so that writing to pipes can block without blocking
+    the main loop.
+    """
+
+    def __init__(self, fd, splitter):
+        threading.Thread.__init__(self, name='SplitThread')
+        self.daemon = True
+
+        self._fd = fd
+        self._splitter = splitter
+
+    def run(self):
+        try:
+            while True:
+                data = os.read(self._fd, ReadTrackTask._STREAM_BYTES)
+                if not data:
+                    break
+                self._splitter.update(data)
+        finally:
+            self._splitter.close()
+            os.close(self._fd)
+
+
+class _EncodePartsTask(task.MultiSeparateTask):
+    """
+    I encode tracks one after the other, each from its own pipe.
+
+    The pipes of tracks I do not get to encode are closed when I stop.
+
+    @ivar encoders: the tasks encoding the tracks, once started
+    @type encoders: list of L{morituri.common.encode.EncodeTask}
+    """
+
+    description = 'Encoding tracks'
+
+    def __init__(self, fds, paths, profile, taglists, digests, lengths,
+                 whats):
+        task.MultiSeparateTask.__init__(self)
+
+        self._fds = list(fds) # not handed to an encoder yet
+        self._paths = paths
+        self._profile = profile
+        self._taglists = taglists
+        self._digests = digests
+        self._lengths = lengths
+        self._whats = whats
+        self.encoders = []
+
+    def start(self, runner):
+        try:
+            self.addTask(self._nextEncoder())
+        except:
+            self._closeFds()
+            raise
+
+        task.MultiSeparateTask.start(self, runner)
+
+    def stop(self):
+        self._closeFds()
+        task.MultiSeparateTask.stop(self)
+
+    def _nextEncoder(self):
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        i = len(self.encoders)
+        encoder = encode.EncodeTask(None, self._paths[i], self._profile,
+            taglist=self._taglists[i], what=self._whats[i],
+            digests=self._digests[i], fd=self._fds[i],
+            length=self._lengths[i])
+        self._fds[i] = None
+        self.encoders.append(encoder)
+        return encoder
+
+    def _closeFds(self):
+        # whoever writes to these pipes would block otherwise
+        for i, fd in enumerate(self._fds):
+            if fd is not None:
+                os.close(fd)
+                self._fds[i] = None
+
+    ### ITaskListener methods
+    def stopped(self, taskk):
+        if not taskk.exception and len(self.encoders) < len(self._paths):
+            try:
+                self.addTask(self._nextEncoder())
+            except Exception, e:
+                self.setException(e)
+                self.stop()
+                return
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+
+class ReadSplitEncodeTask(ctask.MultiParallelTask):
+    """
+    I am a task that reads consecutive tracks using a single cdparanoia
+    run, splits the audio at the track boundaries and encodes each track,
+    streaming the audio through pipes.
+
+    @ivar reader:  the task reading the tracks
+    @type reader:  L{ReadTrackTask}
+    @ivar encoder: the task encoding the tracks
+    @type encoder: L{_EncodePartsTask}
+    """
+
+    reader = None
+    encoder = None
+
+    def __init__(self, paths, table, spans, overread, offset=0,
+                 device=None, profile=None, taglists=None, digests=None,
+                 action="Reading", what="tracks", whats=None, paranoia=True,
+                 reader='cdparanoia'):
+        """
+        @param paths:    where to store each encoded track
+        @type  paths:    list of unicode
+        @param spans:    the first and last frame of each track; each track
+                         starts right after the previous one
+        @type  spans:    list of (int, int)
+        @param taglists: the tags for each track
+        @param digests:  the digests to feed each track's audio to while
+                         encoding
+        @type  digests:  list of list of objects with an update(data) method
+        @param what:     a string representing all tracks being read
+        @param whats:    a string representing each track being encoded
+        @param reader:   what reads the tracks; see L{createReadTrackTask}
+        @type  reader:   str
+
+        See L{ReadTrackTask} and L{morituri.common.encode.EncodeTask} for
+        the other parameters.
+        """
+        ctask.MultiParallelTask.__init__(self)
+
+        for (_, stop), (start, _) in zip(spans[:-1], spans[1:]):
+            assert start == stop + 1, "tracks are not consecutive"
+
+        self.paths = paths
+        self._table = table
+        self._spans = spans
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._profile = profile
+        self._taglists = taglists or [None] * len(paths)
+        self._digests = digests or [[] for _ in paths]
+        self._action = action
+        self._what = what
+        self._whats = whats or ["track"] * len(paths)
+        self._paranoia = paranoia
+        self._reader = reader
+        self._thread = None
+        self.description = "%s and encoding %s" % (action, what)
+
+    def start(self, runner):
+        readfd, writefd = os.pipe()
+
+        self.reader = createReadTrackTask(None, self._table,
+            self._spans[0][0], self._spans[-1][1], self._overread,
+            offset=self._offset, device=self._device, action=self._action,
+            what=self._what, stdout=writefd, paranoia=self._paranoia,
+            reader=self._reader)
+
+        fds = []
+        writers = []
+        for _ in self._spans:
+            r, w = os.pipe()
+            fds.append(r)
+            writers.append([_PipeWriter(w)])
+        sizes = [(stop - start + 1) * common.BYTES_PER_FRAME
+            for start, stop in self._spans]
+
+        self._thread = _SplitThread(readfd,
+            digest.SplitDigest(sizes, writers))
+        self._thread.start()
+
+        self.encoder = _EncodePartsTask(fds, self.paths, self._profile,
+            self._taglists, self._digests, self._getLengths(), self._whats)
+
+        # cdparanoia needs to be started before the encoders can preroll
+        self.tasks = [self.reader, self.encoder]
+        ctask.MultiParallelTask.start(self, runner)
+
+    def stop(self):
+        # cdparanoia has exited and all pipes are closed, so the thread
+        # sees the end of the audio
+        if self._thread:
+            self._thread.join()
+
+        if not self.exception:
+            for path, encoder, length in zip(self.paths,
+                    self.encoder.encoders, self._getLengths()):
+                if encoder.samples != length:
+                    msg = "Encoded %d samples instead of the expected " \
+                        "%d" % (encoder.samples, length)
+                    logger.warning(msg)
+                    self.setExceptionAndTraceback(FileSizeError(path, msg))
+                    break
+
+        ctask.MultiParallelTask.stop(self)
+
+    def _getLengths(self):
+        return [(stop - start + 1) * common.SAMPLES_PER_FRAME
+            for start, stop in self._spans]
+
+
+class VerifyEncodingTask(task.MultiSeparateTask):
+    """
+    I am a task that checks that an encoded track decodes to the audio
+    that was read, and then moves it to its final path.
+    I remove the encoded track if it does not match.
+    """
+
+    description = 'Verifying encoding'
+
+    def __init__(self, tmppath, path, expected):
+        """
+        @param tmppath:  the encoded track
+        @type  tmppath:  unicode
+        @param path:     where to move the encoded track to
+        @type  path:     unicode
+        @param expected: the CRC32 checksum of the audio that was read
+        @type  expected: int
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        self.path = path
+        self._tmppath = tmppath
+        self._expected = expected
+        self._crc = digest.CRC32Digest()
+
+        # here to avoid import gst eating our options
+        from morituri.common import checksum
+
+        self.tasks = [checksum.AnalysisTask(tmppath, [self._crc])]
+
+    def stop(self):
+        try:
+            if not self.exception and self._crc.checksum != self._expected:
+                self.exception = ChecksumException(
+                    'Encoding failed, checksum does not match')
+
+            if not self.exception:
+                try:
+                    logger.debug('Moving to final path %r', self.path)
+                    os.rename(self._tmppath, self.path)
+                except Exception, e:
+                    logger.debug('Exception while moving to final path %r: '
+                        '%r',
+                        self.path, str(e))
+                    self.exception = e
+            elif os.path.exists(self._tmppath):
+                os.unlink(self._tmppath)
+        except Exception, e:
+            print 'WARNING: unhandled exception %r' % (e, )
+
+        task.MultiSeparateTask.stop(self)
+
+
+# test and copy reads are compared per segment of this many frames, and
+# only segments that differ are read again
+_SEGMENT_FRAMES = common.FRAMES_PER_SECOND
+
+
+class _BufferDigest(object):
+    """
+    I keep the audio I am fed, as a digest.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def update(self, data):
+        self._chunks.append(data)
+
+    @property
+    def data(self):
+        """
+        @rtype: str
+        """
+        return ''.join(self._chunks)
+
+
+class ReReadSegmentsTask(task.MultiSeparateTask):
+    """
+    I am a task that reads the segments of a track again where its test
+    and copy read differ, until every segment was read the same way twice.
+
+    Each run of consecutive differing segments is read with a single
+    cdparanoia run.  A segment is settled once a read of it has a checksum
+    an earlier read already had; segments still unsettled are read again
+    in a next round, up to L{_MAX_ROUNDS} rounds.
+
+    @ivar patches: for the settled segments whose audio differs from the
+                   copy read, the byte offset in the track and the audio
+    @type patches: list of (int, str)
+    @ivar segments: the number of segments that were read again
+    @type segments: int
+    """
+
+    description = 'Re-reading segments'
+
+    _MAX_ROUNDS = 5
+
+    def __init__(self, table, start, stop, overread, testchecksums,
+                 copychecksums, offset=0, device=None, what="track",
+                 reader='cdparanoia'):
+        """
+        @param testchecksums: the segment checksums of the test read
+        @type  testchecksums: list of int
+        @param copychecksums: the segment checksums of the copy read
+        @type  copychecksums: list of int
+        @param reader:        what reads the segments; see
+                              L{createReadTrackTask}
+        @type  reader:        str
+
+        See L{ReadTrackTask} for the other parameters.
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        self._table = table
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._what = what
+        self._reader = reader
+
+        self._copychecksums = copychecksums
+        # the checksums each unsettled segment was read with so far
+        self._seen = {}
+        count = max(len(testchecksums), len(copychecksums))
+        for i in range(count):
+            seen = set(testchecksums[i:i + 1] + copychecksums[i:i + 1])
+            if len(seen) != 1:
+                self._seen[i] = seen
+
+        self.segments = len(self._seen)
+        self.patches = []
+        self._round = 0
+        self._reads = {} # read task -> list of (segment, crc, buffer)
+
+        logger.debug('%d segments differ: %r', self.segments,
+            sorted(self._seen))
+        self._addRound()
+
+    def _addRound(self):
+        self._round += 1
+        segments = sorted(self._seen)
+        runs = []
+        for i in segments:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+
+        for run in runs:
+            start, _ = self._getSpan(run[0])
+            _, stop = self._getSpan(run[-1])
+            segments = []
+            sizes = []
+            digests = []
+            for i in run:
+                first, last = self._getSpan(i)
+                crc = digest.CRC32Digest()
+                buf = _BufferDigest()
+                segments.append((i, crc, buf))
+                sizes.append((last - first + 1) * common.BYTES_PER_FRAME)
+                digests.append([crc, buf])
+
+            t = createReadTrackTask(None, self._table, start, stop,
+                self._overread, offset=self._offset, device=self._device,
+                action="Re-reading", what="%s, %s - %s" % (self._what,
+                    common.framesToMSF(start - self._start),
+                    common.framesToMSF(stop + 1 - self._start)),
+                digests=[digest.SplitDigest(sizes, digests)],
+                reader=self._reader)
+            self._reads[t] = segments
+            self.addTask(t)
+
+    def _getSpan(self, segment):
+        first = self._start + segment * _SEGMENT_FRAMES
+        return first, min(first + _SEGMENT_FRAMES - 1, self._stop)
+
+    ### ITaskListener methods
+    def stopped(self, taskk):
+        if not taskk.exception:
+            for i, crc, buf in self._reads.pop(taskk):
+                checksum = crc.checksum
+                if checksum not in self._seen[i]:
+                    self._seen[i].add(checksum)
+                    continue
+
+                logger.debug('segment %d settled in round %d, %08x',
+                    i, self._round, checksum)
+                del self._seen[i]
+                if i >= len(self._copychecksums) or \
+                        checksum != self._copychecksums[i]:
+                    first, _ = self._getSpan(i)
+                    self.patches.append((
+                        (first - self._start) * common.BYTES_PER_FRAME,
+                        buf.data))
+
+            if not self._reads and self._seen:
+                if self._round < self._MAX_ROUNDS:
+                    self._addRound()
+                else:
+                    self.setException(ChecksumException(
+                        '%d segments did not read the same twice' % len(
+                            self._seen)))
+                    self.stop()
+                    return
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+
+class _Splicer(object):
+    """
+    I replace parts of the audio I am fed with patches, and feed the result
+    to digests.  Digests with a close() method are closed when I am.
+    """
+
+    def __init__(self, patches, digests):
+        """
+        @param patches: the byte offset and the audio of each patch
+        @type  patches: list of (int, str)
+        @param digests: the digests to feed the patched audio to
+        @type  digests: list of objects with an update(data) method
+        """
+        self._patches = sorted(patches)
+        self._digests = digests
+        self._position = 0
+
+    def update(self, data):
+        start = self._position
+        end = start + len(data)
+        self._position = end
+
+        for offset, patch in self._patches:
+            if offset >= end:
+                break
+            if offset + len(patch) <= start:
+                continue
+            first = max(offset, start)
+            last = min(offset + len(patch), end)
+            data = data[:first - start] + patch[first - offset:last - offset] \
+                + data[last - start:]
+
+        for d in self._digests:
+            d.update(data)
+
+    def close(self):
+        for d in self._digests:
+            if hasattr(d, 'close'):
+                d.close()
+
+
+class SpliceEncodeTask(ctask.MultiParallelTask):
+    """
+    I am a task that decodes an encoded track, replaces parts of its audio
+    with patches and encodes the result again, streaming the audio through
+    pipes.
+
+    @ivar encoder: the task encoding the patched track
+    @type encoder: L{morituri.common.encode.EncodeTask}
+    """
+
+    description = 'Splicing re-read segments'
+
+    encoder = None
+
+    def __init__(self, inpath, outpath, profile, patches, length,
+                 taglist=None, digests=None, what="track"):
+        """
+        @param inpath:  the encoded track
+        @type  inpath:  unicode
+        @param outpath: where to store the patched track
+        @type  outpath: unicode
+        @param patches: the byte offset and the audio of each patch
+        @type  patches: list of (int, str)
+        @param length:  the length of the track, in samples
+        @type  length:  int
+
+        See L{morituri.common.encode.EncodeTask} for the other parameters.
+        """
+        ctask.MultiParallelTask.__init__(self)
+
+        self.path = outpath
+        self._inpath = inpath
+        self._profile = profile
+        self._patches = patches
+        self._length = length
+        self._taglist = taglist
+        self._digests = digests
+        self._what = what
+        self._thread = None
+
+    def start(self, runner):
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        # the decoder writes to one pipe, the encoder reads from the other
+        readfd, decodefd = os.pipe()
+        encodefd, writefd = os.pipe()
+
+        self._thread = _SplitThread(readfd,
+            _Splicer(self._patches, [_PipeWriter(writefd)]))
+        self._thread.start()
+
+        self.encoder = encode.EncodeTask(None, self.path, self._profile,
+            taglist=self._taglist, what=self._what, digests=self._digests,
+            fd=encodefd, length=self._length)
+        self.tasks = [encode.DecodeTask(self._inpath, decodefd),
+            self.encoder]
+        ctask.MultiParallelTask.start(self, runner)
+
+    def stop(self):
+        if self._thread:
+            self._thread.join()
+
+        if not self.exception and self.encoder.samples != self._length:
+            msg = "Encoded %d samples instead of the expected %d" % (
+                self.encoder.samples, self._length)
+            logger.warning(msg)
+            self.setExceptionAndTraceback(FileSizeError(self.path, msg))
+
+        if self.exception and os.path.exists(self.path):
+            os.unlink(self.path)
+
+        ctask.MultiParallelTask.stop(self)
+
+
 class ReadVerifyTrackTask(task.MultiSeparateTask):
     """
     I am a task that reads and verifies a track using cdparanoia.
     I also encode the track.
 
+    The test read is only checksummed, and the copy read is encoded while
+    reading, so no temporary .wav file is written.
+
+    Unless told not to verify, I then check the encoded track and move it
+    to its final path; otherwise L{getVerifyTask} gives a task doing this,
+    to run later.
+
+    If given AccurateRip responses, I read the track only once if
+    possible: the copy read goes first, and the test read is skipped when
+    the AccurateRip checksum of the copy read matches a response with
+    enough confidence.
+
+    Both reads are also checksummed per segment of a second.  When the
+    reads differ, only the differing segments are read again, and the
+    track is encoded again with the segments that turned out to differ in
+    the copy read replaced.  Segments are always read again with paranoia,
+    even when the track was read in burst mode.
+
+    Given a checkpoint, each read keeps the audio it read in a file in the
+    working directory, and the checkpoint is updated regularly with how
+    much of each file is on disk.  A read that was interrupted then
+    resumes where it got.  The files are removed if I fail; otherwise
+    they are kept until the track is committed, see L{clearCheckpoint}.
+
     The path where the file is stored can be changed if necessary, for
     example if the file name is too long.
 
     @ivar path:         the path where the file is to be stored.
-    @ivar checksum:     the checksum of the track; set if they match.
+    @ivar checksum:     the checksum of the track; set if they match, or
+                        once the segments that differ were read again.
     @ivar testchecksum: the test checksum of the track.
     @ivar copychecksum: the copy checksum of the track.
     @ivar testspeed:    the test speed of the track, as a multiple of
@@ -414,23 +1606,49 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     @ivar testduration: the test duration of the track, in seconds.
     @ivar copyduration: the copy duration of the track, in seconds.
     @ivar peak:         the peak level of the track
+    @ivar arv1:         the AccurateRip v1 checksum of the copy read;
+                        set if the track number and count are given.
+    @ivar arv2:         the AccurateRip v2 checksum of the copy read;
+                        set if the track number and count are given.
+    @ivar singleRead:   whether the test read was skipped because the copy
+                        read matched AccurateRip; None if no responses were
+                        given.
+    @ivar arConfidence: the confidence of the AccurateRip match for a
+                        single read.
+    @ivar readCounts:   how many times each frame was read by the copy
+                        read.
+    @ivar rereadSegments: how many segments were read again because the
+                          test and copy read differed.
+    @ivar duration:     how long I ran, in seconds; also set if I failed.
     """
 
     checksum = None
     testchecksum = None
     copychecksum = None
     peak = None
+    arv1 = None
+    arv2 = None
     quality = None
     testspeed = None
     copyspeed = None
     testduration = None
     copyduration = None
+    singleRead = None
+    arConfidence = None
+    readCounts = None
+    rereadSegments = 0
+    duration = None
 
-    _tmpwavpath = None
     _tmppath = None
+    _startTime = None
+
+    _CHECKPOINT_INTERVAL = 5 # seconds between checkpoints
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-                 device=None, profile=None, taglist=None, what="track"):
+                 device=None, profile=None, taglist=None, what="track",
+                 trackNumber=None, trackCount=None, verify=True,
+                 responses=None, minConfidence=1, paranoia=True,
+                 checkpoint=None, onCheckpoint=None, reader='cdparanoia'):
         """
         @param path:    where to store the ripped track
         @type  path:    str
@@ -448,6 +1666,29 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
         @type  profile: L{encode.Profile}
         @param taglist: a list of tags
         @param taglist: L{gst.TagList}
+        @param trackNumber: the number of the track, for AccurateRip
+        @type  trackNumber: int
+        @param trackCount:  the number of audio tracks, for AccurateRip
+        @type  trackCount:  int
+        @param verify:  whether to verify the encoded track after reading
+        @type  verify:  bool
+        @param responses:     AccurateRip responses to allow a single read
+                              with; needs the track number and count
+        @type  responses:     list of L{accurip.AccurateRipResponse}
+        @param minConfidence: the lowest confidence of a matching response
+                              for a single read
+        @type  minConfidence: int
+        @param paranoia: whether to read with paranoia; otherwise the test
+                         and copy read are done in burst mode
+        @type  paranoia: bool
+        @param checkpoint:   where the reads of the track got, to resume
+                             them and to keep up to date
+        @type  checkpoint:   L{morituri.result.result.Checkpoint}
+        @param onCheckpoint: called without arguments when the checkpoint
+                             was updated, to store it
+        @type  onCheckpoint: callable
+        @param reader:   what reads the track; see L{createReadTrackTask}
+        @type  reader:   str
         """
         task.MultiSeparateTask.__init__(self)
 
@@ -455,100 +1696,509 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
 
         if taglist:
             logger.debug('read and verify with taglist %r', taglist)
-        # FIXME: choose a dir on the same disk/dir as the final path
-        fd, tmppath = tempfile.mkstemp(suffix='.morituri.wav')
-        tmppath = unicode(tmppath)
-        os.close(fd)
-        self._tmpwavpath = tmppath
 
-        # here to avoid import gst eating our options
-        from morituri.common import checksum
-
-        self.tasks = []
-        self.tasks.append(
-            ReadTrackTask(tmppath, table, start, stop, overread,
-                offset=offset, device=device, what=what))
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        t = ReadTrackTask(tmppath, table, start, stop, overread,
-            offset=offset, device=device, action="Verifying", what=what)
-        self.tasks.append(t)
-        self.tasks.append(checksum.CRC32Task(tmppath))
+        # each read and the encoded file are checksummed only once; all
+        # checksums and the peak level are calculated while streaming
+        self._testcrc = digest.CRC32Digest()
+        self._copycrc = digest.CRC32Digest()
+        segment = _SEGMENT_FRAMES * common.BYTES_PER_FRAME
+        self._testsegments = digest.SegmentDigest(segment)
+        self._copysegments = digest.SegmentDigest(segment)
+        self._crc = self._copycrc # of the encoded audio
+        self._verify = verify
+        copydigests = [self._copycrc, self._copysegments]
+        self._accurip = None
+        if trackNumber and trackCount:
+            self._accurip = accurip.AccurateRipChecksum(trackNumber,
+                trackCount)
+            copydigests.append(self._accurip)
+        self._trackNumber = trackNumber
+        self._trackCount = trackCount
+        self._responses = None
+        if self._accurip and responses:
+            self._responses = responses
+            self._minConfidence = minConfidence
+
+        # with responses, the copy read comes first and the test read is
+        # only added once we know it is needed
+        testaction, copyaction = "Reading", "Verifying"
+        if self._responses:
+            testaction, copyaction = copyaction, testaction
+
+        self._checkpoint = checkpoint
+        self._onCheckpoint = onCheckpoint
+        self._reader = reader
+        testdigests = [self._testcrc, self._testsegments]
+        copypath = None
+        copyframes = 0
+        if checkpoint:
+            if not checkpoint.testpath:
+                checkpoint.testpath = _createCheckpointFile(u'.test.raw')
+                checkpoint.copypath = _createCheckpointFile(u'.copy.raw')
+            self._testread = ResumableReadTask(checkpoint.testpath,
+                checkpoint.testframes, table, start, stop, overread,
+                offset=offset, device=device, action=testaction, what=what,
+                digests=testdigests, paranoia=paranoia, reader=reader)
+            copypath = checkpoint.copypath
+            copyframes = checkpoint.copyframes
+        else:
+            self._testread = createReadTrackTask(None, table, start, stop,
+                overread, offset=offset, device=device, action=testaction,
+                what=what, digests=testdigests, paranoia=paranoia,
+                reader=reader)
 
         # encode to the final path + '.part'
-        try:
-            tmpoutpath = path + u'.part'
-            open(tmpoutpath, 'wb').close()
-        except IOError, e:
-            if errno.ENAMETOOLONG != e.errno:
-                raise
-            path = common.shrinkPath(path)
-            tmpoutpath = path + u'.part'
-            open(tmpoutpath, 'wb').close()
+        path, tmpoutpath = _createPartFile(path)
         self._tmppath = tmpoutpath
         self.path = path
 
-        # here to avoid import gst eating our options
-        from morituri.common import encode
+        self._copyread = ReadEncodeTrackTask(tmpoutpath, table, start, stop,
+            overread, offset=offset, device=device, profile=profile,
+            taglist=taglist, digests=copydigests, action=copyaction,
+            what=what, paranoia=paranoia, checkpoint=copypath,
+            frames=copyframes, reader=reader)
 
-        self.tasks.append(encode.EncodeTask(tmppath, tmpoutpath, profile,
-            taglist=taglist, what=what))
-        # make sure our encoding is accurate
-        self.tasks.append(checksum.CRC32Task(tmpoutpath))
-        self.tasks.append(encode.SoxPeakTask(tmppath))
+        if self._responses:
+            self.tasks = [self._copyread]
+        else:
+            self.tasks = [self._testread, self._copyread]
+
+        # to read segments again and encode them in place
+        self._table = table
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._profile = profile
+        self._taglist = taglist
+        self._what = what
+        self._reread = None
+        self._splice = None
 
         self.checksum = None
 
+    def getVerifyTask(self):
+        """
+        Get the task verifying the encoded track, once the reads matched.
+
+        @rtype: L{VerifyEncodingTask}
+        """
+        return VerifyEncodingTask(self._tmppath, self.path, self.checksum)
+
+    def start(self, runner):
+        self._startTime = time.time()
+        task.MultiSeparateTask.start(self, runner)
+
+        if self._checkpoint:
+            self.schedule(self._CHECKPOINT_INTERVAL, self._saveCheckpoint)
+
+    def _saveCheckpoint(self):
+        if not self.running:
+            return
+
+        self._updateCheckpoint()
+        self.schedule(self._CHECKPOINT_INTERVAL, self._saveCheckpoint)
+
+    def _updateCheckpoint(self):
+        checkpoint = self._checkpoint
+        checkpoint.testframes = self._testread.sync()
+        if self._copyread.reader:
+            checkpoint.copyframes = self._copyread.reader.sync()
+        logger.debug('checkpoint: test read %d frames, copy read %d frames',
+            checkpoint.testframes, checkpoint.copyframes)
+
+        if self._onCheckpoint:
+            self._onCheckpoint()
+
     def stop(self):
+        if self._startTime is not None:
+            self.duration = time.time() - self._startTime
+
         # FIXME: maybe this kind of try-wrapping to make sure
         # we chain up should be handled by a parent class function ?
         try:
             if not self.exception:
-                self.quality = max(self.tasks[0].quality,
-                    self.tasks[2].quality)
-                self.peak = self.tasks[6].peak
+                copyread = self._copyread.reader
+                self.readCounts = copyread.readCounts
+                encoder = self._copyread.encoder
+                if self._splice:
+                    encoder = self._splice.encoder
+                self.peak = encoder.peak
                 logger.debug('peak: %r', self.peak)
-                self.testspeed = self.tasks[0].speed
-                self.copyspeed = self.tasks[2].speed
-                self.testduration = self.tasks[0].duration
-                self.copyduration = self.tasks[2].duration
-
-                self.testchecksum = c1 = self.tasks[1].checksum
-                self.copychecksum = c2 = self.tasks[3].checksum
-                if c1 == c2:
+                self.copyspeed = copyread.speed
+                self.copyduration = copyread.duration
+                self.copychecksum = c2 = self._copycrc.checksum
+
+                if self.singleRead:
+                    self.quality = copyread.quality
+                    self.testspeed = 0.0
+                    self.testduration = 0.0
+                else:
+                    testread = self._testread
+                    self.quality = max(testread.quality, copyread.quality)
+                    self.testspeed = testread.speed
+                    self.testduration = testread.duration
+                    self.testchecksum = c1 = self._testcrc.checksum
+
+                if self.singleRead:
+                    logger.info('Single read matched AccurateRip, %08x' % c2)
+                    self.checksum = self.copychecksum
+                elif self._match():
                     logger.info('Checksums match, %08x' % c1)
                     self.checksum = self.testchecksum
+                elif self._reread:
+                    # every segment was read the same way twice now
+                    self.rereadSegments = self._reread.segments
+                    self.checksum = self._crc.checksum
+                    logger.info('Checksums %08x %08x match as %08x after '
+                        're-reading %d segments' % (c1, c2, self.checksum,
+                            self.rereadSegments))
                 else:
-                    # FIXME: detect this before encoding
                     logger.info('Checksums do not match, %08x %08x' % (
                         c1, c2))
                     self.exception = ChecksumException(
                         'read and verify failed: test checksum')
+                    os.unlink(self._tmppath)
 
-                if self.tasks[5].checksum != self.checksum:
-                    self.exception = ChecksumException(
-                        'Encoding failed, checksum does not match')
-
-                # delete the unencoded file
-                os.unlink(self._tmpwavpath)
-
-                if not self.exception:
-                    try:
-                        logger.debug('Moving to final path %r', self.path)
-                        os.rename(self._tmppath, self.path)
-                    except Exception, e:
-                        logger.debug('Exception while moving to final path %r: '
-                            '%r',
-                            self.path, str(e))
-                        self.exception = e
+                if self._accurip:
+                    self.arv1 = self._accurip.v1
+                    self.arv2 = self._accurip.v2
+            else:
+                logger.debug('stop: exception %r', self.exception)
+
+            # a failed rip starts over
+            if self.exception and self._checkpoint:
+                clearCheckpoint(self._checkpoint)
+                if self._onCheckpoint:
+                    self._onCheckpoint()
+        except Exception, e:
+            print 'WARNING: unhandled exception %r' % (e, )
+
+        task.MultiSeparateTask.stop(self)
+
+    def _match(self):
+        return self._testcrc.checksum == self._copycrc.checksum
+
+    def _repaired(self, taskk):
+        """
+        Handle the end of re-reading segments or of encoding them in place.
+
+        @returns: whether the encoded track now has the audio both reads
+                  agree on
+        """
+        if taskk is self._splice:
+            os.rename(self._splice.path, self._tmppath)
+            return True
+
+        # without patches, the copy read was right all along
+        if not self._reread.patches:
+            return True
+
+        self._splice = self._getSpliceTask()
+        self.addTask(self._splice)
+        return False
+
+    def _getSpliceTask(self):
+        """
+        Get the task encoding the track again with the re-read segments.
+
+        @rtype: L{SpliceEncodeTask}
+        """
+        fd, path = tempfile.mkstemp(suffix=u'.part',
+            dir=os.path.dirname(self._tmppath))
+        os.close(fd)
+
+        self._crc = digest.CRC32Digest()
+        digests = [self._crc]
+        if self._accurip:
+            self._accurip = accurip.AccurateRipChecksum(self._trackNumber,
+                self._trackCount)
+            digests.append(self._accurip)
+
+        length = (self._stop - self._start + 1) * common.SAMPLES_PER_FRAME
+        return SpliceEncodeTask(self._tmppath, path, self._profile,
+            self._reread.patches, length, taglist=self._taglist,
+            digests=digests, what=self._what)
+
+    def _matchAccurateRip(self):
+        """
+        Check whether the copy read matched AccurateRip with enough
+        confidence for a single read, and record the outcome.
+        """
+        confidence = accurip.getMatchConfidence(self._responses,
+            self._trackNumber, [self._accurip.v1, self._accurip.v2])
+        self.singleRead = confidence is not None and \
+            confidence >= self._minConfidence
+        if self.singleRead:
+            self.arConfidence = confidence
+        logger.info('AccurateRip confidence %r, %s', confidence,
+            self.singleRead and 'single read' or 'reading again to test')
+        return self.singleRead
+
+    ### ITaskListener methods
+    def stopped(self, taskk):
+        if not taskk.exception:
+            if self._checkpoint and taskk in (self._testread,
+                    self._copyread):
+                self._updateCheckpoint()
+
+            readsDone = False
+            if taskk is self._copyread and self._responses:
+                if self._matchAccurateRip():
+                    readsDone = True
                 else:
-                    os.unlink(self._tmppath)
+                    self.addTask(self._testread)
+            elif taskk is self.tasks[1] and \
+                    taskk in (self._testread, self._copyread):
+                readsDone = self._match()
+                if not readsDone:
+                    logger.info('Checksums do not match, re-reading the '
+                        'segments that differ')
+                    self._reread = ReReadSegmentsTask(self._table,
+                        self._start, self._stop, self._overread,
+                        self._testsegments.checksums,
+                        self._copysegments.checksums, offset=self._offset,
+                        device=self._device, what=self._what,
+                        reader=self._reader)
+                    self.addTask(self._reread)
+            elif taskk is self._reread or taskk is self._splice:
+                try:
+                    readsDone = self._repaired(taskk)
+                except Exception, e:
+                    self.setException(e)
+                    self.stop()
+                    return
+
+            # verify the encoding once the reads are done and match
+            if readsDone and self._verify:
+                self.checksum = self._crc.checksum
+                self.addTask(self.getVerifyTask())
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+
+class DiscTrackRead:
+    """
+    I hold what a L{ReadVerifyDiscTask} read for one of its tracks, with
+    the same attributes as a L{ReadVerifyTrackTask} that ran.
+    """
+
+    checksum = None
+    testchecksum = None
+    copychecksum = None
+    peak = None
+    arv1 = None
+    arv2 = None
+    quality = None
+    testspeed = None
+    copyspeed = None
+    testduration = None
+    copyduration = None
+    singleRead = None
+    arConfidence = None
+    readCounts = None
+    rereadSegments = 0
+
+    def __init__(self, path, tmppath, trackNumber=None, trackCount=None):
+        self.path = path
+        self.tmppath = tmppath
+        self.trackNumber = trackNumber
+
+        self.testcrc = digest.CRC32Digest()
+        self.copycrc = digest.CRC32Digest()
+        self.accurip = None
+        if trackNumber and trackCount:
+            self.accurip = accurip.AccurateRipChecksum(trackNumber,
+                trackCount)
+
+    def getVerifyTask(self):
+        """
+        Get the task verifying the encoded track, once the reads matched.
+
+        @rtype: L{VerifyEncodingTask}
+        """
+        return VerifyEncodingTask(self.tmppath, self.path, self.checksum)
+
+
+class ReadVerifyDiscTask(task.MultiSeparateTask):
+    """
+    I am a task that reads and verifies consecutive tracks using
+    cdparanoia, with one continuous test read and one continuous copy read
+    for all of them.  The audio is split at the track boundaries, so each
+    track still gets its own checksums and encoded file.
+
+    I do not verify the encoded tracks; the track reads that matched give
+    a task doing this, to run later.  Tracks whose reads did not match
+    have no checksum, and their encoded file is removed.
+
+    If given AccurateRip responses, the copy read goes first, and the test
+    read is skipped if the AccurateRip checksums of all tracks match
+    responses with enough confidence.
+
+    The quality of each track is calculated from the frames of the track;
+    the speed is that of the whole read, and the durations are split over
+    the tracks by their length.
+
+    @ivar tracks: what was read for each track
+    @type tracks: list of L{DiscTrackRead}
+    """
+
+    description = 'Reading tracks'
+
+    def __init__(self, paths, table, spans, overread, offset=0,
+                 device=None, profile=None, taglists=None, what="tracks",
+                 whats=None, trackNumbers=None, trackCount=None,
+                 responses=None, minConfidence=1, paranoia=True,
+                 reader='cdparanoia'):
+        """
+        @param paths:        where to store each track
+        @type  paths:        list of unicode
+        @param spans:        the first and last frame of each track; each
+                             track starts right after the previous one
+        @type  spans:        list of (int, int)
+        @param taglists:     the tags for each track
+        @param whats:        a string representing each track
+        @type  whats:        list of str
+        @param trackNumbers: the number of each track, for AccurateRip;
+                             None for tracks not covered by it
+        @type  trackNumbers: list of int
+        @param trackCount:   the number of audio tracks, for AccurateRip
+        @type  trackCount:   int
+
+        See L{ReadVerifyTrackTask} for the other parameters.
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        logger.debug('Creating read and verify task on %d tracks',
+            len(paths))
+
+        trackNumbers = trackNumbers or [None] * len(paths)
+        self.tracks = []
+        for path, number in zip(paths, trackNumbers):
+            path, tmppath = _createPartFile(path)
+            self.tracks.append(DiscTrackRead(path, tmppath, number,
+                trackCount))
+
+        self._spans = spans
+        self._responses = responses
+        self._minConfidence = minConfidence
+
+        testaction, copyaction = "Reading", "Verifying"
+        if self._responses:
+            testaction, copyaction = copyaction, testaction
+
+        sizes = [(stop - start + 1) * common.BYTES_PER_FRAME
+            for start, stop in spans]
+        self._testread = createReadTrackTask(None, table, spans[0][0],
+            spans[-1][1], overread, offset=offset, device=device,
+            action=testaction, what=what,
+            digests=[digest.SplitDigest(sizes,
+                [[t.testcrc] for t in self.tracks])], paranoia=paranoia,
+            reader=reader)
+
+        copydigests = []
+        for t in self.tracks:
+            copydigests.append([t.copycrc])
+            if t.accurip:
+                copydigests[-1].append(t.accurip)
+        self._copyread = ReadSplitEncodeTask(
+            [t.tmppath for t in self.tracks], table, spans, overread,
+            offset=offset, device=device, profile=profile,
+            taglists=taglists, digests=copydigests, action=copyaction,
+            what=what, whats=whats, paranoia=paranoia, reader=reader)
+
+        if self._responses:
+            # the test read is added once we know it is needed
+            self.tasks = [self._copyread]
+        else:
+            self.tasks = [self._testread, self._copyread]
+
+    def stop(self):
+        try:
+            if not self.exception:
+                self._setResults()
             else:
                 logger.debug('stop: exception %r', self.exception)
+                for t in self.tracks:
+                    if os.path.exists(t.tmppath):
+                        os.unlink(t.tmppath)
         except Exception, e:
             print 'WARNING: unhandled exception %r' % (e, )
 
         task.MultiSeparateTask.stop(self)
 
+    def _setResults(self):
+        testread = self._testread
+        tested = testread in self.tasks
+        copyread = self._copyread.reader
+        first = self._spans[0][0]
+        frames = self._spans[-1][1] - first + 1
+
+        for t, encoder, (start, stop) in zip(self.tracks,
+                self._copyread.encoder.encoders, self._spans):
+            share = float(stop - start + 1) / frames
+            part = slice(start - first, stop - first + 1)
+
+            t.readCounts = copyread.readCounts[part]
+            t.peak = encoder.peak
+            t.copyspeed = copyread.speed
+            t.copyduration = copyread.duration * share
+            t.copychecksum = t.copycrc.checksum
+            if t.accurip:
+                t.arv1 = t.accurip.v1
+                t.arv2 = t.accurip.v2
+
+            if tested:
+                t.quality = max(getQuality(testread.readCounts[part]),
+                    getQuality(t.readCounts))
+                t.testspeed = testread.speed
+                t.testduration = testread.duration * share
+                t.testchecksum = t.testcrc.checksum
+            else:
+                t.quality = getQuality(t.readCounts)
+                t.testspeed = 0.0
+                t.testduration = 0.0
+
+            if t.singleRead or t.testchecksum == t.copychecksum:
+                logger.info('Track %r read, %08x', t.trackNumber,
+                    t.copychecksum)
+                t.checksum = t.copychecksum
+            else:
+                logger.info('Track %r checksums do not match, %08x %08x',
+                    t.trackNumber, t.testchecksum, t.copychecksum)
+                os.unlink(t.tmppath)
+
+    def _matchAccurateRip(self):
+        """
+        Check which tracks matched AccurateRip with enough confidence for
+        a single read, and record the outcome.
+
+        @returns: whether all tracks did
+        """
+        for t in self.tracks:
+            t.singleRead = False
+            if not t.accurip:
+                continue
+
+            confidence = accurip.getMatchConfidence(self._responses,
+                t.trackNumber, [t.accurip.v1, t.accurip.v2])
+            if confidence is not None and confidence >= self._minConfidence:
+                t.singleRead = True
+                t.arConfidence = confidence
+            logger.info('Track %d: AccurateRip confidence %r',
+                t.trackNumber, confidence)
+
+        return False not in [t.singleRead for t in self.tracks]
+
+    ### ITaskListener methods
+    def stopped(self, taskk):
+        if taskk is self._copyread and not taskk.exception and \
+                self._responses and not self._matchAccurateRip():
+            self.addTask(self._testread)
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
 _VERSION_RE = re.compile(
     "^cdparanoia (?P<version>.+) release (?P<release>.+) \(.*\)")
 
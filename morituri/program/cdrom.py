@@ -0,0 +1,523 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_program_cdrom -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read the table of contents of a disc straight from the drive.
+
+This asks the kernel for the same TOC cdrdao read-toc --fast-toc reads,
+without running cdrdao and parsing the .toc file it writes.
+
+The pre-gaps, indexes and ISRCs cdrdao read-toc finds by reading the Q
+sub-channel of the whole disc are found by reading it only around the
+index changes, which are bisected.
+"""
+
+import ctypes
+import ctypes.util
+import fcntl
+import os
+import struct
+import sys
+
+from morituri.image import table
+from morituri.program import cdrdao
+
+import logging
+logger = logging.getLogger(__name__)
+
+# from linux/cdrom.h
+_CDROMREADTOCHDR = 0x5305
+_CDROMREADTOCENTRY = 0x5306
+_CDROM_LBA = 0x01
+_CDROM_LEADOUT = 0xAA
+_CDROM_DATA_TRACK = 0x04
+_CDROM_PRE_EMPHASIS = 0x01
+_CDROM_SEND_PACKET = 0x5393
+_CGC_DATA_READ = 2
+
+# from the MMC specification
+_READ_CD = 0xBE
+_READ_TOC = 0x43
+_READ_CD_SUBCHANNEL_Q = 0x02
+_READ_TOC_CDTEXT = 0x05
+_Q_SIZE = 16
+_CDTEXT_PACK_SIZE = 18
+
+# modes of the Q sub-channel
+_Q_POSITION = 1
+_Q_CATALOG = 2
+_Q_ISRC = 3
+
+# a frame with a catalog number or ISRC comes at least once every this many
+_Q_INTERVAL = 100
+# how many frames are read to find a frame with a position
+_Q_PROBE = 10
+
+# the lead-out and lead-in between an audio session and a data session,
+# as in table.Table._getMusicBrainzValues
+_SESSION_GAP = 11250 + 150
+
+# CD-Text pack types
+_CDTEXT_KEYS = {
+    0x80: 'TITLE',
+    0x81: 'PERFORMER',
+    0x82: 'SONGWRITER',
+    0x83: 'COMPOSER',
+    0x84: 'ARRANGER',
+    0x85: 'MESSAGE',
+    0x86: 'DISCID',
+    0x8e: 'UPC_EAN',
+}
+
+# struct cdrom_tochdr: first and last track
+_TOCHDR = 'BB'
+# struct cdrom_tocentry: track, adr and ctrl bit fields, format,
+# the union cdrom_addr as an int lba, and datamode
+_TOCENTRY = 'BBBxiBxxx'
+
+
+def _getControl(adrCtrl):
+    # the adr:4 and ctrl:4 bit fields are allocated from the least
+    # significant bit on little-endian machines, from the most significant
+    # one on big-endian ones
+    if sys.byteorder == 'little':
+        return adrCtrl >> 4
+    return adrCtrl & 0x0f
+
+
+def readTOC(device, ioctl=fcntl.ioctl):
+    """
+    Read the table of contents of the disc in the given device.
+
+    Like cdrdao's fast TOC, the table only has index 1 of each track,
+    and the leadout.
+
+    @param ioctl: the function to issue ioctl calls with, as fcntl.ioctl
+    @type  device: str
+
+    @raises IOError: when the drive cannot read the table of contents
+    @rtype: L{table.Table}
+    """
+    fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        first, last = struct.unpack(_TOCHDR, ioctl(fd, _CDROMREADTOCHDR,
+            struct.pack(_TOCHDR, 0, 0)))
+        logger.debug('readTOC: tracks %d to %d', first, last)
+
+        def entry(number):
+            buf = struct.pack(_TOCENTRY, number, 0, _CDROM_LBA, 0, 0)
+            _, adrCtrl, _, lba, _ = struct.unpack(_TOCENTRY,
+                ioctl(fd, _CDROMREADTOCENTRY, buf))
+            return _getControl(adrCtrl), lba
+
+        tracks = []
+        for number in range(first, last + 1):
+            control, lba = entry(number)
+            logger.debug('readTOC: track %d, control %x, lba %d',
+                number, control, lba)
+            track = table.Track(number,
+                audio=not control & _CDROM_DATA_TRACK)
+            if control & _CDROM_PRE_EMPHASIS:
+                track.pre_emphasis = True
+            track.index(1, absolute=lba)
+            tracks.append(track)
+
+        _, leadout = entry(_CDROM_LEADOUT)
+    finally:
+        os.close(fd)
+
+    t = table.Table(tracks)
+    t.leadout = leadout
+    logger.debug('readTOC: leadout %d', leadout)
+    return t
+
+
+def _bcd(byte):
+    return (byte >> 4) * 10 + (byte & 0x0f)
+
+
+def _isrcCharacter(code):
+    # six bit codes: 0 to 9 are the digits, 17 to 42 the letters
+    if code < 10:
+        return str(code)
+    return chr(ord('A') + code - 17)
+
+
+class SubchannelQ:
+    """
+    I am the Q sub-channel of a frame, as the drive reports it.
+
+    @ivar adr:      the mode of the Q sub-channel
+    @type adr:      int
+    @ivar track:    for positions, the track number, 0xAA in the leadout
+    @type track:    int
+    @ivar index:    for positions, the index number
+    @type index:    int
+    @ivar absolute: for positions, the absolute offset of the frame
+    @type absolute: int
+    @ivar relative: for positions, how many frames the frame is from the
+                    start of index 1 of its track, or of the lead-out
+    @type relative: int
+    @ivar catalog:  for catalog numbers, the catalog number
+    @type catalog:  str
+    @ivar isrc:     for ISRCs, the ISRC
+    @type isrc:     str
+    """
+
+    adr = None
+    track = None
+    index = None
+    absolute = None
+    relative = None
+    catalog = None
+    isrc = None
+
+    def __init__(self, data):
+        b = struct.unpack('%dB' % _Q_SIZE, data)
+        self.adr = b[0] & 0x0f
+
+        if self.adr == _Q_POSITION:
+            self.track = b[1]
+            if self.track != _CDROM_LEADOUT:
+                self.track = _bcd(self.track)
+            self.index = _bcd(b[2])
+            self.relative = (_bcd(b[3]) * 60 + _bcd(b[4])) * 75 \
+                + _bcd(b[5])
+            self.absolute = (_bcd(b[7]) * 60 + _bcd(b[8])) * 75 \
+                + _bcd(b[9]) - 150
+        elif self.adr == _Q_CATALOG:
+            self.catalog = ''.join(['%02x' % x for x in b[1:8]])[:13]
+        elif self.adr == _Q_ISRC:
+            # five six bit characters, then seven BCD digits
+            bits = b[1] << 24 | b[2] << 16 | b[3] << 8 | b[4]
+            self.isrc = ''.join([_isrcCharacter(bits >> (26 - 6 * i) & 0x3f)
+                for i in range(5)])
+            self.isrc += ''.join(['%02x' % x for x in b[5:9]])[:7]
+
+    def __repr__(self):
+        return '<SubchannelQ adr %d track %r index %r absolute %r>' % (
+            self.adr, self.track, self.index, self.absolute)
+
+
+class _GenericCommand(ctypes.Structure):
+    # struct cdrom_generic_command from linux/cdrom.h
+    _fields_ = [
+        ('cmd', ctypes.c_ubyte * 12),
+        ('buffer', ctypes.c_void_p),
+        ('buflen', ctypes.c_uint),
+        ('stat', ctypes.c_int),
+        ('sense', ctypes.c_void_p),
+        ('data_direction', ctypes.c_ubyte),
+        ('quiet', ctypes.c_int),
+        ('timeout', ctypes.c_int),
+        ('reserved', ctypes.c_void_p),
+    ]
+
+
+class Drive:
+    """
+    I send the MMC commands the kernel has no ioctl for to a drive.
+    """
+
+    def __init__(self, device):
+        self._fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+            use_errno=True)
+
+    def close(self):
+        os.close(self._fd)
+
+    def _command(self, cmd, length):
+        buf = ctypes.create_string_buffer(length)
+        cgc = _GenericCommand()
+        cgc.cmd[:] = struct.unpack('12B', cmd)
+        cgc.buffer = ctypes.cast(buf, ctypes.c_void_p)
+        cgc.buflen = length
+        cgc.data_direction = _CGC_DATA_READ
+        cgc.quiet = 1
+
+        if self._libc.ioctl(self._fd, _CDROM_SEND_PACKET,
+                ctypes.byref(cgc)) < 0:
+            errno = ctypes.get_errno()
+            raise IOError(errno, os.strerror(errno))
+
+        return buf.raw
+
+    def readQ(self, lba, count):
+        """
+        Read the Q sub-channel, and nothing else, of consecutive frames.
+
+        @rtype: list of L{SubchannelQ}
+        """
+        cmd = struct.pack('>BBiBHBBB', _READ_CD, 0, lba,
+            count >> 16, count & 0xffff, 0, _READ_CD_SUBCHANNEL_Q, 0)
+        data = self._command(cmd, count * _Q_SIZE)
+        return [SubchannelQ(data[i:i + _Q_SIZE])
+            for i in range(0, count * _Q_SIZE, _Q_SIZE)]
+
+    def readCDText(self):
+        """
+        Read the CD-Text packs from the lead-in.
+
+        @returns: the packs, or an empty str if the disc has no CD-Text
+        @rtype:   str
+        """
+        def read(length):
+            cmd = struct.pack('>BBB3xBHB2x', _READ_TOC, 0, _READ_TOC_CDTEXT,
+                0, length, 0)
+            return self._command(cmd, length)
+
+        # the length does not count the two bytes of the length itself
+        length, = struct.unpack('>H', read(4)[:2])
+        if length <= 2:
+            return ''
+
+        return read(length + 2)[4:]
+
+
+def parseCDText(data):
+    """
+    Parse the text of the first block of CD-Text packs, as ISO 8859-1.
+
+    @returns: the CD-Text of the disc as number 0, and of the tracks
+    @rtype:   dict of int -> dict of str -> unicode
+    """
+    texts = {}
+    for i in range(0, len(data) - _CDTEXT_PACK_SIZE + 1, _CDTEXT_PACK_SIZE):
+        kind, number, _, position = struct.unpack('4B', data[i:i + 4])
+        # skip the other blocks and double byte character blocks
+        if kind not in _CDTEXT_KEYS or position & 0xf0:
+            continue
+        if kind not in texts:
+            texts[kind] = [number & 0x7f, '']
+        texts[kind][1] += data[i + 4:i + 16]
+
+    result = {}
+    for kind, (number, text) in texts.items():
+        value = None
+        # each value ends in a NUL; a TAB repeats the previous one
+        for s in text.split('\0')[:-1]:
+            if s != '\t':
+                value = s
+            key = _CDTEXT_KEYS[kind]
+            if kind == 0x8e and number > 0:
+                key = 'ISRC'
+            if value:
+                result.setdefault(number, {})[key] = value.decode('latin-1')
+            number += 1
+
+    return result
+
+
+class Scanner:
+    """
+    I find the pre-gaps, indexes and ISRCs of the tracks of a disc, and its
+    catalog number and CD-Text.
+
+    Only the Q sub-channel of a few frames is read for each index change,
+    which is found by bisecting between the track starts of the fast TOC.
+
+    @ivar reads: how many times frames were read
+    @type reads: int
+    """
+
+    reads = 0
+
+    _leadout = None
+
+    def __init__(self, drive):
+        """
+        @type drive: L{Drive}
+        """
+        self._drive = drive
+
+    def _readQ(self, lba, count):
+        self.reads += 1
+        return self._drive.readQ(lba, count)
+
+    def getPosition(self, lba):
+        """
+        @returns: the track and index number of the frame at lba
+        @rtype:   tuple of (int, int)
+        """
+        # frames with a catalog number or ISRC do not have a position,
+        # so take that of the next frame with one; one ending an index is
+        # taken to start the next
+        count = _Q_PROBE
+        if self._leadout is not None:
+            count = min(count, self._leadout - lba)
+        for q in self._readQ(lba, count):
+            if q.adr != _Q_POSITION:
+                continue
+            # the relative time counts down to index 1 in a pre-gap, and
+            # up from it after; it tells whether the frame comes before
+            # the start of the track or lead-out
+            if q.index == 0 or q.relative >= q.absolute - lba:
+                return q.track, q.index
+            break
+
+        # the frame ends the track before, so take that of the frame before
+        start = max(lba - _Q_PROBE, 0)
+        if start < lba:
+            for q in reversed(self._readQ(start, lba - start)):
+                if q.adr == _Q_POSITION:
+                    return q.track, q.index
+
+        raise IOError('no position in the Q sub-channel at frame %d' % lba)
+
+    def _search(self, lo, hi, position):
+        # the first frame from lo to hi at or after position;
+        # hi is known to be at or after it
+        while lo < hi:
+            middle = (lo + hi) / 2
+            if self.getPosition(middle) >= position:
+                hi = middle
+            else:
+                lo = middle + 1
+
+        return lo
+
+    def _searchBack(self, lo, hi, position):
+        # as _search, but pre-gaps are short, so first gallop back from hi
+        step = 1
+        while hi - step >= lo and self.getPosition(hi - step) >= position:
+            step *= 2
+
+        return self._search(max(hi - step + 1, lo), hi - step / 2, position)
+
+    def _find(self, lba, end, adr):
+        # the first frame of the given mode from lba on
+        count = min(_Q_INTERVAL, end - lba + 1)
+        for q in self._readQ(lba, count):
+            if q.adr == adr:
+                return q
+
+    def _getEnd(self, t, i):
+        # the last frame of track i, counting from 0
+        if i == len(t.tracks) - 1:
+            return t.leadout - 1
+
+        following = t.tracks[i + 1]
+        if not following.audio:
+            return following.getIndex(1).absolute - _SESSION_GAP - 1
+
+        return following.getFirstIndex().absolute - 1
+
+    def scan(self, toc):
+        """
+        @param toc: the fast table of contents of the disc
+        @type  toc: L{table.Table}
+
+        @rtype: L{table.Table}
+        """
+        t = table.Table()
+        t.leadout = self._leadout = toc.leadout
+        for fast in toc.tracks:
+            track = table.Track(fast.number, audio=fast.audio)
+            track.pre_emphasis = fast.pre_emphasis
+            track.index(1, absolute=fast.getIndex(1).absolute)
+            t.tracks.append(track)
+
+        # the pre-gap of the first track starts the disc
+        if t.getTrackStart(1) > 0:
+            t.tracks[0].index(0, absolute=0)
+
+        for i, track in enumerate(t.tracks[1:]):
+            if not track.audio or not t.tracks[i].audio:
+                continue
+            start = track.getIndex(1).absolute
+            lba = self._searchBack(t.getTrackStart(i + 1) + 1, start,
+                (track.number, 0))
+            if lba < start:
+                track.index(0, absolute=lba)
+                logger.debug('scan: track %d, index 0 at %d',
+                    track.number, lba)
+
+        for i, track in enumerate(t.tracks):
+            if not track.audio:
+                continue
+            lba = track.getIndex(1).absolute
+            end = self._getEnd(t, i)
+            number, last = self.getPosition(end)
+            if number == track.number:
+                for index in range(2, last + 1):
+                    lba = self._search(lba + 1, end, (track.number, index))
+                    track.index(index, absolute=lba)
+                    logger.debug('scan: track %d, index %d at %d',
+                        track.number, index, lba)
+
+            q = self._find(track.getIndex(1).absolute, end, _Q_ISRC)
+            if q:
+                track.isrc = q.isrc
+
+        q = self._find(t.getTrackStart(1), self._getEnd(t, 0), _Q_CATALOG)
+        if q:
+            t.catalog = q.catalog
+
+        # some drives fail to read the lead-in of discs without CD-Text
+        try:
+            data = self._drive.readCDText()
+        except IOError, e:
+            logger.debug('scan: cannot read CD-Text: %r', e)
+            data = ''
+        texts = parseCDText(data)
+        t.cdtext = texts.get(0, {})
+        for track in t.tracks:
+            track.cdtext = texts.get(track.number, {})
+
+        logger.debug('scan: %d reads', self.reads)
+        return t
+
+
+def getFastToc(device):
+    """
+    Read the table of contents of the disc in the given device,
+    with cdrdao if the drive cannot be asked directly.
+
+    @type  device: str
+
+    @rtype: L{table.Table}
+    """
+    try:
+        return readTOC(device)
+    except EnvironmentError, e:
+        logger.info('Cannot read the TOC of %s natively (%s), '
+            'using cdrdao', device, e)
+
+    return cdrdao.ReadTOCTask(device).table
+
+
+def readTable(device):
+    """
+    Read the table of contents of the disc in the given device, with the
+    pre-gaps, indexes, ISRCs, catalog number and CD-Text cdrdao read-toc
+    finds.
+
+    @type  device: str
+
+    @raises IOError: when the drive cannot be asked
+    @rtype: L{table.Table}
+    """
+    toc = readTOC(device)
+    drive = Drive(device)
+    try:
+        return Scanner(drive).scan(toc)
+    finally:
+        drive.close()
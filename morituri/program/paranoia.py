@@ -0,0 +1,415 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_program_paranoia -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read audio in-process with libcdio-paranoia, the library behind the
+cdparanoia program.
+
+Instead of parsing the progress cdparanoia prints, every callback event of
+the library is fed to a L{cdparanoia.ProgressParser}, and the audio of each
+sector goes straight to its destination.
+"""
+
+import array
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+import time
+import wave
+
+from morituri.common import common
+from morituri.extern.task import task
+from morituri.program import cdparanoia
+
+import logging
+logger = logging.getLogger(__name__)
+
+# paranoia_cb_mode_t, named like cdparanoia prints them
+CALLBACK_NAMES = {
+    0: 'read',
+    1: 'verify',
+    2: 'jitter',
+    3: 'correction',
+    4: 'scratch',
+    5: 'scratch repair',
+    6: 'skip',
+    7: 'drift',
+    8: 'backoff',
+    9: 'overlap',
+    10: 'dropped',
+    11: 'duped',
+    12: 'transport error',
+    13: 'cache error',
+}
+
+# the defaults of cdparanoia
+_MODE_FULL = 0xff
+_MODE_NEVERSKIP = 0x20
+_MODE_DISABLE = 0x00
+_MAX_RETRIES = 20
+
+_CDDA_MESSAGE_FORGETIT = 0
+_SEEK_SET = 0
+
+_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_long, ctypes.c_int)
+
+_libraries = None
+
+
+def _load():
+    """
+    Load the libcdio cdda and paranoia libraries, once.
+
+    @returns: the cdda and the paranoia library
+    @rtype:   tuple of L{ctypes.CDLL}
+    """
+    global _libraries
+    if _libraries:
+        return _libraries
+
+    libs = []
+    for name in ('cdio_cdda', 'cdio_paranoia'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            raise common.MissingDependencyException('libcdio-paranoia')
+        libs.append(ctypes.CDLL(path))
+    cdda, paranoia = libs
+
+    cdda.cdio_cddap_identify.restype = ctypes.c_void_p
+    cdda.cdio_cddap_identify.argtypes = [ctypes.c_char_p, ctypes.c_int,
+        ctypes.c_void_p]
+    cdda.cdio_cddap_find_a_cdrom.restype = ctypes.c_void_p
+    cdda.cdio_cddap_find_a_cdrom.argtypes = [ctypes.c_int, ctypes.c_void_p]
+    cdda.cdio_cddap_open.argtypes = [ctypes.c_void_p]
+    cdda.cdio_cddap_close.argtypes = [ctypes.c_void_p]
+    cdda.cdio_cddap_disc_lastsector.restype = ctypes.c_int32
+    cdda.cdio_cddap_disc_lastsector.argtypes = [ctypes.c_void_p]
+
+    paranoia.cdio_paranoia_init.restype = ctypes.c_void_p
+    paranoia.cdio_paranoia_init.argtypes = [ctypes.c_void_p]
+    paranoia.cdio_paranoia_free.argtypes = [ctypes.c_void_p]
+    paranoia.cdio_paranoia_modeset.argtypes = [ctypes.c_void_p,
+        ctypes.c_int]
+    paranoia.cdio_paranoia_seek.restype = ctypes.c_int32
+    paranoia.cdio_paranoia_seek.argtypes = [ctypes.c_void_p, ctypes.c_int32,
+        ctypes.c_int]
+    paranoia.cdio_paranoia_read_limited.restype = ctypes.c_void_p
+    paranoia.cdio_paranoia_read_limited.argtypes = [ctypes.c_void_p,
+        _CALLBACK, ctypes.c_int]
+
+    _libraries = (cdda, paranoia)
+    return _libraries
+
+
+def isAvailable():
+    """
+    @returns: whether libcdio-paranoia can be used
+    @rtype:   bool
+    """
+    try:
+        _load()
+    except common.MissingDependencyException:
+        return False
+    return True
+
+
+class Paranoia(object):
+    """
+    I read sectors from a drive through libcdio-paranoia.
+    """
+
+    def __init__(self, device=None, paranoia=True):
+        """
+        @param device:   the device to read from; the first drive found if
+                         None
+        @type  device:   str
+        @param paranoia: whether to verify and correct the reads; otherwise
+                         sectors are read in burst mode
+        @type  paranoia: bool
+        """
+        self._cdda, self._paranoia = _load()
+        self._drive = None
+        self._p = None
+
+        if device:
+            self._drive = self._cdda.cdio_cddap_identify(device,
+                _CDDA_MESSAGE_FORGETIT, None)
+        else:
+            self._drive = self._cdda.cdio_cddap_find_a_cdrom(
+                _CDDA_MESSAGE_FORGETIT, None)
+        if not self._drive:
+            raise IOError('Could not identify drive %r' % device)
+
+        if self._cdda.cdio_cddap_open(self._drive) != 0:
+            self.close()
+            raise IOError('Could not open drive %r' % device)
+
+        self._p = self._paranoia.cdio_paranoia_init(self._drive)
+        mode = _MODE_FULL ^ _MODE_NEVERSKIP
+        if not paranoia:
+            mode = _MODE_DISABLE
+        self._paranoia.cdio_paranoia_modeset(self._p, mode)
+
+    def getLastSector(self):
+        """
+        @returns: the last sector of the disc
+        @rtype:   int
+        """
+        return self._cdda.cdio_cddap_disc_lastsector(self._drive)
+
+    def seek(self, sector):
+        self._paranoia.cdio_paranoia_seek(self._p, sector, _SEEK_SET)
+
+    def read(self, callback):
+        """
+        Read the next sector.
+
+        @param callback: called with the position in words and the
+                         L{CALLBACK_NAMES} code of each event
+        @type  callback: L{_CALLBACK}
+
+        @returns: the audio of the sector, as little-endian 16-bit stereo
+                  samples
+        @rtype:   str
+        """
+        buf = self._paranoia.cdio_paranoia_read_limited(self._p, callback,
+            _MAX_RETRIES)
+        if not buf:
+            raise IOError('Could not read sector')
+
+        data = ctypes.string_at(buf, common.BYTES_PER_FRAME)
+        if sys.byteorder == 'big':
+            samples = array.array('h', data)
+            samples.byteswap()
+            data = samples.tostring()
+        return data
+
+    def close(self):
+        if self._p:
+            self._paranoia.cdio_paranoia_free(self._p)
+            self._p = None
+        if self._drive:
+            self._cdda.cdio_cddap_close(self._drive)
+            self._drive = None
+
+
+def getSectorRange(start, stop, offset):
+    """
+    Get the sectors to read to rip frames with a read offset.
+
+    @param start:  first frame to rip
+    @type  start:  int
+    @param stop:   last frame to rip (inclusive)
+    @type  stop:   int
+    @param offset: read offset, in samples
+    @type  offset: int
+
+    @returns: the first and last sector to read, and how many bytes of
+              the first sector to skip
+    @rtype:   tuple of (int, int, int)
+    """
+    first = start * common.SAMPLES_PER_FRAME + offset
+    last = (stop + 1) * common.SAMPLES_PER_FRAME + offset - 1
+    return (first // common.SAMPLES_PER_FRAME,
+        last // common.SAMPLES_PER_FRAME,
+        (first % common.SAMPLES_PER_FRAME) * 4)
+
+
+class ReadTrackTask(task.Task):
+    """
+    I am a task that reads a track using libcdio-paranoia, in a thread.
+
+    I have the same interface as L{cdparanoia.ReadTrackTask}; see there.
+    Sectors outside of the disc read as silence, unless told to overread.
+
+    @ivar readCounts: how many times each frame was read; set at end of
+                      reading
+    @type readCounts: L{array.array}
+    @ivar events:     how many times each callback event happened; set at
+                      end of reading
+    @type events:     dict of str -> int
+    """
+
+    description = "Reading track"
+    quality = None # set at end of reading
+    readCounts = None
+    events = None
+    speed = None
+    duration = None # in seconds
+
+    _MAXERROR = cdparanoia.ReadTrackTask._MAXERROR
+    _PROGRESS_FRAMES = common.FRAMES_PER_SECOND # between progress updates
+
+    def __init__(self, path, table, start, stop, overread, offset=0,
+        device=None, action="Reading", what="track", digests=None,
+        stdout=None, paranoia=True):
+        assert path is None or type(path) is unicode, \
+            "%r is not unicode" % path
+
+        self.path = path
+        self._digests = digests or []
+        self._stdout = stdout
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._paranoia = paranoia
+        self._parser = cdparanoia.ProgressParser(start, stop)
+        self._start_time = None
+        self._thread = None
+        self._error = None
+        self._bytes = 0
+        self.description = "%s %s" % (action, what)
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        logger.debug('Ripping from %d to %d (inclusive) with '
+            'libcdio-paranoia', self._start, self._stop)
+
+        try:
+            self._reader = Paranoia(self._device, self._paranoia)
+        except:
+            self._closeOutput()
+            raise
+
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run,
+            name='ParanoiaThread')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._read()
+        except Exception, e:
+            logger.debug('reading failed: %r', e)
+            self._error = e
+        finally:
+            self._reader.close()
+            self._closeOutput()
+            self.schedule(0, self._done)
+
+    def _read(self):
+        first, last, skip = getSectorRange(self._start, self._stop,
+            self._offset)
+        left = (self._stop - self._start + 1) * common.BYTES_PER_FRAME
+        lastSector = self._reader.getLastSector()
+
+        handle = None
+        if self.path is not None:
+            handle = self._openWave()
+
+        def callback(inpos, function):
+            self._parser.event(CALLBACK_NAMES.get(function, str(function)),
+                inpos)
+        # keep a reference for as long as the library may call it
+        callback = _CALLBACK(callback)
+
+        seeked = False
+        try:
+            for sector in xrange(first, last + 1):
+                if sector < 0 or (sector > lastSector and
+                        not self._overread):
+                    data = '\0' * common.BYTES_PER_FRAME
+                else:
+                    if not seeked:
+                        self._reader.seek(sector)
+                        seeked = True
+                    data = self._reader.read(callback)
+
+                if self._parser.events.get('transport error', 0) > \
+                        self._MAXERROR:
+                    raise IOError('%d read errors' %
+                        self._parser.events['transport error'])
+
+                data = data[skip:skip + left]
+                skip = 0
+                left -= len(data)
+                self._write(data, handle)
+
+                # like cdparanoia, report one word less than a frame
+                written = sector - first + 1
+                self._parser.event('wrote', (self._start + written) *
+                    common.WORDS_PER_FRAME - 1)
+                if written % self._PROGRESS_FRAMES == 0:
+                    self.schedule(0, self._progress)
+        finally:
+            if handle:
+                handle.close()
+
+    def _openWave(self):
+        handle = wave.open(self.path.encode('utf-8'), 'wb')
+        handle.setnchannels(2)
+        handle.setsampwidth(2)
+        handle.setframerate(44100)
+        return handle
+
+    def _write(self, data, handle):
+        self._bytes += len(data)
+        if handle:
+            handle.writeframesraw(data)
+        elif self._stdout is not None:
+            while data:
+                written = os.write(self._stdout, data)
+                data = data[written:]
+        else:
+            for d in self._digests:
+                d.update(data)
+
+    def _closeOutput(self):
+        if self._stdout is not None:
+            os.close(self._stdout)
+            self._stdout = None
+
+    def _progress(self):
+        if not self.running:
+            return
+
+        num = self._parser.wrote - self._start + 1
+        den = self._stop - self._start + 1
+        progress = float(num) / float(den)
+        if progress < 1.0:
+            self.setProgress(progress)
+
+    def _done(self):
+        self._thread.join()
+        end_time = time.time()
+        self.setProgress(1.0)
+
+        expected = (self._stop - self._start + 1) * common.BYTES_PER_FRAME
+        if self._error:
+            self.setException(self._error)
+        elif self._bytes != expected:
+            msg = "Read %d bytes instead of the expected %d" % (
+                self._bytes, expected)
+            logger.warning(msg)
+            self.setException(cdparanoia.FileSizeError(self.path, msg))
+
+        self.quality = self._parser.getTrackQuality()
+        self.readCounts = self._parser.getReadCounts()
+        self.events = dict(self._parser.events)
+        self.duration = end_time - self._start_time
+        self.speed = (self._stop - self._start + 1) / 75.0 / self.duration
+
+        self.stop()
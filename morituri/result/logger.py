@@ -6,6 +6,37 @@ import morituri
 from morituri.common import common
 from morituri.result import result
 
+# most frames are read twice when cdparanoia verifies them
+_READS = 2
+
+# number of places where frames had to be read again to log for a track
+_REREAD_PLACES = 5
+
+
+def getRereadPlaces(readCounts):
+    """
+    Find where frames of a track had to be read more than twice.
+
+    @param readCounts: run-length encoded read counts of the track, see
+                       L{result.TrackResult}
+    @type  readCounts: list of (int, int)
+
+    @returns: the first frame, the frame after the last one and the most
+              reads of each place, relative to the start of the track
+    @rtype:   list of (int, int, int)
+    """
+    places = []
+    frame = 0
+    for reads, frames in readCounts:
+        if reads > _READS:
+            if places and places[-1][1] == frame:
+                start, _, most = places[-1]
+                places[-1] = (start, frame + frames, max(most, reads))
+            else:
+                places.append((frame, frame + frames, reads))
+        frame += frames
+    return places
+
 
 class MorituriLogger(result.Logger):
 
@@ -45,6 +76,8 @@ class MorituriLogger(result.Logger):
         else:
             defeat = "No"
         lines.append("  Defeat audio cache: %s" % defeat)
+        if ripResult.reader == 'libcdio':
+            lines.append("  Reader: libcdio-paranoia (in-process)")
         lines.append("  Read offset correction: %+d" % ripResult.offset)
         # Currently unsupported by the official cdparanoia package
         over = "No"
@@ -52,6 +85,9 @@ class MorituriLogger(result.Logger):
         if ripResult.overread:
             over = "Yes"
         lines.append("  Overread into lead-out: %s" % over)
+        if ripResult.burst:
+            lines.append("  Read strategy: burst, paranoia for failing "
+                         "tracks")
         # Next one fully works only using the patched cdparanoia package
         # lines.append("Fill up missing offset samples with silence: Yes")
         lines.append("  Gap detection: cdrdao %s" % ripResult.cdrdaoVersion)
@@ -187,11 +223,21 @@ class MorituriLogger(result.Logger):
             lines.append("    Extraction speed: %.1f X" % (
                 trackResult.copyspeed))
 
+        # Read strategy, when ripping burst first
+        if trackResult.strategy:
+            lines.append("    Read strategy: %s" % trackResult.strategy)
+            lines.append("    Read time: burst %.1f s, paranoia %.1f s" % (
+                trackResult.burstduration, trackResult.paranoiaduration))
+
         # Extraction quality
         if trackResult.quality and trackResult.quality > 0.001:
             lines.append("    Extraction quality: %.2f %%" %
                          (trackResult.quality * 100.0, ))
 
+        # Places where frames had to be read again
+        if trackResult.readCounts:
+            lines.extend(self._rereadLog(trackResult.readCounts))
+
         # Ripper Test CRC
         if trackResult.testcrc is not None:
             lines.append("    Test CRC: %08X" % trackResult.testcrc)
@@ -200,6 +246,17 @@ class MorituriLogger(result.Logger):
         if trackResult.copycrc is not None:
             lines.append("    Copy CRC: %08X" % trackResult.copycrc)
 
+        # Segments read again because the CRCs differed
+        if trackResult.rereadSegments:
+            lines.append("    Re-read %d segments, CRC: %08X" % (
+                trackResult.rereadSegments, trackResult.rereadcrc))
+
+        # Read mode, when ripping in AccurateRip single read mode
+        if trackResult.singleRead:
+            lines.append("    Read mode: single read, matched AccurateRip")
+        elif trackResult.singleRead is not None:
+            lines.append("    Read mode: test and copy")
+
         # AccurateRip track status
         # Currently there's no support for AccurateRip V2
         if trackResult.accurip:
@@ -220,9 +277,30 @@ class MorituriLogger(result.Logger):
                          "AccurateRip database")
 
         # Check if Test & Copy CRCs are equal
-        if trackResult.testcrc == trackResult.copycrc:
+        if trackResult.singleRead:
+            lines.append("    Status: Copy OK")
+        elif trackResult.testcrc == trackResult.copycrc:
             lines.append("    Status: Copy OK")
+        elif trackResult.rereadSegments:
+            lines.append("    Status: Copy OK, after re-reading")
         else:
             self._errors = True
             lines.append("    Status: Error, CRC mismatch")
         return lines
+
+    def _rereadLog(self, readCounts):
+        """Returns lines on where frames were read more than twice"""
+
+        places = getRereadPlaces(readCounts)
+        if not places:
+            return []
+
+        frames = sum([end - start for start, end, _ in places])
+        lines = ["    Frames read more than twice: %d" % frames]
+        for start, end, most in places[:_REREAD_PLACES]:
+            lines.append("      %s - %s: up to %d reads" % (
+                common.framesToMSF(start), common.framesToMSF(end), most))
+        if len(places) > _REREAD_PLACES:
+            lines.append("      %d more places" % (
+                len(places) - _REREAD_PLACES))
+        return lines
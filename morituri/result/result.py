@@ -31,6 +31,34 @@ class TrackResult:
     @type testcrc:           int
     @ivar copycrc:           4-byte CRC for the copy read
     @type copycrc:           int
+    @ivar readCounts:        how many times each frame of the copy read was
+                             read, run-length encoded as a list of
+                             (reads, frames); see
+                             L{morituri.program.cdparanoia.encodeReadCounts}
+    @type readCounts:        list of (int, int)
+    @ivar rereadSegments:    how many segments were read again because the
+                             test and copy CRCs differed; 0 if they matched.
+    @type rereadSegments:    int
+    @ivar rereadcrc:         4-byte CRC of the track once the segments that
+                             differed were read again; None if none were.
+    @type rereadcrc:         int
+    @ivar singleRead:        whether the test read was skipped because the
+                             copy read matched AccurateRip; None if the track
+                             was not ripped in AccurateRip single read mode.
+    @type singleRead:        bool
+    @ivar strategy:          how the track was read: 'burst' or 'paranoia';
+                             None if it was not ripped burst first.
+    @type strategy:          str
+    @ivar burstduration:     the time spent reading the track in burst mode,
+                             including failed reads, in seconds.
+    @type burstduration:     float
+    @ivar paranoiaduration:  the time spent reading the track with paranoia
+                             when ripping burst first, including failed
+                             reads, in seconds.
+    @type paranoiaduration:  float
+    @ivar checkpoint:        how far the reads of the track got, while it is
+                             being ripped
+    @type checkpoint:        L{Checkpoint}
 
     @var  accurip:           whether this track's AR CRC was found in the
                              database, and thus whether the track is considered
@@ -42,6 +70,9 @@ class TrackResult:
     @var  ARCRC:             our calculated 4 byte AccurateRip CRC for this
                              track.
     @type ARCRC:             int
+    @var  ARCRCv2:           our calculated 4 byte AccurateRip v2 CRC for this
+                             track.
+    @type ARCRCv2:           int
 
     @var  ARDBCRC:           the 4-byte AccurateRip CRC this
                              track did or should have matched in the database.
@@ -60,14 +91,23 @@ class TrackResult:
 
     peak = 0.0
     quality = 0.0
+    readCounts = None
     testspeed = 0.0
     copyspeed = 0.0
     testduration = 0.0
     copyduration = 0.0
     testcrc = None
     copycrc = None
+    rereadSegments = 0
+    rereadcrc = None
+    singleRead = None
+    strategy = None
+    burstduration = 0.0
+    paranoiaduration = 0.0
+    checkpoint = None
     accurip = False # whether it's in the database
     ARCRC = None
+    ARCRCv2 = None
     ARDBCRC = None
     ARDBConfidence = None
     ARDBMaxConfidence = None
@@ -75,6 +115,30 @@ class TrackResult:
     classVersion = 3
 
 
+class Checkpoint:
+    """
+    I hold how far the reads of a track got, so that an interrupted rip
+    can resume them instead of reading the track again from the start.
+
+    The audio of each read is kept in a file; the frames counted are known
+    to be on disk, and cover the track from its first frame on.
+
+    @ivar testpath:   the file holding the audio of the test read
+    @type testpath:   unicode
+    @ivar testframes: how many frames of the test read are in testpath
+    @type testframes: int
+    @ivar copypath:   the file holding the audio of the copy read
+    @type copypath:   unicode
+    @ivar copyframes: how many frames of the copy read are in copypath
+    @type copyframes: int
+    """
+
+    testpath = None
+    testframes = 0
+    copypath = None
+    copyframes = 0
+
+
 class RipResult:
     """
     I hold information about the result for rips.
@@ -90,10 +154,19 @@ class RipResult:
 
     @ivar cdrdaoVersion:     version of cdrdao used for the rip
     @ivar cdparanoiaVersion: version of cdparanoia used for the rip
+
+    @ivar burst: whether tracks were read in burst mode first, and with
+                 paranoia only if that failed
+    @type burst: bool
+    @ivar reader: what read the disc: 'cdparanoia' for the program, or
+                  'libcdio' for libcdio-paranoia in-process
+    @type reader: str
     """
 
     offset = 0
     overread = None
+    burst = False
+    reader = 'cdparanoia'
     logger = None
     table = None
     artist = None
@@ -1,7 +1,13 @@
 # -*- Mode: Python; test-case-name: morituri.test.test_common_accurip -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import BaseHTTPServer
 import os
+import shutil
+import struct
+import tempfile
+import threading
+import urllib2
 
 from morituri.common import accurip
 
@@ -30,3 +36,227 @@ class AccurateRipResponseTestCase(tcommon.TestCase):
             self.assertEquals(response.confidences[i], 35)
         self.assertEquals(response.checksums[0], "beea32c8")
         self.assertEquals(response.checksums[10], "acee98ca")
+
+    def testMatchConfidence(self):
+        path = os.path.join(os.path.dirname(__file__),
+            'dBAR-011-0010e284-009228a3-9809ff0b.bin')
+        data = open(path, "rb").read()
+        responses = accurip.getAccurateRipResponses(data)
+
+        self.assertEquals(accurip.getMatchConfidence(responses, 1,
+            [0xbeea32c8, None]), 35)
+        # the v2 checksum can match another response
+        self.assertEquals(accurip.getMatchConfidence(responses, 2,
+            [0x12345678, 0x7ed3def9]), 2)
+        self.assertEquals(accurip.getMatchConfidence(responses, 2,
+            [0x12345678]), None)
+        self.assertEquals(accurip.getMatchConfidence(responses, 12,
+            [0xbeea32c8]), None)
+        self.assertEquals(accurip.getMatchConfidence(None, 1,
+            [0xbeea32c8]), None)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keeps connections open
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        path = os.path.join(os.path.dirname(__file__),
+            os.path.basename(self.path))
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+
+        data = open(path, 'rb').read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class AccuCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp(suffix='.morituri.test')
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.connections = 0
+        self.server.requests = []
+        self._thread = threading.Thread(target=self.server.serve_forever,
+            kwargs={'poll_interval': 0.05})
+        self._thread.start()
+
+        base = 'http://127.0.0.1:%d/accuraterip/' % self.server.server_port
+        self.url = base + '4/8/2/dBAR-011-0010e284-009228a3-9809ff0b.bin'
+        self.url2 = base + '4/1/e/dBAR-020-002e5023-029d8e49-040eaa14.bin'
+        self.missing = base + '0/0/0/dBAR-001-00000000-00000000-00000000.bin'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+        shutil.rmtree(self._path)
+
+    def testGetKey(self):
+        self.assertEquals(accurip.getKey(self.url),
+            ('0010e284', '009228a3', '9809ff0b'))
+
+    def testRetrieve(self):
+        c = accurip.AccuCache(self._path)
+        responses = c.retrieve(self.url)
+        self.assertEquals(len(responses), 3)
+        self.assertEquals(responses[0].checksums[0], "beea32c8")
+
+        # stored, also for another cache
+        c = accurip.AccuCache(self._path)
+        self.assertEquals(len(c.retrieve(self.url)), 3)
+        self.assertEquals(len(self.server.requests), 1)
+
+        c.retrieve(self.url, force=True)
+        self.assertEquals(len(self.server.requests), 2)
+
+    def testMissing(self):
+        c = accurip.AccuCache(self._path)
+        self.assertEquals(c.retrieve(self.missing), None)
+        self.assertEquals(c.retrieve(self.missing), None)
+        self.assertEquals(len(self.server.requests), 1)
+
+    def testOutdated(self):
+        c = accurip.AccuCache(self._path, ttl=0)
+        c.retrieve(self.url)
+        c.retrieve(self.url)
+        self.assertEquals(len(self.server.requests), 2)
+
+        # used when it cannot be fetched again
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEquals(len(c.retrieve(self.url)), 3)
+
+        self.assertRaises(urllib2.URLError, c.retrieve, self.url2)
+
+    def testPrefetch(self):
+        c = accurip.AccuCache(self._path)
+        c.retrieve(self.url)
+        self.assertEquals(c.prefetch([self.url, self.url2, self.missing]), 2)
+        # one connection for the retrieve, one for the prefetch
+        self.assertEquals(self.server.connections, 2)
+
+        c = accurip.AccuCache(self._path)
+        self.assertEquals(len(c.retrieve(self.url2)), 1)
+        self.assertEquals(c.retrieve(self.missing), None)
+        self.assertEquals(len(self.server.requests), 3)
+
+    def testPrefetchOutdated(self):
+        c = accurip.AccuCache(self._path, ttl=0)
+        c.retrieve(self.url)
+
+        # the stored responses are kept when they cannot be fetched again
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEquals(c.prefetch([self.url, self.url2]), 0)
+        self.assertEquals(len(c.retrieve(self.url)), 3)
+        self.assertRaises(urllib2.URLError, c.retrieve, self.url2)
+
+    def testStoredBeforeIndex(self):
+        path = os.path.join(self._path, 'accuraterip', '4', '8', '2')
+        os.makedirs(path)
+        shutil.copy(os.path.join(os.path.dirname(__file__),
+            'dBAR-011-0010e284-009228a3-9809ff0b.bin'), path)
+
+        c = accurip.AccuCache(self._path)
+        self.assertEquals(len(c.retrieve(self.url)), 3)
+        self.assertEquals(self.server.requests, [])
+
+
+class AccurateRipChecksumTestCase(tcommon.TestCase):
+
+    # 20 frames of samples, checksums verified with accuraterip-checksum
+    _data = struct.pack('<%dI' % (588 * 20),
+        *[(i * 2654435761) & 0xFFFFFFFF for i in range(588 * 20)])
+    _expected = {
+        (1, 3): (0x6d320c58, 0x6f209c86),
+        (2, 3): (0xe6e2e9b0, 0xe8f26e54),
+        (3, 3): (0xcb2c8d04, 0xcc555700),
+        (1, 1): (0x517bafac, 0x52838532),
+    }
+
+    def _checksum(self, trackNumber, trackCount, chunk):
+        checksum = accurip.AccurateRipChecksum(trackNumber, trackCount)
+        for i in range(0, len(self._data), chunk):
+            checksum.update(self._data[i:i + chunk])
+        return checksum.v1, checksum.v2
+
+    def testWhole(self):
+        for (number, count), expected in self._expected.items():
+            self.assertEquals(
+                self._checksum(number, count, len(self._data)), expected)
+
+    def testChunked(self):
+        # chunks that split samples and frames
+        for (number, count), expected in self._expected.items():
+            self.assertEquals(self._checksum(number, count, 1001), expected)
+        self.assertEquals(self._checksum(3, 3, 3), self._expected[(3, 3)])
+
+    def testPython(self):
+        numpy = accurip.numpy
+        accurip.numpy = None
+        try:
+            for (number, count), expected in self._expected.items():
+                self.assertEquals(
+                    self._checksum(number, count, 4096), expected)
+        finally:
+            accurip.numpy = numpy
+
+    def testShortLastTrack(self):
+        checksum = accurip.AccurateRipChecksum(2, 2)
+        checksum.update(self._data[:4 * 588 * 5])
+        self.assertEquals((checksum.v1, checksum.v2), (0, 0))
+        self.assertEquals(checksum.samples, 588 * 5)
+
+
+class OffsetChecksumsTestCase(tcommon.TestCase):
+
+    # 2 frames of margin on each side of a 12 frame track
+    _margin = 588 * 2
+    _length = 588 * 12
+    _data = struct.pack('<%dI' % (_length + 2 * _margin),
+        *[(i * 2654435761) & 0xFFFFFFFF
+          for i in range(_length + 2 * _margin)])
+    _offsets = [-_margin, -667, -1, 0, 6, 48, 667, _margin - 1]
+
+    def _checksum(self, offset, trackNumber, trackCount):
+        start = (self._margin + offset) * 4
+        checksum = accurip.AccurateRipChecksum(trackNumber, trackCount)
+        checksum.update(self._data[start:start + self._length * 4])
+        return checksum.v1
+
+    def _testOffsets(self):
+        for number, count in [(1, 3), (2, 3), (3, 3), (1, 1)]:
+            checksums = accurip.getOffsetChecksums(self._data, self._margin,
+                self._length, number, count, self._offsets)
+            for offset in self._offsets:
+                self.assertEquals(checksums[offset],
+                    self._checksum(offset, number, count))
+
+    def testOffsets(self):
+        self._testOffsets()
+
+    def testPython(self):
+        numpy = accurip.numpy
+        accurip.numpy = None
+        try:
+            self._testOffsets()
+        finally:
+            accurip.numpy = numpy
+
+    def testOutOfRange(self):
+        self.assertRaises(ValueError, accurip.getOffsetChecksums, self._data,
+            self._margin, self._length, 2, 3, [self._margin + 1])
@@ -2,6 +2,8 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import os
+import shutil
+import tempfile
 
 from morituri.common import cache
 
@@ -21,3 +23,86 @@ class ResultCacheTestCase(tcommon.TestCase):
     def testGetIds(self):
         ids = self.cache.getIds()
         self.assertEquals(ids, ['fe105a11'])
+
+
+class MusicBrainzCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp(suffix='.morituri.test')
+        self.lookups = []
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def _lookup(self, result):
+        def lookup():
+            self.lookups.append(result)
+            return result
+        return lookup
+
+    def _waitForRevalidation(self, c):
+        for thread in c._revalidating.values():
+            thread.join()
+
+    def testFresh(self):
+        c = cache.MusicBrainzCache(self._path)
+        self.assertEquals(c.get('discid.a', self._lookup(1)), 1)
+        self.assertEquals(c.get('discid.a', self._lookup(2)), 1)
+        self.assertEquals(self.lookups, [1])
+
+        # a new cache finds it on disk
+        c = cache.MusicBrainzCache(self._path)
+        self.assertEquals(c.get('discid.a', self._lookup(2)), 1)
+        self.assertEquals(self.lookups, [1])
+
+    def testRefresh(self):
+        c = cache.MusicBrainzCache(self._path)
+        c.get('discid.a', self._lookup(1))
+        self.assertEquals(c.get('discid.a', self._lookup(2), refresh=True), 2)
+        self.assertEquals(c.get('discid.a', self._lookup(3)), 2)
+        self._waitForRevalidation(c)
+
+    def testStale(self):
+        c = cache.MusicBrainzCache(self._path, ttl=0)
+        c.get('discid.a', self._lookup(1))
+
+        # served while looked up again
+        self.assertEquals(c.get('discid.a', self._lookup(2)), 1)
+        self._waitForRevalidation(c)
+        self.assertEquals(self.lookups, [1, 2])
+        self.assertEquals(c.get('discid.a', self._lookup(3)), 2)
+        self._waitForRevalidation(c)
+
+    def testStaleFailing(self):
+        c = cache.MusicBrainzCache(self._path, ttl=0)
+        c.get('discid.a', self._lookup(1))
+
+        def fail():
+            raise IOError('offline')
+
+        self.assertEquals(c.get('discid.a', fail), 1)
+        self._waitForRevalidation(c)
+        self.assertEquals(c.get('discid.a', self._lookup(2)), 1)
+        self._waitForRevalidation(c)
+
+    def testExpired(self):
+        c = cache.MusicBrainzCache(self._path, ttl=0, stale=0)
+        c.get('discid.a', self._lookup(1))
+        self.assertEquals(c.get('discid.a', self._lookup(2)), 2)
+        self.assertEquals(self.lookups, [1, 2])
+
+    def testEvict(self):
+        c = cache.MusicBrainzCache(self._path)
+        for i in range(5):
+            c.get('release.%d' % i, self._lookup('x' * 1000))
+            # distinct times of use
+            os.utime(os.path.join(self._path, 'release.%d.pickle' % i),
+                (i, i))
+
+        c = cache.MusicBrainzCache(self._path, size=3000)
+        # using it keeps it
+        c.get('release.0', self._lookup(None))
+
+        c.get('release.5', self._lookup('x' * 1000))
+        names = sorted(os.listdir(self._path))
+        self.assertEquals(names, ['release.0.pickle', 'release.5.pickle'])
@@ -0,0 +1,104 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_digest -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import struct
+import zlib
+
+from morituri.common import digest
+
+from morituri.test import common as tcommon
+
+
+class CRC32DigestTestCase(tcommon.TestCase):
+
+    def testChunked(self):
+        data = struct.pack('<1000h', *range(-500, 500))
+        d = digest.CRC32Digest()
+        for i in range(0, len(data), 333):
+            d.update(data[i:i + 333])
+        self.assertEquals(d.checksum, zlib.crc32(data) % 2 ** 32)
+
+
+class SegmentDigestTestCase(tcommon.TestCase):
+
+    def testSegments(self):
+        d = digest.SegmentDigest(4)
+        d.update('abcdef')
+        d.update('ghij')
+        self.assertEquals(d.checksums, [zlib.crc32(s) % 2 ** 32
+            for s in ['abcd', 'efgh', 'ij']])
+
+        d.update('kl')
+        self.assertEquals(len(d.checksums), 3)
+        self.assertEquals(d.checksums[-1], zlib.crc32('ijkl') % 2 ** 32)
+
+    def testEmpty(self):
+        self.assertEquals(digest.SegmentDigest(4).checksums, [])
+
+
+class PeakDigestTestCase(tcommon.TestCase):
+
+    def testEmpty(self):
+        self.assertEquals(digest.PeakDigest().peak, 0.0)
+
+    def testPeak(self):
+        d = digest.PeakDigest()
+        d.update(struct.pack('<4h', 0, 100, -16384, 200))
+        self.assertEquals(d.peak, 0.5)
+
+    def testNegativeFullScale(self):
+        d = digest.PeakDigest()
+        d.update(struct.pack('<2h', 32767, -32768))
+        self.assertEquals(d.peak, 1.0)
+
+    def testSplitSample(self):
+        # -16384 split over two updates
+        data = struct.pack('<2h', 1, -16384)
+        d = digest.PeakDigest()
+        d.update(data[:3])
+        d.update(data[3:])
+        self.assertEquals(d.peak, 0.5)
+
+
+class _Recorder:
+
+    def __init__(self):
+        self.data = ''
+        self.closed = False
+
+    def update(self, data):
+        assert not self.closed
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+
+class SplitDigestTestCase(tcommon.TestCase):
+
+    def testSplit(self):
+        parts = [_Recorder(), _Recorder(), _Recorder()]
+        crc = digest.CRC32Digest()
+        d = digest.SplitDigest([3, 5, 2],
+            [[parts[0], crc], [parts[1]], [parts[2]]])
+
+        d.update('abcd')
+        self.failUnless(parts[0].closed)
+        self.failIf(parts[1].closed)
+        d.update('efghij')
+        self.failUnless(parts[2].closed)
+        # ignored
+        d.update('kl')
+
+        self.assertEquals([p.data for p in parts], ['abc', 'defgh', 'ij'])
+        self.assertEquals(crc.checksum, zlib.crc32('abc') % 2 ** 32)
+
+    def testClose(self):
+        parts = [_Recorder(), _Recorder()]
+        d = digest.SplitDigest([3, 5], [[parts[0]], [parts[1]]])
+
+        d.update('ab')
+        d.close()
+        self.failUnless(parts[0].closed)
+        self.failUnless(parts[1].closed)
+        self.assertEquals(parts[1].data, '')
@@ -1,6 +1,7 @@
 # -*- Mode: Python; test-case-name: morituri.test.test_common_mbngs -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import copy
 import os
 import json
 
@@ -116,3 +117,53 @@ class MetadataTestCase(unittest.TestCase):
         )
 
 
+class LookupTestCase(unittest.TestCase):
+
+    discid = "wbjbST2jUHRZaB1inCyxxsL7Eqc-"
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__),
+            'morituri.release.3451f29c-9bb8-4cc5-bfcc-bd50104b94f8.json')
+        handle = open(path, "rb")
+        self.release = json.loads(handle.read())['release']
+        handle.close()
+
+        import musicbrainzngs
+        self._musicbrainzngs = musicbrainzngs
+        self._saved = (musicbrainzngs.get_releases_by_discid,
+            musicbrainzngs.get_release_by_id)
+        self.requests = []
+        musicbrainzngs.get_releases_by_discid = self._getReleasesByDiscid
+        musicbrainzngs.get_release_by_id = self._getReleaseById
+
+    def tearDown(self):
+        (self._musicbrainzngs.get_releases_by_discid,
+            self._musicbrainzngs.get_release_by_id) = self._saved
+
+    def _getReleasesByDiscid(self, discid, includes=[]):
+        self.requests.append(discid)
+        return {'disc': {'release-list': [self.short]}}
+
+    def _getReleaseById(self, id, includes=[]):
+        self.requests.append(id)
+        return {'release': self.release}
+
+    def testComplete(self):
+        self.short = self.release
+        metadatas = mbngs.musicbrainz(self.discid)
+        self.assertEquals(self.requests, [self.discid])
+        self.assertEquals(metadatas[0].mbid, self.release['id'])
+        self.assertEquals(len(metadatas[0].tracks), 5)
+
+    def testIncomplete(self):
+        # without the artist credits of the recordings
+        self.short = copy.deepcopy(self.release)
+        for medium in self.short['medium-list']:
+            for t in medium['track-list']:
+                del t['recording']['artist-credit']
+
+        metadatas = mbngs.musicbrainz(self.discid)
+        self.assertEquals(self.requests, [self.discid, self.release['id']])
+        self.assertEquals(metadatas[0].tracks[0].artist,
+            self.release['medium-list'][0]['track-list'][0]['recording'][
+                'artist-credit-phrase'])
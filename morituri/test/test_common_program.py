@@ -2,6 +2,7 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 
+import StringIO
 import os
 import pickle
 
@@ -116,3 +117,64 @@ class PathTestCase(unittest.TestCase):
         path = prog.getPath(u'/tmp', u'%A/%d', 'mbdiscid', 0)
         self.assertEquals(path,
             u'/tmp/Jeff Buckley/Grace')
+
+
+class _TOC:
+
+    def getCDDBValues(self):
+        return [0x0f0c1e10, 16, 150, 3600]
+
+    def getAccurateRipURL(self):
+        return 'http://www.accuraterip.com/accuraterip/0/1/0/dBAR.bin'
+
+
+class _PrefetchProgram(program.Program):
+
+    def __init__(self, *args, **kwargs):
+        program.Program.__init__(self, *args, **kwargs)
+        self.calls = []
+
+    def _queryMusicBrainz(self, mbdiscid, country):
+        self.calls.append('musicbrainz')
+        return None, None, []
+
+    def _queryCDDB(self, cddbdiscid):
+        self.calls.append('cddb')
+        raise IOError('socket error', 'unreachable')
+
+    def _retrieveAccurateRip(self, url):
+        self.calls.append(url)
+        return ['response']
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = StringIO.StringIO()
+        self.prog = _PrefetchProgram(config.Config(), stdout=self.stdout)
+        self.toc = _TOC()
+
+    def testPrefetched(self):
+        self.prog.prefetch(self.toc, 'mbdiscid')
+        url = self.toc.getAccurateRipURL()
+
+        self.assertEquals(self.prog.getAccurateRipResponses(url),
+            ['response'])
+
+        # errors of the lookup are raised when getting its result
+        self.assertEquals(self.prog.getCDDB(self.toc.getCDDBValues()), None)
+        self.failUnless(self.stdout.getvalue().startswith(
+            'Warning: network error'))
+        self.assertEquals(self.prog.calls.count('cddb'), 1)
+        self.assertEquals(self.prog.calls.count(url), 1)
+
+        # a prefetched result is used once
+        self.prog.getAccurateRipResponses(url)
+        self.assertEquals(self.prog.calls[-1], url)
+        self.assertEquals(self.prog.calls.count(url), 2)
+
+    def testOtherArguments(self):
+        self.prog.prefetch(self.toc, 'mbdiscid')
+        self.prog.getAccurateRipResponses('http://example.com/dBAR.bin')
+        self.assertEquals(self.prog.calls.count(
+            'http://example.com/dBAR.bin'), 1)
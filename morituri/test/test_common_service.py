@@ -0,0 +1,182 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_service -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import gobject
+
+from morituri.common import service
+from morituri.extern.task import task
+
+from morituri.test import common as tcommon
+
+
+class _ReadTask(task.Task):
+    description = 'Reading'
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.setProgress(0.5)
+        self.setDescription('Reading track 1')
+        self.schedule(0, self.stop)
+
+
+def _run(argv):
+    # stands in for a whipper command in the process of a job
+    if argv[-1] == 'fail':
+        raise KeyError('fail')
+    if argv[-1] == 'wait':
+        time.sleep(10)
+    # only what tasks tell is progress, not what looks like it
+    sys.stdout.write('Looking like progress 42 %\r')
+    task.SyncRunner().run(_ReadTask())
+    sys.stdout.write('started %s\n' % ' '.join(argv))
+    sys.stdout.write('x' * 5000 + '\n')
+    return 0, {'argv': argv}
+
+
+class JobTestCase(tcommon.TestCase):
+
+    def testRip(self):
+        job = service.Job(1, 'rip', '/dev/sr0', ['--offset', '6'])
+        self.assertEquals(job.argv,
+            ['cd', '-d', '/dev/sr0', 'rip', '--offset', '6'])
+        self.assertEquals(job.resources, ['drive:/dev/sr0'])
+        self.assertEquals(job.state, service.QUEUED)
+
+    def testRipLink(self):
+        path = os.path.realpath(tempfile.mkdtemp(suffix='.morituri.test'))
+        try:
+            device = os.path.join(path, 'sr0')
+            open(device, 'w').close()
+            link = os.path.join(path, 'cdrom')
+            os.symlink(device, link)
+
+            job = service.Job(1, 'rip', link, [])
+            self.assertEquals(job.argv, ['cd', '-d', device, 'rip'])
+            self.assertEquals(job.resources, ['drive:%s' % device])
+        finally:
+            shutil.rmtree(path)
+
+    def testRipWithoutDevice(self):
+        self.assertRaises(ValueError, service.Job, 1, 'rip', None, [])
+
+    def testUnknownKind(self):
+        self.assertRaises(ValueError, service.Job, 1, 'burn', None, [])
+
+    def testStatus(self):
+        job = service.Job(1, 'verify', None, ['a.cue'])
+        job.setStatus('Reading track 1 of 2', 0.42)
+        self.assertEquals(job.description, 'Reading track 1 of 2')
+        self.assertEquals(job.progress, 0.42)
+
+
+class ServiceTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix='.morituri.test')
+        self.path = os.path.join(self._dir, 'serve.sock')
+        self.service = service.ServiceTask(self.path, cpus=1, run=_run)
+        self.client = service.ServiceClient(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _serve(self, talk):
+        """
+        Serve while talk talks to the service from a thread.
+        """
+        def t():
+            try:
+                # wait for the service to listen
+                while not os.path.exists(self.path):
+                    time.sleep(0.01)
+                talk()
+            except Exception, e:
+                self._failure = e
+            gobject.timeout_add(0, self.service.stop)
+
+        self._failure = None
+        thread = threading.Thread(target=t)
+        thread.start()
+        task.SyncRunner(verbose=False).run(self.service)
+        thread.join()
+        if self._failure:
+            raise self._failure
+
+    def _waitForJob(self, id):
+        while True:
+            job = self.client.getJob(id)
+            if job['state'] in (service.DONE, service.FAILED,
+                    service.CANCELLED):
+                return job
+            time.sleep(0.01)
+
+    def testJobs(self):
+        jobs = []
+
+        def talk():
+            jobs.append(self.client.submit('verify', ['a.cue']))
+            jobs.append(self.client.submit('retag', ['fail']))
+            jobs.append(self._waitForJob(1))
+            jobs.append(self._waitForJob(2))
+            jobs.append(self.client.getJobs())
+
+        self._serve(talk)
+
+        self.assertEquals(jobs[0]['id'], 1)
+        self.assertEquals(jobs[0]['state'], service.QUEUED)
+
+        done = jobs[2]
+        self.assertEquals(done['state'], service.DONE)
+        self.assertEquals(done['returncode'], 0)
+        self.assertEquals(done['description'], 'Reading track 1')
+        self.assertEquals(done['progress'], 1.0)
+        self.assertEquals(done['output'],
+            ['started image verify a.cue', 'x' * 5000])
+        self.assertEquals(done['result'],
+            {'argv': ['image', 'verify', 'a.cue']})
+
+        failed = jobs[3]
+        self.assertEquals(failed['state'], service.FAILED)
+        self.assertEquals(failed['returncode'], 1)
+        self.failUnless(failed['output'][-1].startswith('KeyError'))
+
+        self.assertEquals([j['state'] for j in jobs[4]],
+            [service.DONE, service.FAILED])
+
+    def testResources(self):
+        jobs = []
+
+        def talk():
+            self.client.submit('rip', ['wait'], '/dev/sr0')
+            self.client.submit('rip', [], '/dev/sr0')
+            self.client.submit('rip', [], '/dev/sr1')
+            # the second rip waits for its drive, the third one does not
+            jobs.append(self._waitForJob(3))
+            jobs.append(self.client.getJobs())
+            self.client.cancel(1)
+            jobs.append(self._waitForJob(1))
+            jobs.append(self._waitForJob(2))
+
+        self._serve(talk)
+
+        self.assertEquals(jobs[0]['state'], service.DONE)
+        self.assertEquals([j['state'] for j in jobs[1]],
+            [service.RUNNING, service.QUEUED, service.DONE])
+        self.assertEquals(jobs[2]['state'], service.CANCELLED)
+        self.assertEquals(jobs[3]['state'], service.DONE)
+
+    def testErrors(self):
+        def talk():
+            self.assertRaises(service.ServiceError,
+                self.client.submit, 'burn')
+            self.assertRaises(service.ServiceError,
+                self.client.getJob, 1)
+
+        self._serve(talk)
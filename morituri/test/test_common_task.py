@@ -0,0 +1,153 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_task -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+from morituri.common import task
+from morituri.extern.task import task as etask
+
+from morituri.test import common as tcommon
+
+
+class LineBufferTestCase(tcommon.TestCase):
+
+    def testFeed(self):
+        b = task.LineBuffer()
+        self.assertEquals(b.feed('Ripping from sector'), [])
+        self.assertEquals(b.feed(' 0\nto sector 10\n\nDone'),
+            ['Ripping from sector 0', 'to sector 10', ''])
+        self.assertEquals(b.feed('.\n'), ['Done.'])
+        self.assertEquals(b.feed(''), [])
+
+
+class _CountingTask(etask.Task):
+    """
+    I stop a moment after starting, counting how many of my kind run at
+    once.
+    """
+
+    running = 0
+    most = 0
+
+    def __init__(self, fail=False):
+        self._fail = fail
+
+    def start(self, runner):
+        etask.Task.start(self, runner)
+        _CountingTask.running += 1
+        _CountingTask.most = max(_CountingTask.most, _CountingTask.running)
+        self.schedule(0.01, self._done)
+
+    def _done(self):
+        _CountingTask.running -= 1
+        if self._fail:
+            self.setException(ValueError('failed'))
+        self.stop()
+
+
+class _RaisingTask(etask.Task):
+    """
+    I raise from a scheduled call a moment after starting.
+    """
+
+    def start(self, runner):
+        etask.Task.start(self, runner)
+        self.schedule(0.01, self._raise)
+
+    def _raise(self):
+        raise ValueError('raised')
+
+
+class _Listener(etask.ITaskListener):
+
+    def __init__(self):
+        self.done = []
+
+    def progressed(self, task, value):
+        pass
+
+    def described(self, task, description):
+        pass
+
+    def stopped(self, task):
+        self.done.append(task)
+
+
+class WorkerPoolTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        _CountingTask.running = 0
+        _CountingTask.most = 0
+
+    def testLimit(self):
+        pool = task.WorkerPool(2)
+        tasks = [pool.wrap(_CountingTask()) for _ in range(5)]
+        t = task.MultiParallelTask()
+        for pooled in tasks:
+            t.addTask(pooled)
+        task.SyncRunner(verbose=False).run(t)
+
+        self.assertEquals(_CountingTask.most, 2)
+        self.failIf([p for p in tasks if p.task.running])
+
+    def testException(self):
+        pool = task.WorkerPool(1)
+        t = task.MultiParallelTask()
+        failing = pool.wrap(_CountingTask(fail=True))
+        t.addTask(failing)
+        t.addTask(pool.wrap(_CountingTask()))
+        self.assertRaises(etask.TaskException,
+            task.SyncRunner(verbose=False).run, t)
+
+        self.failUnless(isinstance(failing.exception, ValueError))
+        self.assertEquals(_CountingTask.most, 1)
+
+
+class BackgroundRunnerTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        _CountingTask.running = 0
+        _CountingTask.most = 0
+
+    def testRunsWithOtherRunner(self):
+        background = task.BackgroundRunner()
+        t = _CountingTask()
+        background.run(t)
+        self.assertEquals(background.running, 1)
+
+        # the background task runs while another runner runs
+        task.SyncRunner(verbose=False).run(_CountingTask())
+        background.wait()
+
+        self.assertEquals(background.running, 0)
+        self.failIf(t.running)
+        self.assertEquals(_CountingTask.most, 2)
+
+    def testWaitFailing(self):
+        background = task.BackgroundRunner()
+        t = _CountingTask(fail=True)
+        background.run(t)
+        background.wait()
+
+        self.failUnless(isinstance(t.exception, ValueError))
+        background.wait()
+
+    def testWaitRaisingSubtask(self):
+        background = task.BackgroundRunner()
+        t = task.MultiParallelTask()
+        t.addTask(_RaisingTask())
+        t.addTask(_CountingTask())
+        background.run(t)
+        background.wait()
+
+        self.assertEquals(background.running, 0)
+        self.failIf(t.running)
+        self.failUnless(isinstance(t.exception, ValueError))
+
+    def testListeners(self):
+        listener = _Listener()
+        background = task.BackgroundRunner()
+        background.listeners = [listener]
+        t = _CountingTask()
+        background.run(t)
+        background.wait()
+
+        self.assertEquals(listener.done, [t])
@@ -87,3 +87,28 @@ FILE "track02.wav" WAVE
     INDEX 01 00:00:00
 """ % morituri.__version__, it.cue())
         os.unlink(path)
+
+
+class MessagesTestCase(unittest.TestCase):
+
+    def testMessages(self):
+        fd, path = tempfile.mkstemp(suffix=u'.morituri.test.cue')
+        os.write(fd, """REM GENRE Rock
+  TRACK 01 AUDIO
+FILE "track01.wav" WAVE
+  TRACK 01 AUDIO
+REM DATE 2009
+    INDEX 01 00:00:00
+""")
+        os.close(fd)
+
+        c = cue.CueFile(path)
+        c.parse()
+        os.unlink(path)
+
+        self.assertEquals(c._rems, {'GENRE': 'Rock'})
+        self.assertEquals(c._messages, [
+            (2, 'TRACK without preceding FILE'),
+            (5, 'REM DATE outside of header'),
+        ])
+        self.assertEquals(len(c.table.tracks), 1)
@@ -1,6 +1,11 @@
 # -*- Mode: Python; test-case-name: morituri.test.test_image_table -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import copy
+import os
+import pickle
+
+from morituri.common import cache
 from morituri.image import table
 
 from morituri.test import common as tcommon
@@ -19,6 +24,22 @@ class TrackTestCase(tcommon.TestCase):
         track.index(1, 100)
         self.failUnless(repr(track.indexes[1]).startswith('<Index 01 '))
 
+    def testSlots(self):
+        track = table.Track(1)
+        self.assertRaises(AttributeError, setattr, track, 'title', 'Intro')
+        self.assertEquals(track.session, None)
+
+    def testPickle(self):
+        track = table.Track(1, session=2)
+        track.index(1, absolute=100, path=u'track.wav', counter=1)
+        for protocol in range(3):
+            t = pickle.loads(pickle.dumps(track, protocol))
+            self.assertEquals(t.session, 2)
+            self.assertEquals(t.getIndex(1).path, u'track.wav')
+
+        t = copy.deepcopy(track)
+        self.assertEquals(t.getIndex(1).absolute, 100)
+
 
 class LadyhawkeTestCase(tcommon.TestCase):
     # Ladyhawke - Ladyhawke - 0602517818866
@@ -115,3 +136,51 @@ class PregapTestCase(tcommon.TestCase):
     def testPreGap(self):
         self.assertEquals(self.table.tracks[0].getPregap(), 0)
         self.assertEquals(self.table.tracks[1].getPregap(), 200)
+
+
+class CacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self.table = table.Table()
+        for i, offset in enumerate([0, 1000, 2000]):
+            self.table.tracks.append(table.Track(i + 1))
+            self.table.tracks[i].index(1, absolute=offset)
+        self.table.leadout = 3000
+
+    def testUnpickleResult(self):
+        # the results of earlier versions have old-style tracks and indexes
+        result = cache.ResultCache(
+            os.path.join(os.path.dirname(__file__), 'cache', 'result')
+            ).getRipResult('fe105a11')
+        t = result.object.table
+        self.assertEquals(t.getCDDBDiscId(), 'fe105a11')
+        self.assertEquals(t.getTrackEnd(1), 9434)
+        self.assertEquals(t.tracks[0].session, None)
+        self.assertEquals(t.tracks[0].getIndex(1).counter, 1)
+
+    def testPickle(self):
+        self.assertEquals(self.table.getTrackEnd(1), 999)
+        t = pickle.loads(pickle.dumps(self.table, 2))
+        self.failIf('_cache' in t.__dict__)
+
+    def testAddTrack(self):
+        self.assertEquals(self.table.getTrackEnd(3), 2999)
+        self.table.tracks.append(table.Track(4))
+        self.table.tracks[3].index(1, absolute=2500)
+        self.assertEquals(self.table.getTrackEnd(3), 2499)
+
+    def testMerge(self):
+        cddb = self.table.getCDDBDiscId()
+        other = table.Table([table.Track(1)])
+        other.tracks[0].index(1, absolute=0)
+        other.leadout = 3000
+        self.table.merge(other)
+        self.assertNotEquals(self.table.getCDDBDiscId(), cddb)
+        self.assertEquals(self.table.getTrackStart(4), 3000 + 11400)
+        self.assertEquals(self.table.getTrackEnd(4), 6000 + 11400 - 1)
+
+    def testSetFile(self):
+        self.assertEquals(self.table.getTrackStart(2), 1000)
+        self.table.tracks[1].indexes[1].absolute = 1500
+        self.table.setFile(1, 1, u'data.wav', 3000)
+        self.assertEquals(self.table.getTrackStart(2), 1500)
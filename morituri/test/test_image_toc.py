@@ -11,6 +11,34 @@ from morituri.image import toc
 from morituri.test import common
 
 
+class SourcesTestCase(common.TestCase):
+
+    def setUp(self):
+        self.sources = toc.Sources()
+        self.sources.append(0, 0, None)
+        self.sources.append(1, 32, 'a.wav')
+        self.sources.append(1, 100, 'a.wav')
+        self.sources.append(2, 200, 'b.wav')
+
+    def testGet(self):
+        self.assertEquals(self.sources.get(0), (0, 0, None))
+        self.assertEquals(self.sources.get(31), (0, 0, None))
+        self.assertEquals(self.sources.get(32), (1, 32, 'a.wav'))
+        self.assertEquals(self.sources.get(150), (1, 100, 'a.wav'))
+        self.assertEquals(self.sources.get(10000), (2, 200, 'b.wav'))
+
+    def testGetUnsorted(self):
+        self.sources.append(3, 150, 'c.wav')
+        self.assertEquals(self.sources.get(120), (1, 100, 'a.wav'))
+        self.assertEquals(self.sources.get(10000), (3, 150, 'c.wav'))
+
+    def testGetCounterStart(self):
+        self.assertEquals(self.sources.getCounterStart(1), 32)
+        self.assertEquals(self.sources.getCounterStart(2), 200)
+        # unknown counters start at the last source
+        self.assertEquals(self.sources.getCounterStart(5), 200)
+
+
 class CureTestCase(common.TestCase):
 
     def setUp(self):
@@ -2,10 +2,14 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import os
+import tempfile
+import zlib
 
 from morituri.extern.task import task
 
+from morituri.common import common as mcommon
 from morituri.program import cdparanoia
+from morituri.result import result
 
 from morituri.test import common
 
@@ -27,6 +31,39 @@ class ParseTestCase(common.TestCase):
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEquals(q, '99.6 %')
 
+    def testReadCounts(self):
+        for line in self._handle.readlines():
+            self._parser.parse(line)
+
+        self.assertEquals(self._parser.getReadHistogram(),
+            {1: 14, 2: 1702, 3: 1, 4: 13})
+        self.assertEquals(cdparanoia.encodeReadCounts(
+            self._parser.getReadCounts())[:5],
+            [(1, 14), (2, 1171), (3, 1), (4, 13), (2, 531)])
+
+        # the frames read more than twice are all before the end
+        self.assertEquals(self._parser.getReadHistogram(47200, 47719),
+            {2: 520})
+        self.assertEquals(self._parser.getTrackQuality(47200, 47719), 1.0)
+
+    def testEvents(self):
+        for line in self._handle.readlines():
+            self._parser.parse(line)
+
+        self.assertEquals(self._parser.events,
+            {'read': 180, 'verify': 8, 'wrote': 1730, 'finished': 1})
+
+        # events passed directly count the same as parsed ones
+        parser = cdparanoia.ProgressParser(start=45990, stop=47719)
+        self._handle.seek(0)
+        for line in self._handle.readlines():
+            m = cdparanoia._PROGRESS_RE.search(line)
+            if m:
+                parser.event(m.group('function'), int(m.group('offset')))
+        self.assertEquals(parser.events, self._parser.events)
+        self.assertEquals(parser.getReadCounts(),
+            self._parser.getReadCounts())
+
 class Parse1FrameTestCase(common.TestCase):
 
     def setUp(self):
@@ -58,8 +95,11 @@ class ErrorTestCase(common.TestCase):
         for line in self._handle.readlines():
             self._parser.parse(line)
 
+        # the rip got stuck around frame 1197, so most frames were never
+        # read
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
-        self.assertEquals(q, '79.6 %')
+        self.assertEquals(q, '1.0 %')
+        self.assertEquals(self._parser.getReadHistogram()[0], 9604)
 
 
 class VersionTestCase(common.TestCase):
@@ -92,3 +132,107 @@ class CacheTestCase(common.TestCase):
         self.runner.run(t)
         self.failUnless(t.defeatsCache)
 
+
+
+class SplitThreadTestCase(common.TestCase):
+
+    def testSplit(self):
+        readfd, writefd = os.pipe()
+        pipes = [os.pipe(), os.pipe()]
+        splitter = cdparanoia.digest.SplitDigest([3, 5],
+            [[cdparanoia._PipeWriter(w)] for r, w in pipes])
+        thread = cdparanoia._SplitThread(readfd, splitter)
+        thread.start()
+
+        os.write(writefd, 'abcdefghij')
+        os.close(writefd)
+        thread.join()
+
+        # each pipe is closed at the end of its part
+        self.assertEquals([os.read(r, 100) for r, w in pipes],
+            ['abc', 'defgh'])
+        self.assertEquals([os.read(r, 100) for r, w in pipes], ['', ''])
+        for r, w in pipes:
+            os.close(r)
+
+    def testClosedReader(self):
+        readfd, writefd = os.pipe()
+        r, w = os.pipe()
+        os.close(r)
+        splitter = cdparanoia.digest.SplitDigest([3],
+            [[cdparanoia._PipeWriter(w)]])
+        thread = cdparanoia._SplitThread(readfd, splitter)
+        thread.start()
+
+        # the audio is still drained
+        os.write(writefd, 'abcdef')
+        os.close(writefd)
+        thread.join()
+        self.failIf(thread.isAlive())
+
+
+class SplicerTestCase(common.TestCase):
+
+    def testSplice(self):
+        buf = cdparanoia._BufferDigest()
+        splicer = cdparanoia._Splicer([(8, 'XYZ'), (2, 'AB')], [buf])
+        # patches spanning chunks
+        for chunk in ['abc', 'defgh', 'ij', 'kl']:
+            splicer.update(chunk)
+        splicer.close()
+        self.assertEquals(buf.data, 'abABefghXYZl')
+
+
+class ReReadSegmentsTestCase(common.TestCase):
+
+    def testRuns(self):
+        segment = cdparanoia._SEGMENT_FRAMES
+        # segments 1, 2 and 4 differ; the last one is short
+        t = cdparanoia.ReReadSegmentsTask(None, 100, 100 + 5 * segment - 11,
+            False, [1, 2, 3, 4, 5], [1, 0, 0, 4, 0])
+        self.assertEquals(t.segments, 3)
+        self.assertEquals([(r._start, r._stop) for r in t.tasks], [
+            (100 + segment, 100 + 3 * segment - 1),
+            (100 + 4 * segment, 100 + 5 * segment - 11)])
+
+
+class CheckpointTestCase(common.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=u'.morituri.test')
+        # three frames and a partial one
+        self.data = ''.join([chr(i % 256)
+            for i in range(mcommon.BYTES_PER_FRAME * 3 + 100)])
+        os.write(fd, self.data)
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def testResumeAll(self):
+        # the checkpoint holds the whole track, so nothing is read
+        crc = cdparanoia.digest.CRC32Digest()
+        t = cdparanoia.ResumableReadTask(self.path, 3, None, 10, 11, False,
+            digests=[crc])
+        task.SyncRunner(verbose=False).run(t)
+
+        two = self.data[:mcommon.BYTES_PER_FRAME * 2]
+        self.assertEquals(t.reader, None)
+        self.assertEquals(t.resumed, 2)
+        self.assertEquals(crc.checksum, zlib.crc32(two) % 2 ** 32)
+        self.assertEquals(t.sync(), 2)
+        # what is not needed is cut off
+        self.assertEquals(open(self.path, 'rb').read(), two)
+
+    def testClear(self):
+        checkpoint = result.Checkpoint()
+        checkpoint.testpath = self.path
+        checkpoint.testframes = 3
+        checkpoint.copyframes = 1
+
+        cdparanoia.clearCheckpoint(checkpoint)
+        self.failIf(os.path.exists(self.path))
+        self.assertEquals(checkpoint.testpath, None)
+        self.assertEquals(checkpoint.testframes, 0)
+        self.assertEquals(checkpoint.copyframes, 0)
@@ -0,0 +1,240 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_program_cdrom -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import struct
+import sys
+
+from morituri.common import common as mcommon
+from morituri.image import table, toc
+from morituri.program import cdrom
+
+from morituri.test import common
+
+
+class FakeDevice:
+    """
+    I answer the TOC ioctls of a drive with the disc of a .toc file.
+    """
+
+    def __init__(self, name):
+        self.toc = toc.TocFile(os.path.join(os.path.dirname(__file__),
+            name))
+        self.toc.parse()
+        self.calls = 0
+
+    def ioctl(self, fd, request, arg):
+        self.calls += 1
+        tracks = self.toc.table.tracks
+        if request == cdrom._CDROMREADTOCHDR:
+            return struct.pack(cdrom._TOCHDR, 1, len(tracks))
+
+        assert request == cdrom._CDROMREADTOCENTRY
+        number, _, format, _, _ = struct.unpack(cdrom._TOCENTRY, arg)
+        assert format == cdrom._CDROM_LBA
+        if number == cdrom._CDROM_LEADOUT:
+            control, lba = 0, self.toc.table.leadout
+        else:
+            track = tracks[number - 1]
+            control = not track.audio and cdrom._CDROM_DATA_TRACK or 0
+            lba = track.getIndex(1).absolute
+        adr = 1
+        if sys.byteorder == 'little':
+            adrCtrl = control << 4 | adr
+        else:
+            adrCtrl = adr << 4 | control
+        return struct.pack(cdrom._TOCENTRY, number, adrCtrl, format, lba, 0)
+
+
+class ReadTOCTestCase(common.TestCase):
+
+    def _read(self, name):
+        device = FakeDevice(name)
+        t = cdrom.readTOC(os.devnull, ioctl=device.ioctl)
+        return device, t
+
+    def _assertSameIds(self, name):
+        device, t = self._read(name)
+        expected = device.toc.table
+        self.failUnless(t.hasTOC())
+        self.assertEquals(t.leadout, expected.leadout)
+        self.assertEquals(t.getCDDBDiscId(), expected.getCDDBDiscId())
+        self.assertEquals(t.getMusicBrainzDiscId(),
+            expected.getMusicBrainzDiscId())
+        self.assertEquals(t.getAccurateRipIds(), expected.getAccurateRipIds())
+        self.assertEquals(t.getAccurateRipURL(), expected.getAccurateRipURL())
+        return t
+
+    def testAudio(self):
+        t = self._assertSameIds(u'totbl.fast.toc')
+        self.assertEquals(len(t.tracks), 11)
+        self.assertEquals(t.getTrackStart(2), 17750)
+
+    def testEnhanced(self):
+        # an audio session followed by a data session
+        t = self._assertSameIds(u'capital.fast.toc')
+        self.assertEquals(t.getAudioTracks(), 11)
+        self.failUnless(t.hasDataTracks())
+        self.assertEquals(t.getCDDBDiscId(), '8e10130c')
+
+    def testHiddenTrack(self):
+        # a pre-gap before the first track
+        t = self._assertSameIds(u'bloc.toc')
+        self.assertEquals(t.getTrackStart(1), 15220)
+
+    def testCalls(self):
+        # one for the header, one per track and one for the leadout
+        device, t = self._read(u'totbl.fast.toc')
+        self.assertEquals(device.calls, 1 + 11 + 1)
+
+
+class GetFastTocTestCase(common.TestCase):
+
+    def testFallback(self):
+        # without a drive to ask, cdrdao is tried
+        def ReadTOCTask(device):
+            raise ValueError(device)
+
+        self.patch(cdrom.cdrdao, 'ReadTOCTask', ReadTOCTask)
+        self.assertRaises(ValueError, cdrom.getFastToc,
+            '/dev/nonexistent')
+
+
+def _toBCD(value):
+    return value / 10 << 4 | value % 10
+
+
+def _toMSF(frames):
+    return [_toBCD(int(x)) for x in mcommon.framesToMSF(frames).split(':')]
+
+
+def _encodeISRC(isrc):
+    bits = 0
+    for c in isrc[:5]:
+        code = c.isdigit() and int(c) or ord(c) - ord('A') + 17
+        bits = bits << 6 | code
+    bits <<= 2
+    digits = isrc[5:] + '0'
+    return [bits >> 24 & 0xff, bits >> 16 & 0xff, bits >> 8 & 0xff,
+        bits & 0xff] + [int(digits[i:i + 2], 16) for i in range(0, 8, 2)]
+
+
+class FakeDrive:
+    """
+    I answer for the Q sub-channel and CD-Text of a drive with the disc of
+    a .toc file as cdrdao read it.
+    """
+
+    def __init__(self, name, cdtext=''):
+        self.toc = toc.TocFile(os.path.join(os.path.dirname(__file__),
+            name))
+        self.toc.parse()
+        self.cdtext = cdtext
+        self.frames = 0
+
+        self._indexes = []
+        for track in self.toc.table.tracks:
+            for index in track.indexes.values():
+                self._indexes.append((index.absolute, track.number,
+                    index.number, track.isrc))
+        self._indexes.sort()
+        self._ends = set([i[0] - 1 for i in self._indexes])
+
+    def _getQ(self, lba):
+        table = self.toc.table
+        if lba >= table.leadout:
+            position = (cdrom._CDROM_LEADOUT, 1, None)
+            relative = lba - table.leadout
+        else:
+            position = [i[1:] for i in self._indexes if i[0] <= lba][-1]
+            relative = abs(lba - table.getTrackStart(position[0]))
+        number, index, isrc = position
+
+        # a frame without a position can start an index, but cannot be
+        # told apart from one ending the index before
+        if lba % 100 == 42 and isrc and lba not in self._ends:
+            b = [cdrom._Q_ISRC] + _encodeISRC(isrc)
+        elif lba % 100 == 87 and table.catalog and lba not in self._ends:
+            digits = table.catalog + '0'
+            b = [cdrom._Q_CATALOG] + [int(digits[i:i + 2], 16)
+                for i in range(0, 14, 2)]
+        else:
+            if number != cdrom._CDROM_LEADOUT:
+                number = _toBCD(number)
+            b = [cdrom._Q_POSITION, number, _toBCD(index)] \
+                + _toMSF(relative) + [0] + _toMSF(lba + 150)
+
+        return struct.pack('16B', *(b + [0] * (16 - len(b))))
+
+    def readQ(self, lba, count):
+        self.frames += count
+        return [cdrom.SubchannelQ(self._getQ(lba + i))
+            for i in range(count)]
+
+    def readCDText(self):
+        return self.cdtext
+
+
+class ScannerTestCase(common.TestCase):
+
+    def _scan(self, name, cdtext=''):
+        drive = FakeDrive(name, cdtext)
+        fast = table.Table()
+        fast.leadout = drive.toc.table.leadout
+        for track in drive.toc.table.tracks:
+            t = table.Track(track.number, track.audio)
+            t.index(1, absolute=track.getIndex(1).absolute)
+            fast.tracks.append(t)
+
+        scanner = cdrom.Scanner(drive)
+        return drive, scanner, scanner.scan(fast)
+
+    def _assertSameTable(self, name):
+        drive, scanner, t = self._scan(name)
+        expected = drive.toc.table
+        self.assertEquals(t.getAccurateRipURL(), expected.getAccurateRipURL())
+        self.assertEquals(t.catalog, expected.catalog)
+        for track, expectedTrack in zip(t.tracks, expected.tracks):
+            self.assertEquals(
+                dict([(i.number, i.absolute)
+                    for i in track.indexes.values()]),
+                dict([(i.number, i.absolute)
+                    for i in expectedTrack.indexes.values()]))
+            self.assertEquals(track.isrc, expectedTrack.isrc)
+
+        # far from all of the disc is read
+        self.failUnless(drive.frames < expected.leadout / 50, drive.frames)
+        return scanner, t
+
+    def testPregaps(self):
+        scanner, t = self._assertSameTable(u'cure.toc')
+        self.assertEquals(t.tracks[1].getPregap(), 79)
+
+    def testIndexes(self):
+        scanner, t = self._assertSameTable(u'surferrosa.toc')
+        self.assertEquals(t.tracks[10].getIndex(2).absolute, 114627)
+        # the frames starting these have an ISRC and a catalog number
+        self.assertEquals(t.tracks[2].getIndex(0).absolute, 23142)
+        self.assertEquals(t.tracks[2].getIndex(1).absolute, 23187)
+
+    def testHiddenTrack(self):
+        scanner, t = self._assertSameTable(u'bloc.toc')
+        self.assertEquals(t.tracks[0].getPregap(), 15220)
+
+    def testCDText(self):
+        def pack(kind, number, sequence, text):
+            return struct.pack('4B12s2x', kind, number, sequence, 0, text)
+
+        data = pack(0x80, 0, 0, 'Disintegrati') \
+            + pack(0x80, 0, 1, 'on\0Plainsong') \
+            + pack(0x80, 1, 2, '\0Pictures of') \
+            + pack(0x80, 2, 3, ' You\0') \
+            + pack(0x81, 0, 4, 'The Cure\0\t\0\t\0') \
+            + struct.pack('4B12s2x', 0x80, 0, 5, 0x10, 'Autre\0')
+        drive, scanner, t = self._scan(u'cure.toc', data)
+        self.assertEquals(t.cdtext, {'TITLE': u'Disintegration',
+            'PERFORMER': u'The Cure'})
+        self.assertEquals(t.tracks[0].cdtext, {'TITLE': u'Plainsong',
+            'PERFORMER': u'The Cure'})
+        self.assertEquals(t.tracks[1].cdtext['TITLE'], u'Pictures of You')
+        self.assertEquals(t.tracks[2].cdtext, {})
@@ -0,0 +1,114 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_program_paranoia -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import struct
+
+from morituri.common import common as mcommon
+from morituri.extern.task import task
+from morituri.program import cdparanoia, paranoia
+
+from morituri.test import common
+
+
+class SectorRangeTestCase(common.TestCase):
+
+    def testNoOffset(self):
+        self.assertEquals(paranoia.getSectorRange(10, 20, 0), (10, 20, 0))
+
+    def testPositiveOffset(self):
+        # one more sector, skipping the start of the first one
+        self.assertEquals(paranoia.getSectorRange(10, 20, 6),
+            (10, 21, 24))
+        self.assertEquals(paranoia.getSectorRange(10, 20, 588),
+            (11, 21, 0))
+
+    def testNegativeOffset(self):
+        self.assertEquals(paranoia.getSectorRange(10, 20, -6),
+            (9, 20, (588 - 6) * 4))
+        # reading before the disc
+        self.assertEquals(paranoia.getSectorRange(0, 0, -6),
+            (-1, 0, (588 - 6) * 4))
+
+
+class FakeParanoia:
+    """
+    I read sectors of a disc of 20 sectors, each holding its number in
+    every sample, and report the events libcdio-paranoia would.
+    """
+
+    lastSector = 19
+
+    def __init__(self, device=None, paranoia=True):
+        self.device = device
+        self.paranoia = paranoia
+        self._sector = None
+        self.closed = False
+
+    def getLastSector(self):
+        return self.lastSector
+
+    def seek(self, sector):
+        self._sector = sector
+
+    def read(self, callback):
+        sector = self._sector
+        self._sector += 1
+        callback((sector + 1) * mcommon.WORDS_PER_FRAME, 0)
+        if sector == 12:
+            callback(sector * mcommon.WORDS_PER_FRAME + 100, 3)
+        return struct.pack('<i', sector) * mcommon.SAMPLES_PER_FRAME
+
+    def close(self):
+        self.closed = True
+
+
+class ReadTrackTaskTestCase(common.TestCase):
+
+    def setUp(self):
+        self.readers = []
+
+        def create(device=None, paranoia=True):
+            reader = FakeParanoia(device, paranoia)
+            self.readers.append(reader)
+            return reader
+
+        self.patch(paranoia, 'Paranoia', create)
+
+    def _read(self, start, stop, offset=0, overread=False):
+        buf = cdparanoia._BufferDigest()
+        t = cdparanoia.createReadTrackTask(None, None, start, stop,
+            overread, offset=offset, device='/dev/cdrom', digests=[buf],
+            paranoia=False, reader='libcdio')
+        self.failUnless(isinstance(t, paranoia.ReadTrackTask))
+        task.SyncRunner(verbose=False).run(t)
+        return t, buf.data
+
+    def _sectors(self, first, last):
+        return ''.join([struct.pack('<i', s) * mcommon.SAMPLES_PER_FRAME
+            for s in range(first, last + 1)])
+
+    def testRead(self):
+        t, data = self._read(10, 14)
+        self.assertEquals(data, self._sectors(10, 14))
+        self.assertEquals(t.events, {'read': 5, 'correction': 1,
+            'wrote': 5})
+        self.assertEquals(list(t.readCounts), [1] * 5)
+
+        reader, = self.readers
+        self.assertEquals(reader.device, '/dev/cdrom')
+        self.failIf(reader.paranoia)
+        self.failUnless(reader.closed)
+
+    def testOffset(self):
+        t, data = self._read(10, 14, offset=6)
+        self.assertEquals(data, self._sectors(10, 15)[24:24 + 5 * 2352])
+
+    def testDefaultReader(self):
+        t = cdparanoia.createReadTrackTask(None, None, 10, 14, False)
+        self.failUnless(isinstance(t, cdparanoia.ReadTrackTask))
+
+    def testPastLastSector(self):
+        # without overreading, the lead-out is silence
+        t, data = self._read(18, 19, offset=588)
+        self.assertEquals(data, self._sectors(19, 19) + '\0' * 2352)
+        self.assertEquals(t.events['read'], 1)
@@ -0,0 +1,66 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_result_logger -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+from morituri.result import logger, result
+
+from morituri.test import common as tcommon
+
+
+class RereadPlacesTestCase(tcommon.TestCase):
+
+    def testPlaces(self):
+        readCounts = [(1, 14), (2, 100), (3, 1), (4, 13), (2, 50), (9, 2)]
+        self.assertEquals(logger.getRereadPlaces(readCounts),
+            [(114, 128, 4), (178, 180, 9)])
+
+    def testClean(self):
+        self.assertEquals(logger.getRereadPlaces([(1, 3), (2, 1000)]), [])
+
+    def testLog(self):
+        lines = logger.MorituriLogger()._rereadLog(
+            [(2, 75), (5, 10), (2, 100)])
+        self.assertEquals(lines, [
+            "    Frames read more than twice: 10",
+            "      00:01:00 - 00:01:10: up to 5 reads",
+        ])
+
+
+class TrackLogTestCase(tcommon.TestCase):
+
+    def testStrategy(self):
+        trackResult = result.TrackResult()
+        trackResult.number = 1
+        trackResult.filename = u'track.flac'
+        trackResult.testcrc = trackResult.copycrc = 0x12345678
+        trackResult.strategy = 'paranoia'
+        trackResult.burstduration = 12.04
+        trackResult.paranoiaduration = 95.0
+
+        lines = logger.MorituriLogger().trackLog(trackResult)
+        self.failUnless("    Read strategy: paranoia" in lines)
+        self.failUnless("    Read time: burst 12.0 s, paranoia 95.0 s"
+            in lines)
+
+    def testReread(self):
+        # the CRCs of the reads are logged as they were read
+        trackResult = result.TrackResult()
+        trackResult.number = 1
+        trackResult.filename = u'track.flac'
+        trackResult.testcrc = 0x12345678
+        trackResult.copycrc = 0x87654321
+        trackResult.rereadSegments = 2
+        trackResult.rereadcrc = 0x12345678
+
+        lines = logger.MorituriLogger().trackLog(trackResult)
+        self.failUnless("    Test CRC: 12345678" in lines)
+        self.failUnless("    Copy CRC: 87654321" in lines)
+        self.failUnless("    Re-read 2 segments, CRC: 12345678" in lines)
+        self.failUnless("    Status: Copy OK, after re-reading" in lines)
+
+    def testNoStrategy(self):
+        trackResult = result.TrackResult()
+        trackResult.number = 1
+        trackResult.filename = u'track.flac'
+
+        lines = logger.MorituriLogger().trackLog(trackResult)
+        self.failIf([l for l in lines if 'strategy' in l])